@@ -0,0 +1,59 @@
+"""
+Benchmark of the calendar features over multi-year hourly ranges, compared with the
+former row-wise implementation (Python lambdas per row and one merge per feature).
+
+Usage:
+    python -m bikesharing.benchmarks.calendar [n_years ...]
+"""
+import sys
+import time
+
+import holidays
+import numpy as np
+import pandas as pd
+
+from bikesharing.ml_logic.calendar_features import compute_calendar_features
+
+
+def get_rowwise_calendar_features(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+        reference implementation with the former row-wise approach
+    '''
+    bay_holidays = holidays.CountryHoliday('DE', prov='BY')
+    dates = df['rent_date_hour'].dt.date
+
+    holiday_df = df[['rent_date_hour']].copy()
+    holiday_df['is_holiday'] = dates.apply(lambda x: 1 if x in bay_holidays else 0)
+    weekend_df = df[['rent_date_hour']].copy()
+    weekend_df['is_weekend'] = dates.apply(lambda x: 1 if x.weekday() >= 5 else 0)
+
+    return df.merge(holiday_df, on='rent_date_hour', how='inner').merge(weekend_df, on='rent_date_hour', how='inner')
+
+
+def run(years: list) -> pd.DataFrame:
+    results = []
+    for n_years in years:
+        df = pd.DataFrame({'rent_date_hour': pd.date_range('2019-01-01', periods=n_years * 365 * 24, freq='H')})
+
+        start = time.perf_counter()
+        calendar_df = compute_calendar_features(df['rent_date_hour'])
+        vectorized_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rowwise_df = get_rowwise_calendar_features(df)
+        rowwise_seconds = time.perf_counter() - start
+
+        np.testing.assert_array_equal(calendar_df['is_holiday'].to_numpy(), rowwise_df['is_holiday'].to_numpy())
+        np.testing.assert_array_equal(calendar_df['is_weekend'].to_numpy(), rowwise_df['is_weekend'].to_numpy())
+
+        results.append({'n_years': n_years, 'n_rows': len(df), 'vectorized_seconds': vectorized_seconds,
+                        'rowwise_seconds': rowwise_seconds})
+        print(f'{n_years:>3} years ({len(df):>9,} hours): vectorized {vectorized_seconds * 1000:8.1f} ms, '
+              f'row-wise {rowwise_seconds * 1000:9.1f} ms')
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    years = [int(arg) for arg in sys.argv[1:]] or [1, 4, 10, 40]
+    run(years)
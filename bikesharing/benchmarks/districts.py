@@ -0,0 +1,38 @@
+"""
+Benchmark for the district assignment of rental rows.
+
+Usage:
+    python -m bikesharing.benchmarks.districts [n_rows ...]
+"""
+import sys
+import time
+
+import pandas as pd
+
+from bikesharing.benchmarks.synthetic import generate_rentals, get_benchmark_polygons
+from bikesharing.ml_logic.encoders import get_district_from_polygons
+
+
+def run(sizes: list) -> pd.DataFrame:
+    polygons = get_benchmark_polygons()
+
+    # Build the spatial index once, as a long running process would
+    get_district_from_polygons(generate_rentals(10, polygons), polygons)
+
+    results = []
+    for n_rows in sizes:
+        rental_df = generate_rentals(n_rows, polygons)
+
+        start = time.perf_counter()
+        get_district_from_polygons(rental_df, polygons)
+        seconds = time.perf_counter() - start
+
+        results.append({'n_rows': n_rows, 'seconds': seconds, 'rows_per_second': n_rows / seconds})
+        print(f'{n_rows:>12,} rows: {seconds:8.2f} s ({n_rows / seconds:,.0f} rows/s)')
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    sizes = [int(float(arg)) for arg in sys.argv[1:]] or [10**5, 10**6, 10**7, 10**8]
+    run(sizes)
@@ -0,0 +1,85 @@
+"""
+Import-time budget of the prediction entry point, guarding the cold start of prediction workers.
+
+Imports the module in fresh interpreters, fails if the fastest import exceeds the budget or
+if any of the heavy training dependencies got imported with it.
+
+Usage:
+    python -m bikesharing.benchmarks.import_time [--module bikesharing.interface.predict] [--budget 1.5]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+
+# Only needed to preprocess and train, never by the predictions
+FORBIDDEN_MODULES = ['google.cloud.bigquery', 'geopandas', 'shapely', 'sklearn', 'xgboost', 'holidays',
+                     'pyarrow', 'requests', 'duckdb', 'joblib']
+
+MEASURE_IMPORT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def measure_import(module: str) -> dict:
+    '''
+        imports the module in a fresh interpreter and returns the duration and the loaded modules
+    '''
+    result = subprocess.run([sys.executable, '-c', MEASURE_IMPORT.format(module=module)],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def get_slowest_imports(module: str, n: int = 10) -> list:
+    '''
+        returns the n slowest imports (cumulative microseconds, module) of python -X importtime
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+
+    return sorted(imports, reverse=True)[:n]
+
+
+def run(module: str = 'bikesharing.interface.predict', budget: float = 1.5, repeat: int = 5) -> bool:
+    # The fastest of several runs, the first one also pays for cold file system caches
+    measurements = [measure_import(module) for _ in range(repeat)]
+    seconds = min(measurement['seconds'] for measurement in measurements)
+    loaded = set(measurements[0]['modules'])
+    forbidden = [name for name in FORBIDDEN_MODULES if name in loaded]
+
+    print(f'import {module}: {seconds:.3f} s (budget {budget:.3f} s)')
+    for cumulative, name in get_slowest_imports(module):
+        print(f'{cumulative / 1e6:10.3f} s  {name}')
+
+    ok = True
+    if seconds > budget:
+        print(f'❌ Import takes {seconds:.3f} s, over the budget of {budget:.3f} s')
+        ok = False
+    if forbidden:
+        print(f'❌ Importing {module} loads {forbidden}')
+        ok = False
+    if ok:
+        print(f'✅ Import within budget')
+
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the import time of the prediction entry point.')
+    parser.add_argument('--module', default='bikesharing.interface.predict')
+    parser.add_argument('--budget', type=float, default=1.5, help='maximal import time in seconds')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args.module, args.budget, args.repeat) else 1)
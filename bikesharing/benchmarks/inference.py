@@ -0,0 +1,81 @@
+"""
+Parity check and throughput benchmark of the batched inference engines.
+
+Usage:
+    python -m bikesharing.benchmarks.inference [n_districts] [n_rows ...]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from xgboost import XGBRegressor
+
+from bikesharing.ml_logic.inference import CompiledForest, predict_districts
+
+
+FEATURES = ['temperature_2m', 'relativehumidity_2m', 'apparent_temperature',
+       'windspeed_10m', 'precipitation', 'hour_sin', 'hour_cos', 'month_sin',
+       'month_cos', 'day_sin', 'day_cos','is_holiday', 'is_weekend']
+
+
+def get_benchmark_models(n_districts: int = 34, n_train_rows: int = 35040, seed: int = 42) -> dict:
+    '''
+        returns n_districts models trained on random features with varying hyperparameters
+    '''
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.random((n_train_rows, len(FEATURES))), columns=FEATURES)
+    # Some missing values, to check the default directions
+    X.iloc[rng.integers(0, n_train_rows, n_train_rows // 100), 0] = np.nan
+
+    models = {}
+    for i in range(n_districts):
+        y = 50 * X['hour_sin'].fillna(0) + 10 * X['temperature_2m'].fillna(0.5) + rng.normal(0, 5, n_train_rows)
+        model = XGBRegressor(objective='reg:squarederror', n_estimators=[10, 100][i % 2],
+                             max_depth=[5, 7, 10][i % 3], tree_method=['hist', 'approx'][i % 2])
+        models[f'District {i}'] = model.fit(X, y)
+
+    return models
+
+
+def check_parity(models: dict, X: pd.DataFrame) -> float:
+    '''
+        asserts that the compiled forest predicts like XGBRegressor.predict and
+        returns the maximal absolute difference
+    '''
+    expected = predict_districts(models, X, engine='xgboost')
+    actual = CompiledForest(models).predict(X)
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-3)
+
+    return float(np.abs(actual - expected).max())
+
+
+def run(n_districts: int, sizes: list) -> pd.DataFrame:
+    models = get_benchmark_models(n_districts)
+    rng = np.random.default_rng(0)
+
+    results = []
+    for n_rows in sizes:
+        X = pd.DataFrame(rng.random((n_rows, len(FEATURES))), columns=FEATURES)
+        X.iloc[::50, 0] = np.nan
+        max_difference = check_parity(models, X)
+
+        for engine in ['xgboost', 'compiled']:
+            # Warm up (compiles the forest once)
+            predict_districts(models, X, engine=engine)
+
+            start = time.perf_counter()
+            predict_districts(models, X, engine=engine)
+            seconds = time.perf_counter() - start
+
+            results.append({'engine': engine, 'n_rows': n_rows, 'seconds': seconds,
+                            'rows_per_second': n_rows / seconds, 'max_difference': max_difference})
+            print(f'{engine:>8}: {n_rows:>8,} rows x {n_districts} districts in {seconds * 1000:8.2f} ms')
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    n_districts = int(sys.argv[1]) if len(sys.argv) > 1 else 34
+    sizes = [int(float(arg)) for arg in sys.argv[2:]] or [24, 24 * 14, 24 * 365]
+    run(n_districts, sizes)
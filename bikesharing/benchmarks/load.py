@@ -0,0 +1,95 @@
+"""
+Load generator for the prediction service: measures the p50/p99 latency and the requests
+per second of POST /predict at increasing concurrency.
+
+Start the service first (make run_api), then:
+    python -m bikesharing.benchmarks.load [--url http://localhost:8000] [--duration 10] [concurrency ...]
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+from bikesharing.benchmarks.synthetic import generate_weather
+
+
+def get_request_bodies(n_days: int = 365, seed: int = 42) -> list:
+    '''
+        returns the hourly weather of n_days synthetic days, as POST /predict bodies
+    '''
+    weather_df = generate_weather('2023-01-01', str(pd.Timestamp('2023-01-01') + pd.Timedelta(days=n_days) - pd.Timedelta(hours=1)),
+                                  seed=seed)
+    weather_df['time'] = weather_df['time'].dt.strftime('%Y-%m-%dT%H:%M')
+
+    return [day_df.to_dict(orient='list') for _, day_df in weather_df.groupby(weather_df.index // 24)]
+
+
+def run_concurrency(url: str, bodies: list, concurrency: int, duration: float) -> dict:
+    '''
+        sends requests from `concurrency` clients for `duration` seconds and returns the latency statistics
+    '''
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(client_id: int) -> None:
+        nonlocal errors
+        i = client_id
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = session.post(f'{url}/predict', json=bodies[i % len(bodies)], timeout=30)
+                    ok = response.status_code == 200
+                except requests.RequestException:
+                    ok = False
+                latency = time.perf_counter() - start
+                with lock:
+                    if ok:
+                        latencies.append(latency)
+                    else:
+                        errors += 1
+                i += concurrency
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    result = {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / seconds,
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else None,
+        'max_ms': float(latencies_ms.max()) if len(latencies) else None
+    }
+    print(f"{concurrency:>5} clients: {result['rps']:8.1f} req/s, p50 {result['p50_ms'] or 0:8.1f} ms, "
+          f"p99 {result['p99_ms'] or 0:8.1f} ms, {errors} errors")
+
+    return result
+
+
+def run(url: str, concurrencies: list, duration: float = 10.0) -> pd.DataFrame:
+    bodies = get_request_bodies()
+
+    # Warm up the connections and the service
+    requests.post(f'{url}/predict', json=bodies[0], timeout=30).raise_for_status()
+
+    return pd.DataFrame([run_concurrency(url, bodies, concurrency, duration) for concurrency in concurrencies])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the prediction service.')
+    parser.add_argument('concurrency', nargs='*', type=int, default=[1, 4, 16, 64])
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    args = parser.parse_args()
+
+    run(args.url, args.concurrency, args.duration)
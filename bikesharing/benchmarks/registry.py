@@ -0,0 +1,84 @@
+"""
+Benchmark of the model serialization formats of the registry: publish time, size on disk
+and cold-start time of a worker loading all district models.
+
+Every measurement runs in a fresh process with its own temporary LOCAL_REGISTRY_PATH.
+
+Usage:
+    python -m bikesharing.benchmarks.registry [n_districts]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+
+FORMATS = ['joblib', 'ubj', 'packed']
+
+
+def _publish(model_format: str, n_districts: int) -> dict:
+    from bikesharing.benchmarks.inference import get_benchmark_models
+    from bikesharing.ml_logic.registry import publish_models, MODEL_DIRECTORY
+
+    models = get_benchmark_models(n_districts)
+
+    start = time.perf_counter()
+    publish_models(models, model_format=model_format)
+    seconds = time.perf_counter() - start
+
+    size = sum(entry.stat().st_size for entry in os.scandir(MODEL_DIRECTORY) if entry.is_file())
+    return {'publish_seconds': seconds, 'size_mb': size / 1e6}
+
+
+def _load() -> dict:
+    start = time.perf_counter()
+    from bikesharing.ml_logic.registry import ModelPool
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pool = ModelPool()
+    pool.warm()
+    load_seconds = time.perf_counter() - start
+
+    return {'import_seconds': import_seconds, 'load_seconds': load_seconds, 'n_models': len(pool._models)}
+
+
+def _run_in_subprocess(args: list, registry_path: str) -> dict:
+    env = dict(os.environ, LOCAL_REGISTRY_PATH=registry_path)
+    output = subprocess.run([sys.executable, '-m', 'bikesharing.benchmarks.registry', *args],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    # The result is the last line, the registry prints progress before
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(n_districts: int = 34) -> pd.DataFrame:
+    results = []
+    for model_format in FORMATS:
+        with tempfile.TemporaryDirectory() as registry_path:
+            result = {'format': model_format}
+            result.update(_run_in_subprocess(['publish', model_format, str(n_districts)], registry_path))
+
+            # The worker cold start includes the interpreter and the imports
+            start = time.perf_counter()
+            result.update(_run_in_subprocess(['load'], registry_path))
+            result['cold_start_seconds'] = time.perf_counter() - start
+
+        results.append(result)
+        print(f"{model_format:>7}: {result['size_mb']:7.2f} MB, publish {result['publish_seconds']:6.2f} s, "
+              f"load {result['n_models']} models {result['load_seconds'] * 1000:8.1f} ms, "
+              f"cold start {result['cold_start_seconds']:6.2f} s")
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'publish':
+        print(json.dumps(_publish(sys.argv[2], int(sys.argv[3]))))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'load':
+        print(json.dumps(_load()))
+    else:
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else 34)
@@ -0,0 +1,182 @@
+"""
+Times and memory-profiles every stage of the pipeline on synthetic data of increasing size
+and writes the results as JSON, so that runs can be compared across commits.
+
+Usage:
+    python -m bikesharing.benchmarks.suite [--output results.json] [--no-memory] [n_rows ...]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bikesharing.benchmarks.synthetic import generate_rentals, generate_weather, get_benchmark_polygons
+from bikesharing.ml_logic.encoders import get_district_from_polygons, encode_district_label
+from bikesharing.ml_logic.feature_engineering import add_calendar_features
+from bikesharing.ml_logic.feature_pipeline import FeaturePipeline
+from bikesharing.ml_logic.inference import predict_districts
+from bikesharing.ml_logic.preprocessor import count_rentals_by_hour, group_rental_data_by_hour, merge_weather_data, \
+    preprocess_features
+from bikesharing.ml_logic.training import train_district_models
+from bikesharing.params import *
+
+
+FEATURES = ['temperature_2m', 'relativehumidity_2m', 'apparent_temperature',
+       'windspeed_10m', 'precipitation', 'hour_sin', 'hour_cos', 'month_sin',
+       'month_cos', 'day_sin', 'day_cos','is_holiday', 'is_weekend']
+
+# The one-hot encoding allocates a float per district and row, larger inputs would not fit in memory
+MAX_ONE_HOT_ROWS = 10**7
+
+TRAIN_PARAMS = {'n_estimators': 100, 'max_depth': 6, 'learning_rate': 0.1}
+
+
+def _get_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+def _get_git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(results: list, stage: str, n_rows: int, func, *args, profile_memory: bool = True, **kwargs):
+    """
+    Runs func(*args, **kwargs), appends its duration and memory usage to results and returns its result.
+
+    The peak memory is the largest amount allocated by the stage itself (tracemalloc, which also
+    tracks NumPy and pandas buffers), the peak RSS is the high-water mark of the whole process.
+    """
+    if profile_memory:
+        tracemalloc.start()
+
+    cpu_start, start = time.process_time(), time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+
+    peak_memory_mb = None
+    if profile_memory:
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+        tracemalloc.stop()
+
+    results.append({
+        'stage': stage,
+        'n_rows': n_rows,
+        'rows_out': len(result) if hasattr(result, '__len__') else None,
+        'seconds': seconds,
+        'cpu_seconds': cpu_seconds,
+        'rows_per_second': n_rows / seconds if seconds > 0 else None,
+        'peak_memory_mb': peak_memory_mb,
+        'peak_rss_mb': _get_peak_rss_mb()
+    })
+    print(f"{stage:>28} {n_rows:>12,} rows: {seconds:8.2f} s"
+          + (f", {peak_memory_mb:10,.1f} MB" if peak_memory_mb is not None else ""))
+
+    return result
+
+
+def run_size(n_rows: int, polygons: dict, weather_df: pd.DataFrame, profile_memory: bool = True,
+             max_one_hot_rows: int = MAX_ONE_HOT_ROWS, n_workers: int = TRAIN_N_WORKERS) -> list:
+    '''
+        runs every stage of the pipeline on n_rows synthetic rentals and returns the measurements
+    '''
+    results = []
+    rental_df = generate_rentals(n_rows, polygons)
+
+    measure(results, 'get_district_from_polygons', n_rows, get_district_from_polygons,
+            rental_df, polygons, profile_memory=profile_memory)
+
+    rental_by_hour_df = measure(results, 'count_rentals_by_hour', n_rows, count_rentals_by_hour,
+                                rental_df, polygons, profile_memory=profile_memory)
+    districts = [column for column in rental_by_hour_df.columns if column != 'rent_date_hour']
+
+    # The one-hot aggregation it replaces, for comparison
+    if n_rows > max_one_hot_rows:
+        print(f"{'encode_district_label':>28} {n_rows:>12,} rows: skipped (more than {max_one_hot_rows:,} rows)")
+    else:
+        encoded_df = measure(results, 'encode_district_label', n_rows, encode_district_label,
+                             rental_df, polygons, profile_memory=profile_memory)
+        measure(results, 'group_rental_data_by_hour', n_rows, group_rental_data_by_hour,
+                encoded_df, profile_memory=profile_memory)
+        del encoded_df
+    del rental_df
+
+    merged_df = merge_weather_data(rental_by_hour_df, weather_df)
+    merged_df = measure(results, 'add_calendar_features', len(merged_df), add_calendar_features,
+                        merged_df, profile_memory=profile_memory)
+
+    measure(results, 'preprocess_features', len(merged_df), preprocess_features,
+            merged_df.copy(), profile_memory=profile_memory)
+    feature_pipeline = measure(results, 'FeaturePipeline.fit', len(merged_df), FeaturePipeline.fit,
+                               merged_df, FEATURES, profile_memory=profile_memory)
+    X = measure(results, 'FeaturePipeline.transform', len(merged_df), feature_pipeline.transform_frame,
+                merged_df, profile_memory=profile_memory)
+
+    models, _ = measure(results, 'train_district_models', len(X), train_district_models,
+                        X, merged_df[districts], lambda district: TRAIN_PARAMS, n_workers,
+                        profile_memory=profile_memory)
+
+    # One day of hourly forecasts, as predict() gets it
+    X_day = X.iloc[:24]
+    for engine in ['xgboost', 'compiled']:
+        measure(results, f'predict_districts[{engine}]', len(X_day), predict_districts,
+                models, X_day, engine, profile_memory=profile_memory)
+
+    return results
+
+
+def run(sizes: list, output: str = None, profile_memory: bool = True,
+        max_one_hot_rows: int = MAX_ONE_HOT_ROWS) -> pd.DataFrame:
+    polygons = get_benchmark_polygons()
+    weather_df = generate_weather()
+
+    results = []
+    for n_rows in sizes:
+        results += run_size(n_rows, polygons, weather_df, profile_memory, max_one_hot_rows)
+
+    if output is None:
+        output = os.path.join(LOCAL_DATA_PATH, 'benchmarks', f"suite_{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    with open(output, 'w') as file:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': _get_git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'profile_memory': profile_memory,
+            'results': results
+        }, file, indent=2)
+
+    print(f"✅ Benchmark results saved to {output}")
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage on synthetic MVG data.')
+    parser.add_argument('sizes', nargs='*', type=lambda arg: int(float(arg)), default=[10**4, 10**5, 10**6, 10**7])
+    parser.add_argument('--output', default=None, help='path of the JSON results')
+    parser.add_argument('--no-memory', dest='profile_memory', action='store_false',
+                        help='skip tracemalloc, whose bookkeeping slows down allocation-heavy stages')
+    parser.add_argument('--max-one-hot-rows', type=lambda arg: int(float(arg)), default=MAX_ONE_HOT_ROWS)
+    args = parser.parse_args()
+
+    run(args.sizes, args.output, args.profile_memory, args.max_one_hot_rows)
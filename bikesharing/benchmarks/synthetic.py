@@ -0,0 +1,163 @@
+"""
+Synthetic MVG rentals and Open-Meteo weather, so that every pipeline stage can be run
+and benchmarked without BigQuery or network access.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import Polygon
+
+
+# Bounding box of Munich
+MIN_LON, MAX_LON = 11.36, 11.72
+MIN_LAT, MAX_LAT = 48.06, 48.25
+
+# Relative demand per hour of the day (commuting peaks in the morning and the late afternoon)
+HOURLY_PROFILE = np.array([0.15, 0.08, 0.05, 0.04, 0.05, 0.2, 0.6, 1.4, 2.0, 1.2, 0.9, 1.0,
+                           1.2, 1.2, 1.1, 1.3, 1.7, 2.1, 1.9, 1.4, 1.0, 0.7, 0.45, 0.3])
+
+
+def get_grid_polygons(n_lon: int = 6, n_lat: int = 6) -> dict:
+    '''
+        returns a grid of rectangular districts covering Munich, used when the
+        real district polygons are not available
+    '''
+    lon_edges = np.linspace(MIN_LON, MAX_LON, n_lon + 1)
+    lat_edges = np.linspace(MIN_LAT, MAX_LAT, n_lat + 1)
+
+    polygons = {}
+    for i in range(n_lon):
+        for j in range(n_lat):
+            polygons[f'District {i}-{j}'] = Polygon([(lon_edges[i], lat_edges[j]), (lon_edges[i + 1], lat_edges[j]),
+                                                     (lon_edges[i + 1], lat_edges[j + 1]), (lon_edges[i], lat_edges[j + 1])])
+    return polygons
+
+
+def get_benchmark_polygons() -> dict:
+    '''
+        returns the Munich district polygons, or a grid of districts if they are not available
+    '''
+    from bikesharing.ml_logic.data import get_polygons
+
+    try:
+        return get_polygons()
+    except FileNotFoundError:
+        return get_grid_polygons()
+
+
+def generate_stations(polygons: dict, n_stations: int = 5000, seed: int = 42) -> pd.DataFrame:
+    """
+    Places stations uniformly within the district polygons, more in the larger districts.
+
+    Returns:
+        pd.DataFrame: The columns STARTLAT, STARTLON and weight (the popularity of the station).
+    """
+    rng = np.random.default_rng(seed)
+    geometries = np.array(list(polygons.values()))
+    areas = shapely.area(geometries)
+    stations_per_district = rng.multinomial(n_stations, areas / areas.sum())
+
+    lons, lats = [], []
+    for geometry, n in zip(geometries, stations_per_district):
+        min_lon, min_lat, max_lon, max_lat = geometry.bounds
+        shapely.prepare(geometry)
+        found_lon, found_lat = np.empty(0), np.empty(0)
+        # Rejection sampling within the bounding box
+        while len(found_lon) < n:
+            lon = rng.uniform(min_lon, max_lon, 4 * n + 16)
+            lat = rng.uniform(min_lat, max_lat, 4 * n + 16)
+            inside = shapely.contains_xy(geometry, lon, lat)
+            found_lon, found_lat = np.concatenate([found_lon, lon[inside]]), np.concatenate([found_lat, lat[inside]])
+        lons.append(found_lon[:n])
+        lats.append(found_lat[:n])
+
+    return pd.DataFrame({
+        # Rounded like the coordinates of the MVG data
+        'STARTLAT': np.concatenate(lats).round(6),
+        'STARTLON': np.concatenate(lons).round(6),
+        # A few stations are much busier than most (Zipf-like popularity)
+        'weight': rng.pareto(1.5, n_stations) + 0.1
+    })
+
+
+def get_hourly_demand(start: str = '2019-01-01', end: str = '2022-12-31 23:00') -> pd.Series:
+    '''
+        returns the relative demand of every hour: daily profile, weekends and seasons
+    '''
+    hours = pd.date_range(start, end, freq='H')
+    demand = HOURLY_PROFILE[hours.hour]
+    demand = np.where(hours.weekday >= 5, 0.7 * np.roll(HOURLY_PROFILE, -2)[hours.hour], demand)
+    demand = demand * (1.0 + 0.6 * np.sin(2 * np.pi * (hours.dayofyear - 105) / 365))
+
+    return pd.Series(demand, index=hours)
+
+
+def generate_rentals(n_rows: int,
+                     polygons: dict = None,
+                     start: str = '2019-01-01',
+                     end: str = '2022-12-31 23:00',
+                     n_stations: int = 5000,
+                     duplicate_ratio: float = 0.01,
+                     seed: int = 42) -> pd.DataFrame:
+    """
+    Generates rentals with the columns STARTTIME, STARTLAT and STARTLON of the raw MVG data.
+
+    Args:
+        n_rows (int): The number of rentals (10^4 to 10^8).
+        polygons (dict): The district polygons, defaults to get_benchmark_polygons().
+        start (str): The first hour.
+        end (str): The last hour.
+        n_stations (int): The number of distinct start locations.
+        duplicate_ratio (float): The share of duplicated rows, as found in the raw data.
+        seed (int): The random seed.
+
+    Returns:
+        pd.DataFrame: The rentals, ordered by STARTTIME.
+    """
+    rng = np.random.default_rng(seed)
+    stations = generate_stations(polygons if polygons is not None else get_benchmark_polygons(), n_stations, seed)
+    demand = get_hourly_demand(start, end)
+
+    n_unique = n_rows - int(n_rows * duplicate_ratio)
+    hours = np.sort(rng.choice(len(demand), n_unique, p=demand.to_numpy() / demand.sum()))
+    seconds = rng.integers(0, 3600, n_unique)
+    station = rng.choice(n_stations, n_unique, p=stations['weight'].to_numpy() / stations['weight'].sum())
+
+    rental_df = pd.DataFrame({
+        'STARTTIME': demand.index.to_numpy()[hours] + seconds.astype('timedelta64[s]'),
+        'STARTLAT': stations['STARTLAT'].to_numpy()[station],
+        'STARTLON': stations['STARTLON'].to_numpy()[station]
+    })
+
+    if n_rows > n_unique:
+        duplicates = rental_df.iloc[rng.integers(0, n_unique, n_rows - n_unique)]
+        rental_df = pd.concat([rental_df, duplicates]).sort_values('STARTTIME', kind='stable')
+
+    return rental_df.reset_index(drop=True)
+
+
+def generate_weather(start: str = '2019-01-01', end: str = '2022-12-31 23:00', seed: int = 42) -> pd.DataFrame:
+    """
+    Generates hourly weather like the Open-Meteo archive API returns it (with 'time' as datetime64).
+    """
+    rng = np.random.default_rng(seed)
+    time = pd.date_range(start, end, freq='H')
+    n = len(time)
+
+    seasonal = -np.cos(2 * np.pi * (time.dayofyear - 15) / 365)
+    diurnal = -np.cos(2 * np.pi * (time.hour - 3) / 24)
+    temperature = 9 + 10 * seasonal + 4 * diurnal + np.cumsum(rng.normal(0, 0.3, n)) * 0.1
+    windspeed = np.abs(rng.gamma(2.0, 4.0, n))
+    # Rain comes in spells
+    raining = rng.random(n) < 0.08
+    raining = raining | np.roll(raining, 1) | np.roll(raining, 2)
+    precipitation = np.where(raining, rng.exponential(0.8, n), 0.0).round(1)
+
+    return pd.DataFrame({
+        'time': time,
+        'temperature_2m': temperature.round(1),
+        'relativehumidity_2m': np.clip(75 - 15 * diurnal + 20 * raining + rng.normal(0, 5, n), 10, 100).round(),
+        'apparent_temperature': (temperature - 0.15 * windspeed).round(1),
+        'windspeed_10m': windspeed.round(1),
+        'precipitation': precipitation
+    })
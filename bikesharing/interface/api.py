@@ -0,0 +1,112 @@
+"""
+ASGI prediction service.
+
+The models and the feature pipeline are loaded at startup. Concurrent requests are coalesced
+by a MicroBatcher into one feature matrix and one inference pass per district, which runs on
+an inference thread pool, off the event loop.
+
+Usage:
+    uvicorn bikesharing.interface.api:app --port 8000
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import List, Optional
+
+import pandas as pd
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from bikesharing.params import *
+from bikesharing.interface.predict import get_weather_frame, predict_batch
+from bikesharing.ml_logic.batching import MicroBatcher
+from bikesharing.ml_logic.instrumentation import get_prometheus_metrics, span
+from bikesharing.ml_logic.registry import get_model_pool, load_feature_pipeline
+
+
+class HourlyWeather(BaseModel):
+    """
+    The hourly weather to predict, in the format of the Open-Meteo API.
+    """
+    time: List[str]
+    temperature_2m: List[float]
+    relativehumidity_2m: List[float]
+    apparent_temperature: List[float]
+    windspeed_10m: List[float]
+    precipitation: List[float]
+
+
+app = FastAPI(title='Bike Sharing Demand')
+
+executor = ThreadPoolExecutor(max_workers=PREDICT_N_THREADS, thread_name_prefix='inference')
+batcher = MicroBatcher(predict_batch, max_batch_size=PREDICT_MAX_BATCH_SIZE,
+                       max_wait=PREDICT_BATCH_WINDOW_MS / 1000, executor=executor,
+                       max_concurrency=PREDICT_N_THREADS)
+
+
+@app.on_event('startup')
+async def startup() -> None:
+    loop = asyncio.get_running_loop()
+
+    # Load everything before the first request, off the event loop
+    def preload():
+        model_pool = get_model_pool()
+        model_pool.warm()
+        if not model_pool.get_districts():
+            raise FileNotFoundError(f"No models in {LOCAL_REGISTRY_PATH}, run train() first")
+        if load_feature_pipeline() is None:
+            raise FileNotFoundError(f"No feature pipeline in {LOCAL_REGISTRY_PATH}, run train() first")
+
+        # One prediction builds the remaining lazy state (e. g. the compiled forest)
+        hours = pd.date_range(date.today(), periods=24, freq='H')
+        predict_batch([pd.DataFrame({'rent_date_hour': hours, 'temperature_2m': 10.0, 'relativehumidity_2m': 70.0,
+                                     'apparent_temperature': 10.0, 'windspeed_10m': 5.0, 'precipitation': 0.0})])
+
+    with span('api.startup'):
+        await loop.run_in_executor(executor, preload)
+
+    batcher.start()
+
+
+@app.on_event('shutdown')
+async def shutdown() -> None:
+    await batcher.stop()
+    executor.shutdown(wait=False)
+
+
+@app.get('/health')
+async def health() -> dict:
+    return {'status': 'ok'}
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics() -> str:
+    return get_prometheus_metrics()
+
+
+@app.post('/predict')
+async def predict_weather(weather: HourlyWeather) -> dict:
+    """
+    Predicts the hourly rentals per district for the given hourly weather.
+    """
+    try:
+        pred_df = get_weather_frame(weather.dict())
+    except (ValueError, TypeError) as error:
+        raise HTTPException(status_code=422, detail=str(error))
+
+    return await batcher.submit(pred_df)
+
+
+@app.get('/predict')
+async def predict_day(day: date, latitude: Optional[float] = None, longitude: Optional[float] = None) -> dict:
+    """
+    Predicts the hourly rentals per district of a day within the forecast range (about two weeks).
+    """
+    from bikesharing.ml_logic.forecast import get_forecast_provider
+
+    # The forecast provider blocks on the upstream request (shared by concurrent callers of the same day)
+    loop = asyncio.get_running_loop()
+    weather_df = await loop.run_in_executor(None, get_forecast_provider().get_forecast, day, latitude, longitude)
+
+    return await batcher.submit(get_weather_frame(weather_df))
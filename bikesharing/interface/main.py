@@ -1,138 +1,288 @@
 import pandas as pd
 
-from bikesharing.ml_logic.data import get_raw_data, get_weather_data, get_polygons
-from bikesharing.ml_logic.encoders import encode_district_label, encode_temporal_features
-from bikesharing.ml_logic.preprocessor import group_rental_data_by_hour, preprocess_features
-from bikesharing.ml_logic.feature_engineering import is_holiday, is_weekend ,feature_selection
-from bikesharing.ml_logic.registry import load_model, save_model
+from bikesharing.ml_logic.data import get_raw_data, get_weather_data, get_polygons, get_new_raw_data, \
+    get_new_weather_data
+from bikesharing.ml_logic.preprocessor import drop_duplicate_rentals, count_rentals_by_hour, \
+    count_streamed_rentals_by_hour, merge_weather_data, fit_feature_pipeline, build_processed_data, \
+    preprocess_partitions
+from bikesharing.ml_logic.warehouse import build_hourly_location_query, build_rental_query, get_sql_backend
+from bikesharing.ml_logic.feature_engineering import add_calendar_features
+from bikesharing.ml_logic.feature_pipeline import FeaturePipeline
+from bikesharing.ml_logic.processed_store import get_store_path, get_last_processed_hour, append_processed_data, \
+    load_processed_data, save_store_pipeline, load_store_pipeline
+from bikesharing.ml_logic.stage_cache import Stage, list_stages, evict_stages
+from bikesharing.ml_logic.registry import publish_models, garbage_collect, get_model_pool, load_feature_pipeline, \
+    save_hyperparams, get_latest_models, get_run_metadata
 from bikesharing.params import *
-from bikesharing.ml_logic.model import get_model_params
-from xgboost import XGBRegressor
-
+from bikesharing.ml_logic.model import get_model_params, invalidate_tuned_params
+from bikesharing.ml_logic.tuning import tune_districts
+from bikesharing.ml_logic.training import train_district_models, update_district_models
+from bikesharing.ml_logic.backtest import backtest
+# Kept importable from here, the prediction workers import the lean bikesharing.interface.predict
+from bikesharing.interface.predict import predict
+from bikesharing.ml_logic.instrumentation import span
+
+from datetime import date
 from pathlib import Path
 from colorama import Fore, Style
 
 
 
-def preprocess():
-    """
-    1. call get_raw_data
-    2. drop cols
-    3. clean (rm duplicates)
-    3. encode y
-    4. aggregate by hour
-    5. join with weather data (get_weather_data)
-    6. feature engineering & merge
-    7. feature selection
-    8. preproc-pipeline
-    """
-
-    cache_path_X_preproc=Path(f'{LOCAL_DATA_PATH}/processed/X_processed_from_{START_YEAR}_to_{END_YEAR}.csv')
-    cache_path_y_preproc=Path(f'{LOCAL_DATA_PATH}/processed/y_processed_from_{START_YEAR}_to_{END_YEAR}.csv')
-
-    if cache_path_X_preproc.is_file():
-        print(Fore.BLUE + "\nLoad preprocessed data from local CSV..." + Style.RESET_ALL)
-        X_processed = pd.read_csv(cache_path_X_preproc , header='infer')
-        y = pd.read_csv(cache_path_y_preproc , header='infer')
-        if X_processed.shape[0] == y.shape[0]:
-            return X_processed , y
-        print('\nShape mismatch between y and X')
-        return None
-
-    print(Fore.BLUE + "\nPreprocessing Data..." + Style.RESET_ALL)
-
-    # 1. get_raw_data
-    query =f'''
-        SELECT *
-        FROM `{GCP_PROJECT}.{BQ_DATASET}.raw_data_mvg`
-    '''
-
-    rental_data_df = get_raw_data(gcp_project=GCP_PROJECT , query=query , cache_path=Path(f'{LOCAL_DATA_PATH}/raw/mvg_rentals_from_{START_YEAR}_to_{END_YEAR}.csv'))
-
-    # 2. drop cols
-    rental_relavent_cols_df = rental_data_df[['STARTTIME' , 'STARTLAT' , 'STARTLON']]
-
-    # 3. clean(rm duplicates)
-    rental_relavent_cols_df = rental_relavent_cols_df.drop_duplicates()
-
-    # 4. encode y
-    encoded_rental_df = encode_district_label(rental_relavent_cols_df , get_polygons())
+DISTRICTS = ['Altstadt-Lehel', 'Au - Haidhausen',
+       'Aubing-Lochhausen-Langwied', 'Berg am Laim', 'Bogenhausen',
+       'Feldmoching', 'Hadern', 'Harlaching', 'Hasenbergl-Lerchenau Ost',
+       'Laim', 'Lochhausen', 'Ludwigsvorstadt-Isarvorstadt', 'Maxvorstadt',
+       'Milbertshofen-Am Hart', 'Moosach', 'Neuhausen-Nymphenburg',
+       'Obergiesing', 'Obermenzing', 'Obersendling', 'Pasing',
+       'Pasing-Obermenzing', 'Ramersdorf-Perlach', 'Schwabing-Freimann',
+       'Schwabing-West', 'Schwanthalerhöhe', 'Sendling', 'Sendling-Westpark',
+       'Südgiesing', 'Thalkirchen', 'Trudering', 'Trudering-Riem',
+       'Untergiesing', 'Untergiesing-Harlaching', 'Untermenzing-Allach']
 
-    # 5. aggregate by hour
-    aggregated_rental_df = group_rental_data_by_hour(encoded_rental_df)
+FEATURES = ['temperature_2m', 'relativehumidity_2m', 'apparent_temperature',
+       'windspeed_10m', 'precipitation', 'hour_sin', 'hour_cos', 'month_sin',
+       'month_cos', 'day_sin', 'day_cos','is_holiday', 'is_weekend']
 
-    # 6. join with weather data
-    weather_data_df = get_weather_data(cache_path=Path(f'{LOCAL_DATA_PATH}/raw/histotical_weather_data_{START_YEAR}_to_{END_YEAR}.csv'))
-    weather_data_df['time'] = pd.to_datetime(weather_data_df['time'])
-    merged_df = aggregated_rental_df.merge(weather_data_df, right_on='time' , left_on='rent_date_hour' , how='outer')
-    merged_df['rent_date_hour'] = merged_df['time']
-    merged_df = merged_df.sort_values(by='rent_date_hour').drop(columns=['time'])
-    merged_df.fillna(0 , inplace=True)
 
-    # Dropping leapyear data
+def get_preprocess_pipeline() -> dict:
+    """
+    Builds the stages of the preprocessing pipeline and returns them by name:
+    1. raw load (get_raw_data, only the relevant cols)
+    2. clean (rm duplicates)
+    3. + 4. count the rentals per hour and district (y)
+    5. join with weather data (get_weather_data)
+    6. feature engineering
+    7. feature selection & preproc-pipeline
+    In the 'aggregated' RAW_DATA_MODE, 2. and 4. already run in the warehouse. With a
+    PREPROCESS_CHUNK_SIZE, 1. to 4. stream the raw data in chunks (one stage, bounded memory).
+    With PREPROCESS_N_WORKERS > 1, 1. to 6. run per year in a process pool (one stage, see
+    preprocess_partitions) and 7. on the concatenated years.
+    """
+    if START_YEAR is None or END_YEAR is None:
+        raise ValueError("Set START_YEAR and END_YEAR to preprocess the data")
+
+    polygons = get_polygons()
+
+    # 1. + 2. + 3. + 4.
+    if PREPROCESS_N_WORKERS > 1:
+        # 1. to 6. run per year in a process pool (see below)
+        raw_stage, aggregation_stage = None, None
+    elif PREPROCESS_CHUNK_SIZE > 0:
+        backend = get_sql_backend()
+        if RAW_DATA_MODE == 'aggregated':
+            params = {
+                'query': build_hourly_location_query(backend, start_year=START_YEAR, end_year=END_YEAR),
+                'cache_path': Path(f'{LOCAL_DATA_PATH}/raw/mvg_hourly_locations_from_{START_YEAR}_to_{END_YEAR}.parquet'),
+                'deduplicate': False,
+                'time_column': 'rent_date_hour',
+                'weight_column': 'n_rentals'}
+        else:
+            # Ordered by STARTTIME, so that the deduplication only has to remember the latest rentals
+            params = {
+                'query': build_rental_query(backend, start_year=START_YEAR, end_year=END_YEAR),
+                'cache_path': Path(f'{LOCAL_DATA_PATH}/raw/mvg_rentals_ordered_from_{START_YEAR}_to_{END_YEAR}.parquet'),
+                'columns': ['STARTTIME' , 'STARTLAT' , 'STARTLON'],
+                'ordered': True}
+        raw_stage = None
+        aggregation_stage = Stage('hourly_aggregation', count_streamed_rentals_by_hour, params={
+            'gcp_project': GCP_PROJECT, 'polygons': polygons, 'start_year': START_YEAR, 'end_year': END_YEAR,
+            'chunk_size': PREPROCESS_CHUNK_SIZE, **params})
+    elif RAW_DATA_MODE == 'aggregated':
+        query = build_hourly_location_query(get_sql_backend(), start_year=START_YEAR, end_year=END_YEAR)
+        raw_stage = Stage('raw_load', get_raw_data, persist=False, params={
+            'gcp_project': GCP_PROJECT,
+            'query': query,
+            'cache_path': Path(f'{LOCAL_DATA_PATH}/raw/mvg_hourly_locations_from_{START_YEAR}_to_{END_YEAR}.parquet')})
+        aggregation_stage = Stage('hourly_aggregation', count_rentals_by_hour, inputs=[raw_stage],
+                                  params={'polygons': polygons, 'time_column': 'rent_date_hour',
+                                          'weight_column': 'n_rentals'})
+    else:
+        # The same query (and cache) as the streaming and the per-year partitioned preprocessing,
+        # so every mode trains on the rentals of START_YEAR to END_YEAR
+        query = build_rental_query(get_sql_backend(), start_year=START_YEAR, end_year=END_YEAR)
+        raw_stage = Stage('raw_load', get_raw_data, persist=False, params={
+            'gcp_project': GCP_PROJECT,
+            'query': query,
+            'cache_path': Path(f'{LOCAL_DATA_PATH}/raw/mvg_rentals_ordered_from_{START_YEAR}_to_{END_YEAR}.parquet'),
+            'columns': ['STARTTIME' , 'STARTLAT' , 'STARTLON']})
+        dedup_stage = Stage('dedup', drop_duplicate_rentals, inputs=[raw_stage], persist=False)
+        aggregation_stage = Stage('hourly_aggregation', count_rentals_by_hour, inputs=[dedup_stage],
+                                  params={'polygons': polygons})
+
+    # 5. join with weather data, keyed by the content of the weather data
+    weather_data_df = get_weather_data(cache_path=Path(f'{LOCAL_DATA_PATH}/raw/histotical_weather_data_{START_YEAR}_to_{END_YEAR}.parquet'))
+    weather_stage = Stage.from_data('weather_load', weather_data_df)
+
+    if PREPROCESS_N_WORKERS > 1:
+        # The number of workers does not change the output, so it is not part of the key
+        merge_stage = None
+        calendar_stage = Stage('calendar_features', preprocess_partitions, inputs=[weather_stage], params={
+            'polygons': polygons, 'gcp_project': GCP_PROJECT, 'start_year': START_YEAR, 'end_year': END_YEAR,
+            'raw_data_mode': RAW_DATA_MODE})
+    else:
+        merge_stage = Stage('weather_merge', merge_weather_data, inputs=[aggregation_stage, weather_stage])
+
+        # 6. feature engineering
+        calendar_stage = Stage('calendar_features', add_calendar_features, inputs=[merge_stage])
+
+    # 7. feature selection & preproc-pipeline (fitted once, persisted with the models by train)
+    feature_pipeline_stage = Stage('feature_pipeline', fit_feature_pipeline, inputs=[calendar_stage],
+                                   params={'features': FEATURES})
+    scaling_stage = Stage('scaling', build_processed_data, inputs=[calendar_stage, feature_pipeline_stage],
+                          params={'districts': DISTRICTS})
+
+    return {stage.name: stage for stage in [raw_stage, aggregation_stage, weather_stage, merge_stage,
+                                            calendar_stage, feature_pipeline_stage, scaling_stage] if stage is not None}
 
-    merged_df['filter_time'] = merged_df['rent_date_hour'].apply(lambda x: str(x)[5:10])
-    merged_df = merged_df[merged_df['filter_time'] != '02-29'].drop(columns=['filter_time'])
 
-    # 7. feature enginering & merge
-    holidays = is_holiday(merged_df[['rent_date_hour']])
-    merged_df = merged_df.merge(holidays , on='rent_date_hour' , how='inner')
+def preprocess():
+    """
+    Runs the preprocessing pipeline (see get_preprocess_pipeline). Every stage is cached
+    under a hash of its inputs, parameters and code, so only the stages invalidated by
+    a change are recomputed. Use list_stages / evict_stages to manage the cache.
 
-    weekends = is_weekend(merged_df[['rent_date_hour']])
-    merged_df = merged_df.merge(weekends , on='rent_date_hour' , how='inner')
+    With PREPROCESS_MODE='append' the processed data is read from the processed store
+    instead, after appending the new hours to it (see preprocess_append).
 
-    encoded_date = encode_temporal_features(merged_df[['rent_date_hour']])
-    merged_df = merged_df.merge(encoded_date , on='rent_date_hour' , how='inner')
+    Returns X_processed, y (both indexed by rent_date_hour)
+    """
+    print(Fore.BLUE + "\nPreprocessing Data..." + Style.RESET_ALL)
 
-    # 8. feature selection
+    with span('preprocess', mode=PREPROCESS_MODE) as s:
+        if PREPROCESS_MODE == 'append':
+            store_path = preprocess_append()
+            processed_df = load_processed_data(store_path, columns=['rent_date_hour', *FEATURES, *DISTRICTS])
+        else:
+            processed_df = get_preprocess_pipeline()['scaling'].output()
+        processed_df = processed_df.set_index('rent_date_hour')
+        s.set(rows_out=len(processed_df))
 
+    X_processed = processed_df[FEATURES]
+    y = processed_df[DISTRICTS]
 
-    # Dropping leapyear data
+    print(f'X_shape: {X_processed.shape}')
+    print(f'y_shape: {y.shape}')
 
-    districts = ['Altstadt-Lehel', 'Au - Haidhausen',
-       'Aubing-Lochhausen-Langwied', 'Berg am Laim', 'Bogenhausen',
-       'Feldmoching', 'Hadern', 'Harlaching', 'Hasenbergl-Lerchenau Ost',
-       'Laim', 'Lochhausen', 'Ludwigsvorstadt-Isarvorstadt', 'Maxvorstadt',
-       'Milbertshofen-Am Hart', 'Moosach', 'Neuhausen-Nymphenburg',
-       'Obergiesing', 'Obermenzing', 'Obersendling', 'Pasing',
-       'Pasing-Obermenzing', 'Ramersdorf-Perlach', 'Schwabing-Freimann',
-       'Schwabing-West', 'Schwanthalerhöhe', 'Sendling', 'Sendling-Westpark',
-       'Südgiesing', 'Thalkirchen', 'Trudering', 'Trudering-Riem',
-       'Untergiesing', 'Untergiesing-Harlaching', 'Untermenzing-Allach']
+    return X_processed , y
 
-    X = merged_df.drop(columns=districts)
-    y = merged_df[districts]
 
-    print(f'X_shape: {X.shape}')
-    print(f'y_shape: {y.shape}')
+def get_new_processed_data(since, pipeline: FeaturePipeline) -> pd.DataFrame:
+    """
+    Runs the rentals and weather from the hour `since` on through the preprocessing steps
+    (district assignment, hourly aggregation, weather join and calendar features) and scales
+    them with the given feature pipeline, i. e. the one of the rows processed before.
 
-    features = ['temperature_2m', 'relativehumidity_2m', 'apparent_temperature',
-       'windspeed_10m', 'precipitation', 'hour_sin', 'hour_cos', 'month_sin',
-       'month_cos', 'day_sin', 'day_cos','is_holiday', 'is_weekend']
+    Returns the processed rows (rent_date_hour, FEATURES and DISTRICTS) sorted by rent_date_hour
+    """
+    backend = get_sql_backend()
+    polygons = get_polygons()
+
+    if RAW_DATA_MODE == 'aggregated':
+        query = build_hourly_location_query(backend, start_year=START_YEAR, end_year=END_YEAR, since=since)
+        raw_df = get_new_raw_data(GCP_PROJECT, query, backend=backend)
+        last_loaded_hour = raw_df['rent_date_hour'].max()
+        counts_df = count_rentals_by_hour(raw_df, polygons, time_column='rent_date_hour', weight_column='n_rentals')
+    else:
+        query = build_rental_query(backend, start_year=START_YEAR, end_year=END_YEAR, since=since)
+        raw_df = get_new_raw_data(GCP_PROJECT, query, backend=backend)
+        last_loaded_hour = raw_df['STARTTIME'].max()
+        counts_df = count_rentals_by_hour(drop_duplicate_rentals(raw_df), polygons)
+
+    weather_df = get_new_weather_data(since, min(date(END_YEAR, 12, 31), date.today()))
+    if weather_df.empty or pd.isna(last_loaded_hour):
+        return pd.DataFrame(columns=['rent_date_hour', *FEATURES, *DISTRICTS])
+
+    # Only the hours with both weather and rentals loaded in the warehouse: the weather archive is
+    # usually ahead of the monthly rental dumps, and the missing hours must not be appended as zero
+    # rentals. The later hours are appended by a later run, once both sources have them.
+    last_hour = min(weather_df['time'].max(), pd.Timestamp(last_loaded_hour).floor('H'))
+    counts_df = counts_df[counts_df['rent_date_hour'] <= last_hour]
+    weather_df = weather_df[weather_df['time'] <= last_hour]
+    df = add_calendar_features(merge_weather_data(counts_df, weather_df))
+
+    # Districts without a rental in the new hours
+    df = df.reindex(columns=[*df.columns, *[d for d in DISTRICTS if d not in df.columns]], fill_value=0)
+
+    return build_processed_data(df, pipeline.to_frame(), DISTRICTS)
+
+
+def preprocess_append() -> Path:
+    """
+    - On the first run, build the processed store from the full preprocessing pipeline and keep
+      its feature pipeline with the store
+    - Afterwards, detect the last processed hour and only process the newer rentals and weather
+      (see get_new_processed_data), scaled with the feature pipeline of the store
+    - Append them to the monthly partitions of the store, the partition of the last processed
+      hour is completed
+
+    Return the path of the processed store
+    """
+    store_path = get_store_path(START_YEAR)
+    pipeline = load_store_pipeline(store_path)
+    last_hour = get_last_processed_hour(store_path)
+
+    if pipeline is None or last_hour is None:
+        print(Fore.BLUE + f"\nBuild the processed store {store_path}..." + Style.RESET_ALL)
+        stages = get_preprocess_pipeline()
+        pipeline = FeaturePipeline.from_frame(stages['feature_pipeline'].output(),
+                                              version=stages['feature_pipeline'].key[:12])
+        save_store_pipeline(pipeline, store_path)
+        append_processed_data(stages['scaling'].output(), store_path)
+        return store_path
+
+    print(Fore.BLUE + f"\nAppend the hours from {last_hour} on to the processed store..." + Style.RESET_ALL)
+    # The last processed hour is processed again, in case its rentals were incomplete
+    with span('preprocess.new_hours', since=str(last_hour)) as s:
+        new_df = get_new_processed_data(last_hour, pipeline)
+        s.set(rows_out=len(new_df))
+
+    if len(new_df) and new_df['rent_date_hour'].max() > last_hour:
+        append_processed_data(new_df, store_path)
+    else:
+        print("✅ Processed store up to date")
+
+    return store_path
+
+
+def get_feature_pipeline() -> FeaturePipeline:
+    """
+    Returns the feature pipeline fitted on the preprocessed data (the one of the processed
+    store with PREPROCESS_MODE='append').
+    """
+    if PREPROCESS_MODE == 'append':
+        return load_store_pipeline(get_store_path(START_YEAR))
+    stage = get_preprocess_pipeline()['feature_pipeline']
+    return FeaturePipeline.from_frame(stage.output(), version=stage.key[:12])
 
-    selected_merged_df = feature_selection(X , features)
+def tune():
+    """
+    - Get the preprocessed data
+    - Search the hyperparameters of every district (successive halving on time-ordered validation folds)
+    - Store the winners as a new version of the params store, which train() uses from then on
 
-    # 9. preproc-pipeline (Keep date_time for RNN)
-    X_processed = preprocess_features(selected_merged_df)
+    Return the tuning report (validation RMSE, number of fits and duration per district)
+    """
+    X, y = preprocess()
 
-    X_processed.columns = features
-    X_processed.to_csv(cache_path_X_preproc , header=True , index=False)
-    y.to_csv(cache_path_y_preproc , header=True , index=False)
+    with span('tune', rows_in=len(X)) as s:
+        params, report = tune_districts(X, y)
+        s.set(rows_out=len(params))
 
-    if X_processed.shape[0] == y.shape[0]:
-            return X_processed , y
+    save_hyperparams(params, scores=dict(zip(report['district'], report['rmse'])),
+                     metadata={'n_trials': TUNE_N_TRIALS, 'n_folds': TUNE_N_FOLDS,
+                               'validation_hours': TUNE_VALIDATION_HOURS, 'tuned_until': X.index.max()})
+    invalidate_tuned_params()
 
-    print('\nShape mismatch between y and X')
-    return None
+    return report
 
 # function to be defined
 def train():
     """
     - Download processed data from your BQ table (or from cache if it exists)
     - Train on the preprocessed dataset (which should be ordered by date)
-    - Store models on GCP via registry.save_model()
+    - Publish the models of all districts as one version via registry.publish_models()
 
-    Return val_mae as a float
+    Return the training report (duration, worker and error per district)
     """
 
     # 1. Get preprocessed data
@@ -140,62 +290,97 @@ def train():
     print(f'X_shape: {X.shape}')
     print(f'y_shape: {y.shape}')
 
-    districts = y.columns
-
     # 2. Train=4 years
     X_train = X.copy()
     y_train = y.copy()
 
-    for district in districts:
-        hyper_params = get_model_params(district)
-        print(Fore.BLUE + f"\nTraining model for district {district}..." + Style.RESET_ALL)
-        model = XGBRegressor(objective='reg:squarederror', **hyper_params)
-        y_train_district = y_train[district]
-        model.fit(X_train, y_train_district)
-        save_model(model, district)
-
-    print(f"✅ Models trained for all {len(districts)} districts")
-
-    return None
-
-# function to be defined
-def predict(weather_data):
-    weather_data_df = pd.DataFrame(weather_data)
-
-    pred_df = weather_data_df.rename({'time' : 'rent_date_hour'} , axis=1)
-    pred_df['rent_date_hour'] = pd.to_datetime(pred_df['rent_date_hour'])
-
-    holidays = is_holiday(pred_df[['rent_date_hour']])
-    pred_df = pred_df.merge(holidays , on='rent_date_hour' , how='inner')
+    with span('train', rows_in=len(X_train)) as s:
+        models, report = train_district_models(X_train, y_train, get_model_params,
+                                               n_workers=TRAIN_N_WORKERS, threads_per_worker=TRAIN_THREADS_PER_WORKER)
+        s.set(rows_out=len(models))
 
-    weekends = is_weekend(pred_df[['rent_date_hour']])
-    pred_df = pred_df.merge(weekends , on='rent_date_hour' , how='inner')
+    # Publish all district models of the run together with the feature pipeline
+    metrics = {row['district']: {'train_seconds': row['seconds']} for _, row in report.iterrows()}
+    with span('registry.publish_models', rows_in=len(models), model_format=MODEL_FORMAT):
+        publish_models(models, metrics=metrics, feature_pipeline=get_feature_pipeline(),
+                       metadata={'trained_from': X_train.index.min(), 'trained_until': X_train.index.max(),
+                                 'n_rows': X_train.shape[0]})
+    with span('registry.garbage_collect'):
+        garbage_collect()
 
-    encoded_date = encode_temporal_features(pred_df[['rent_date_hour']])
-    pred_df = pred_df.merge(encoded_date , on='rent_date_hour' , how='inner')
+    failed = report[report['error'].notna()]['district'].tolist()
+    if failed:
+        print(Fore.RED + f"\n❌ Training failed for {len(failed)} districts: {failed}" + Style.RESET_ALL)
 
-    pred_proc_df = preprocess_features(pred_df).drop(columns='rent_date_hour')
+    print(f"✅ Models trained for {len(models)} of {len(report)} districts")
 
-    districts = ['Maxvorstadt', 'Schwabing-West', 'Au - Haidhausen', 'Sendling',
-       'Schwanthalerhöhe', 'Moosach', 'Berg am Laim', 'Trudering',
-       'Ramersdorf', 'Obergiesing', 'Thalkirchen', 'Obersendling',
-       'Hadern', 'Pasing', 'Laim', 'Ludwigsvorstadt-Isarvorstadt', 'Ramersdorf-Perlach', 'Südgiesing',
-       'Altstadt-Lehel', 'Sendling-Westpark', 'Neuhausen-Nymphenburg',
-       'Schwabing-Freimann', 'Moosach', 'Milbertshofen-Am Hart',
-       'Bogenhausen', 'Trudering-Riem', 'Untergiesing-Harlaching']
+    return report
 
-    predictions = {}
+def train_incremental():
+    """
+    - Load the latest model of every district and the feature pipeline they were trained with
+    - Warm-start the models on the hours after their trained_until only (INCREMENTAL_MODE),
+      guarded by a validation against a full retrain (INCREMENTAL_GUARDRAIL)
+    - Publish the changed models, the other districts keep their current version
 
-    for dist in districts:
-        print(dist)
-        model = load_model(dist)
+    Return the update report (new hours, validation RMSEs and outcome per district)
+    """
+    latest = get_latest_models()
+    feature_pipeline = load_feature_pipeline()
+    if not latest or feature_pipeline is None:
+        print(Fore.RED + "\n❌ No published models to update, training them from scratch" + Style.RESET_ALL)
+        return train()
+
+    # The features are scaled with the pipeline of the models, not refitted on the new hours
+    if PREPROCESS_MODE == 'append':
+        if get_feature_pipeline().version != feature_pipeline.version:
+            raise ValueError("The processed store is scaled with another feature pipeline than the published "
+                             "models, train them from scratch with train() first")
+        X, y = preprocess()
+    else:
+        df = get_preprocess_pipeline()['calendar_features'].output()
+        X = feature_pipeline.transform_frame(df).set_axis(pd.DatetimeIndex(df['rent_date_hour'], name='rent_date_hour'))
+        y = df.set_index('rent_date_hour')[DISTRICTS]
+
+    pool = get_model_pool()
+    districts = [district for district in DISTRICTS if district in latest]
+    models = {district: pool.get(district) for district in districts}
+    run_metadata = {version: get_run_metadata(version) for version in {latest[d]['version'] for d in districts}}
+    trained_until = {district: run_metadata[latest[district]['version']].get('trained_until') for district in districts}
+
+    with span('train.incremental', rows_in=len(X), mode=INCREMENTAL_MODE) as s:
+        models, report = update_district_models(models, X, y[districts], trained_until, get_model_params)
+        s.set(rows_out=len(models))
+
+    if not models:
+        print("✅ Models up to date, nothing to publish")
+        return report
+
+    metrics = {row['district']: {'train_seconds': row['seconds'], 'validation_rmse': row['validation_rmse'],
+                                 'reference_rmse': row['reference_rmse'], 'outcome': row['outcome']}
+               for _, row in report.iterrows() if row['district'] in models}
+    with span('registry.publish_models', rows_in=len(models), model_format=MODEL_FORMAT):
+        publish_models(models, metrics=metrics, feature_pipeline=feature_pipeline,
+                       metadata={'trained_from': X.index.min(), 'trained_until': X.index.max(), 'n_rows': len(X),
+                                 'incremental': INCREMENTAL_MODE,
+                                 'updated_from': sorted({latest[district]['version'] for district in models})})
+    with span('registry.garbage_collect'):
+        garbage_collect()
+
+    return report
 
-        prediction = [round(x) for x in model.predict(pred_proc_df)]
+def evaluate():
+    """
+    - Get the preprocessed data
+    - Walk-forward backtest of every district on folds of FOLD_LENGTH hours every FOLD_STRIDE hours,
+      trained on the first TRAIN_TEST_RATIO of each fold
 
-        predictions[dist] = prediction
+    Return the metrics table (MAE, RMSE and timings per district and fold)
+    """
+    X, y = preprocess()
 
-    return predictions
+    with span('evaluate', rows_in=len(X)) as s:
+        metrics_df = backtest(X, y, get_model_params)
+        s.set(rows_out=len(metrics_df))
 
-# function to be defined
-def evaluate():
-    pass
+    return metrics_df
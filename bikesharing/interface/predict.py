@@ -0,0 +1,96 @@
+"""
+Lean entry point of the predictions.
+
+Only imports what predict() needs (NumPy, pandas, the registry and the feature pipeline),
+xgboost is loaded with the first model and the forecast client with the first forecast.
+Prediction workers should import this module instead of bikesharing.interface.main,
+which pulls in the preprocessing and training dependencies.
+"""
+import numpy as np
+import pandas as pd
+
+from bikesharing.params import *
+from bikesharing.ml_logic.registry import get_model_pool, load_feature_pipeline
+from bikesharing.ml_logic.inference import predict_districts
+from bikesharing.ml_logic.instrumentation import span
+
+
+def get_models() -> dict:
+    """
+    Returns the latest model of every district published in the registry, from the model pool.
+    """
+    model_pool = get_model_pool()
+    models = {}
+
+    # The districts come from the manifest, the pool logs each model once when it loads it
+    for dist in model_pool.get_districts():
+        model = model_pool.get(dist)
+        if model is not None:
+            models[dist] = model
+
+    return models
+
+
+def get_weather_frame(weather_data) -> pd.DataFrame:
+    """
+    Converts the hourly weather (dict or DataFrame with a 'time' column) to the input of the feature pipeline.
+    """
+    weather_data_df = pd.DataFrame(weather_data)
+
+    pred_df = weather_data_df.rename({'time' : 'rent_date_hour'} , axis=1)
+    pred_df['rent_date_hour'] = pd.to_datetime(pred_df['rent_date_hour'])
+
+    return pred_df
+
+
+def predict_batch(pred_dfs: list) -> list:
+    """
+    Predicts several requests at once: their hours are stacked into one feature matrix, which
+    goes through the feature pipeline and the models of all districts in a single pass.
+
+    Args:
+        pred_dfs (list): The hourly weather of each request (see get_weather_frame).
+
+    Returns:
+        list: The predicted rentals per hour by district of each request.
+    """
+    # The feature pipeline fitted in training (calendar features, selection and scaling)
+    feature_pipeline = load_feature_pipeline()
+    if feature_pipeline is None:
+        raise FileNotFoundError(f"No feature pipeline in {LOCAL_REGISTRY_PATH}, run train() first")
+
+    pred_df = pd.concat(pred_dfs, ignore_index=True) if len(pred_dfs) > 1 else pred_dfs[0]
+
+    with span('predict.features', rows_in=len(pred_df), n_requests=len(pred_dfs)):
+        pred_proc_df = feature_pipeline.transform_frame(pred_df)
+
+    models = get_models()
+
+    # One batched call for all districts, shape (districts, hours)
+    with span('predict.inference', rows_in=len(pred_proc_df), engine=INFERENCE_ENGINE) as s:
+        prediction_matrix = np.rint(predict_districts(models, pred_proc_df)).astype(int)
+        s.set(rows_out=prediction_matrix.size, n_districts=len(models))
+
+    # Split the hours of the batch back into the requests
+    bounds = np.cumsum([0] + [len(df) for df in pred_dfs])
+    return [{dist: prediction_matrix[i, start:end].tolist() for i, dist in enumerate(models)}
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def predict(weather_data=None, day=None):
+    """
+    Predicts the hourly rentals per district.
+
+    Either pass the hourly `weather_data` (dict or DataFrame with a 'time' column), or the
+    `day` (date or ISO string) to predict, whose forecast is then requested through the
+    cached forecast provider.
+
+    Returns a dict with the predicted rentals per hour by district
+    """
+    if weather_data is None:
+        if day is None:
+            raise ValueError("Pass either weather_data or day")
+        from bikesharing.ml_logic.forecast import get_forecast_provider
+        weather_data = get_forecast_provider().get_forecast(pd.Timestamp(day).date())
+
+    return predict_batch([get_weather_frame(weather_data)])[0]
@@ -0,0 +1,149 @@
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from colorama import Fore, Style
+
+from bikesharing.params import *
+from bikesharing.ml_logic.cache import save_cache
+from bikesharing.ml_logic.model import get_fold_starts
+from bikesharing.ml_logic.stage_cache import fingerprint
+from bikesharing.ml_logic.training import _init_worker, get_worker_data
+
+
+BACKTEST_PATH = Path(LOCAL_DATA_PATH).joinpath('backtest')
+
+
+def _evaluate_district_fold(task: dict) -> dict:
+    result = {key: value for key, value in task.items() if key != 'hyper_params'}
+    try:
+        X, y, features = get_worker_data()
+        train_rows = slice(task['train_start'], task['test_start'])
+        test_rows = slice(task['test_start'], task['test_end'])
+
+        # Slices of the memory-mapped matrices, the folds are never copied into the workers
+        X_train = pd.DataFrame(X[train_rows], columns=features, copy=False)
+        X_test = pd.DataFrame(X[test_rows], columns=features, copy=False)
+        y_train, y_test = y[train_rows, task['column']], y[test_rows, task['column']]
+
+        from xgboost import XGBRegressor
+
+        start = time.perf_counter()
+        model = XGBRegressor(objective='reg:squarederror', n_jobs=task['n_threads'], **task['hyper_params'])
+        model.fit(X_train, y_train)
+        result['fit_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        y_pred = model.predict(X_test)
+        result['predict_seconds'] = time.perf_counter() - start
+
+        errors = y_pred - y_test
+        result['mae'] = float(np.mean(np.abs(errors)))
+        result['rmse'] = float(np.sqrt(np.mean(errors ** 2)))
+        result['error'] = None
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    return result
+
+
+def get_backtest_matrices(X: pd.DataFrame, y: pd.DataFrame) -> tuple:
+    """
+    Writes X and y once as float32 .npy files, keyed by their content, and returns their paths.
+    Repeated backtests of the same data reuse the files; every fold is a slice of them.
+    """
+    directory = BACKTEST_PATH.joinpath(fingerprint([X, y])[:16])
+    X_path, y_path = directory.joinpath('X.npy'), directory.joinpath('y.npy')
+
+    if not (X_path.is_file() and y_path.is_file()):
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(X_path, X.to_numpy(dtype=np.float32))
+        np.save(y_path, y.to_numpy(dtype=np.float32))
+
+    return str(X_path), str(y_path)
+
+
+def backtest(X: pd.DataFrame,
+             y: pd.DataFrame,
+             get_params,
+             fold_length: int = FOLD_LENGTH,
+             fold_stride: int = FOLD_STRIDE,
+             train_test_ratio: float = TRAIN_TEST_RATIO,
+             n_workers: int = TRAIN_N_WORKERS,
+             threads_per_worker: int = TRAIN_THREADS_PER_WORKER) -> pd.DataFrame:
+    """
+    Walk-forward backtest: the time series is cut into folds of `fold_length` hours every
+    `fold_stride` hours, each district model is trained on the first `train_test_ratio` of
+    a fold and evaluated on the rest. All (fold, district) pairs run in parallel over a
+    process pool which memory-maps X and y.
+
+    Args:
+        X (pd.DataFrame): The features, ordered by time.
+        y (pd.DataFrame): The rental counts, one column per district.
+        get_params: Function returning the hyperparameters of a district.
+        fold_length (int): How long each fold is in rows (hours).
+        fold_stride (int): How many rows to move forward between the folds.
+        train_test_ratio (float): The share of a fold used for training.
+        n_workers (int): The number of processes.
+        threads_per_worker (int): The number of XGBoost threads of each fit, 0 splits the cores evenly.
+
+    Returns:
+        pd.DataFrame: One row per district and fold with its test period, MAE, RMSE and timings.
+    """
+    if None in (fold_length, fold_stride, train_test_ratio):
+        raise ValueError("Set FOLD_LENGTH, FOLD_STRIDE and TRAIN_TEST_RATIO (or pass them) to backtest")
+
+    fold_starts = get_fold_starts(len(X), fold_length, fold_stride)
+    if len(fold_starts) == 0:
+        raise ValueError(f'{len(X)} rows are not enough for a fold of {fold_length} rows')
+
+    n_workers = max(1, n_workers)
+    n_threads = threads_per_worker or max(1, (os.cpu_count() or 1) // n_workers)
+    X_path, y_path = get_backtest_matrices(X, y)
+
+    tasks = []
+    for fold, fold_start in enumerate(fold_starts):
+        test_start = fold_start + round(train_test_ratio * fold_length)
+        for column, district in enumerate(y.columns):
+            tasks.append({'fold': fold, 'district': district, 'column': column,
+                          'train_start': int(fold_start), 'test_start': int(test_start),
+                          'test_end': int(fold_start + fold_length),
+                          'hyper_params': get_params(district), 'n_threads': n_threads})
+
+    print(Fore.BLUE + f"\nBacktesting {len(y.columns)} districts on {len(fold_starts)} folds "
+          f"with {n_workers} workers..." + Style.RESET_ALL)
+    start = time.perf_counter()
+
+    results = []
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(X_path, y_path, list(X.columns))) as executor:
+        futures = [executor.submit(_evaluate_district_fold, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            if result['error'] is not None:
+                print(Fore.RED + f"❌ {result['district']} failed on fold {result['fold']}:\n{result['error']}" + Style.RESET_ALL)
+            results.append(result)
+
+    failed = [result for result in results if result['error'] is not None]
+    if len(failed) == len(results):
+        errors = '\n'.join(f"{result['district']} (fold {result['fold']}):\n{result['error']}" for result in failed)
+        raise ValueError(f"All {len(results)} backtest tasks failed, no fold was evaluated:\n{errors}")
+
+    metrics_df = pd.DataFrame(results).sort_values(['fold', 'column']).drop(columns=['column', 'n_threads'])
+    metrics_df = metrics_df.reset_index(drop=True)
+
+    if isinstance(X.index, pd.DatetimeIndex):
+        metrics_df['test_from'] = X.index[metrics_df['test_start']]
+        metrics_df['test_until'] = X.index[metrics_df['test_end'] - 1]
+
+    metrics_path = save_cache(metrics_df, BACKTEST_PATH.joinpath(f'metrics_{time.strftime("%Y%m%d-%H%M%S")}.parquet'))
+
+    summary = metrics_df.groupby('district')[['mae', 'rmse']].mean().sort_values('mae')
+    print(summary.to_string())
+    print(f"✅ Backtest finished in {time.perf_counter() - start:.1f} s, metrics saved to {metrics_path}")
+
+    return metrics_df
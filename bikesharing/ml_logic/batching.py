@@ -0,0 +1,134 @@
+import asyncio
+from concurrent.futures import Executor
+
+from bikesharing.ml_logic.instrumentation import record_span
+
+
+class MicroBatcher:
+    """
+    Coalesces the items submitted concurrently on an event loop into batches.
+
+    The first item of a batch waits at most `max_wait` seconds for others to arrive, then
+    `func` (a blocking function mapping a list of items to a list of results) runs on the
+    executor, off the event loop. Up to `max_concurrency` batches run at once (one per executor
+    thread), items submitted while all of them are busy form the next batch, so under load the
+    batches grow on their own.
+
+    If a batch raises, its items are retried one by one, so that one invalid item only fails
+    its own request.
+    """
+
+    def __init__(self, func, max_batch_size: int = 64, max_wait: float = 0.005, executor: Executor = None,
+                 max_concurrency: int = None):
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        # Defaults to the number of threads of the executor
+        self.max_concurrency = max_concurrency or getattr(executor, '_max_workers', None) or 1
+        self._queue = None
+        self._task = None
+        self._batch_tasks = set()
+
+    def start(self) -> None:
+        """
+        Starts collecting batches, must be called on the running event loop.
+        """
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # The batches in flight finish, so that their requests get a response
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+
+    async def submit(self, item):
+        """
+        Returns the result of the item, once the batch containing it was processed.
+        """
+        if self._task is None:
+            raise RuntimeError("MicroBatcher.start() was not called")
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_concurrency)
+
+        while True:
+            # Waiting for a free slot first lets the queue fill up into the next batch
+            await slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                slots.release()
+                raise
+
+            # Requests cancelled by their client while waiting are not computed
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                slots.release()
+                continue
+
+            task = loop.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+
+            def done(task):
+                self._batch_tasks.discard(task)
+                slots.release()
+
+            task.add_done_callback(done)
+
+    async def _run_batch(self, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            results = await loop.run_in_executor(self.executor, self.func, [item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as error:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(error)
+            else:
+                await self._run_individually(batch)
+
+        record_span('batching.batch', wall_seconds=loop.time() - start, rows_in=len(batch))
+
+    async def _run_individually(self, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        for item, future in batch:
+            try:
+                result = (await loop.run_in_executor(self.executor, self.func, [item]))[0]
+                if not future.done():
+                    future.set_result(result)
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
@@ -0,0 +1,224 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.feather
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from pathlib import Path
+
+from bikesharing.params import *
+
+
+# Explicit schemas of the cached datasets, columns which are not listed keep their inferred type
+RAW_RENTAL_SCHEMA = {
+    'STARTTIME': pa.timestamp('ns'),
+    'STARTLAT': pa.float64(),
+    'STARTLON': pa.float64(),
+    # Rentals counted per hour and location in the warehouse
+    'rent_date_hour': pa.timestamp('ns'),
+    'n_rentals': pa.int64()
+}
+
+WEATHER_SCHEMA = {
+    'time': pa.timestamp('ns'),
+    'temperature_2m': pa.float64(),
+    'relativehumidity_2m': pa.float64(),
+    'apparent_temperature': pa.float64(),
+    'windspeed_10m': pa.float64(),
+    'precipitation': pa.float64()
+}
+
+CACHE_SUFFIXES = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'csv': '.csv'
+}
+
+
+def get_cache_path(cache_path: Path, cache_format: str = None) -> Path:
+    """
+    Returns the path of the cached file in the given format.
+
+    Args:
+        cache_path (Path): The path of the cache, the suffix is replaced according to the format.
+        cache_format (str): 'parquet', 'arrow' or 'csv', defaults to CACHE_FORMAT.
+
+    Returns:
+        Path: The path of the cached file.
+    """
+    cache_format = cache_format or CACHE_FORMAT
+
+    if cache_format not in CACHE_SUFFIXES:
+        raise ValueError(f"Unknown cache format '{cache_format}', use one of {list(CACHE_SUFFIXES)}")
+
+    return Path(cache_path).with_suffix(CACHE_SUFFIXES[cache_format])
+
+
+def is_cached(cache_path: Path, cache_format: str = None) -> bool:
+    """
+    Checks whether the cache exists in the given format.
+    """
+    return get_cache_path(cache_path, cache_format).is_file()
+
+
+def _get_arrow_schema(table: pa.Table, schema: dict) -> pa.Schema:
+    # Override the inferred types of the columns listed in the explicit schema
+    fields = [pa.field(field.name, schema.get(field.name, field.type)) for field in table.schema]
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+def save_cache(df: pd.DataFrame, cache_path: Path, schema: dict = None,
+               cache_format: str = None, index: bool = False) -> Path:
+    """
+    Stores the DataFrame in the local cache.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to store.
+        cache_path (Path): The path of the cache.
+        schema (dict): The explicit arrow types of (some of) the columns.
+        cache_format (str): 'parquet', 'arrow' or 'csv', defaults to CACHE_FORMAT.
+        index (bool): Whether the index of the DataFrame should be stored as well.
+
+    Returns:
+        Path: The path of the cached file.
+    """
+    path = get_cache_path(cache_path, cache_format)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=index)
+    table = table.cast(_get_arrow_schema(table, schema or {}))
+
+    # Write to a temporary file first, so an interrupted run never leaves a truncated cache behind
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+
+    if path.suffix == '.parquet':
+        pq.write_table(table, tmp_path)
+    elif path.suffix == '.arrow':
+        # Uncompressed, so that the file can be memory-mapped without decoding
+        pa.feather.write_feather(table, tmp_path, compression='uncompressed')
+    else:
+        pa.csv.write_csv(table, tmp_path)
+
+    tmp_path.replace(path)
+
+    return path
+
+
+def load_cache(cache_path: Path, columns: list = None, schema: dict = None,
+               cache_format: str = None, index_col: str = None) -> pd.DataFrame:
+    """
+    Loads the DataFrame from the local cache.
+
+    Args:
+        cache_path (Path): The path of the cache.
+        columns (list): The columns to load, defaults to all columns.
+        schema (dict): The explicit arrow types of (some of) the columns, only needed for CSV.
+        cache_format (str): 'parquet', 'arrow' or 'csv', defaults to CACHE_FORMAT.
+        index_col (str): The column restored as index, only needed for CSV.
+
+    Returns:
+        pd.DataFrame: The cached DataFrame.
+    """
+    path = get_cache_path(cache_path, cache_format)
+
+    if path.suffix == '.parquet':
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    elif path.suffix == '.arrow':
+        table = pa.feather.read_table(path, columns=columns, memory_map=True)
+    else:
+        convert_options = pa.csv.ConvertOptions(column_types=schema or {}, include_columns=columns)
+        table = pa.csv.read_csv(path, convert_options=convert_options)
+
+    df = table.to_pandas()
+
+    # CSV has no pandas metadata, so a stored index comes back as a regular column
+    if index_col is not None and index_col in df.columns:
+        df = df.set_index(index_col)
+
+    return df
+
+
+def iter_cache(cache_path: Path, columns: list = None, chunk_size: int = 1_000_000, schema: dict = None,
+               cache_format: str = None):
+    """
+    Loads the DataFrame from the local cache in chunks of about `chunk_size` rows, so that
+    only one chunk is in memory at a time.
+
+    Args:
+        cache_path (Path): The path of the cache.
+        columns (list): The columns to load, defaults to all columns.
+        chunk_size (int): The number of rows per chunk (approximate for CSV, which is read in blocks).
+        schema (dict): The explicit arrow types of (some of) the columns, only needed for CSV.
+        cache_format (str): 'parquet', 'arrow' or 'csv', defaults to CACHE_FORMAT.
+
+    Yields:
+        pd.DataFrame: The chunks in the order of the file.
+    """
+    path = get_cache_path(cache_path, cache_format)
+
+    if path.suffix == '.parquet':
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunk_size, columns=columns)
+    elif path.suffix == '.arrow':
+        # The uncompressed file is memory-mapped, the batches are views into the map
+        batches = pa.feather.read_table(path, columns=columns, memory_map=True).to_batches(max_chunksize=chunk_size)
+    else:
+        convert_options = pa.csv.ConvertOptions(column_types=schema or {}, include_columns=columns)
+        # Blocks of about 64 bytes per row
+        read_options = pa.csv.ReadOptions(block_size=max(1 << 20, 64 * chunk_size))
+        batches = pa.csv.open_csv(path, read_options=read_options, convert_options=convert_options)
+
+    for batch in batches:
+        yield batch.to_pandas()
+
+
+class CacheWriter:
+    """
+    Stores a DataFrame arriving in chunks in the local cache, without holding it in memory:
+
+        with CacheWriter(cache_path, schema=RAW_RENTAL_SCHEMA) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+
+    Like save_cache, the file is written to a temporary path and only replaces the cache when
+    all chunks were written, an exception discards it.
+    """
+
+    def __init__(self, cache_path: Path, schema: dict = None, cache_format: str = None):
+        self.path = get_cache_path(cache_path, cache_format)
+        self.tmp_path = self.path.with_name(f'.{self.path.name}.tmp')
+        self.schema = schema or {}
+        self.rows = 0
+        self._arrow_schema = None
+        self._writer = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        if self._writer is None:
+            # The schema of the first chunk, with the explicit types, is used for all chunks
+            self._arrow_schema = _get_arrow_schema(table, self.schema).remove_metadata()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+            if self.path.suffix == '.parquet':
+                self._writer = pq.ParquetWriter(self.tmp_path, self._arrow_schema)
+            elif self.path.suffix == '.arrow':
+                self._writer = pa.ipc.new_file(self.tmp_path, self._arrow_schema)
+            else:
+                self._writer = pa.csv.CSVWriter(self.tmp_path, self._arrow_schema)
+
+        self._writer.write_table(table.select(self._arrow_schema.names).cast(self._arrow_schema))
+        self.rows += len(df)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._writer is not None:
+            self._writer.close()
+
+        if exc_type is None and self._writer is not None:
+            self.tmp_path.replace(self.path)
+        else:
+            self.tmp_path.unlink(missing_ok=True)
+
+        return False
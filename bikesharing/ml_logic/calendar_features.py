@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+
+# Periods of the cyclical encodings (hour, month, day and weekday are counted from 1)
+PERIODS = {
+    'hour': 24,
+    'month': 12,
+    'day': 31,
+    'weekday': 7
+}
+
+CALENDAR_FEATURES = ['is_holiday', 'is_weekend',
+                     'hour_sin', 'hour_cos', 'month_sin', 'month_cos',
+                     'day_sin', 'day_cos', 'weekday_sin', 'weekday_cos']
+
+
+@lru_cache(maxsize=32)
+def get_bavarian_holidays(years: tuple) -> np.ndarray:
+    """
+    Returns the sorted dates of the Bavarian public holidays in the given years.
+
+    Args:
+        years (tuple): The years.
+
+    Returns:
+        np.ndarray: The holiday dates as datetime64[D].
+    """
+    # Imported on first use, the holiday calendars of all countries are slow to import
+    import holidays
+
+    bay_holidays = holidays.CountryHoliday('DE', prov='BY', years=list(years))
+    return np.sort(np.array(list(bay_holidays.keys()), dtype='datetime64[D]'))
+
+
+def _to_datetime64(rent_date_hour) -> np.ndarray:
+    return pd.to_datetime(pd.Series(rent_date_hour)).to_numpy(dtype='datetime64[ns]')
+
+
+def is_leap_day(rent_date_hour) -> np.ndarray:
+    """
+    Flags the hours on February 29th.
+
+    Args:
+        rent_date_hour: The datetime values (Series, Index or array).
+
+    Returns:
+        np.ndarray: A boolean array.
+    """
+    values = _to_datetime64(rent_date_hour)
+    days = values.astype('datetime64[D]')
+    months = values.astype('datetime64[M]')
+
+    return ((months.astype(np.int64) % 12) == 1) & ((days - months.astype('datetime64[D]')).astype(np.int64) == 28)
+
+
+def compute_calendar_features(rent_date_hour) -> pd.DataFrame:
+    """
+    Computes the holiday and weekend flags and the sine and cosine encodings of hour, month,
+    day and weekday in one vectorized pass over the datetime64 values.
+
+    Args:
+        rent_date_hour: The datetime values (Series, Index or array).
+
+    Returns:
+        pd.DataFrame: The CALENDAR_FEATURES, aligned with the index of `rent_date_hour` if it is a Series.
+    """
+    values = _to_datetime64(rent_date_hour)
+
+    days = values.astype('datetime64[D]')
+    months = values.astype('datetime64[M]')
+
+    components = {
+        'hour': (values - days).astype('timedelta64[h]').astype(np.int64) + 1,
+        'month': months.astype(np.int64) % 12 + 1,
+        'day': (days - months.astype('datetime64[D]')).astype(np.int64) + 1,
+        # 1970-01-01 was a Thursday
+        'weekday': (days.astype(np.int64) + 3) % 7 + 1
+    }
+
+    years = values.astype('datetime64[Y]').astype(np.int64) + 1970
+    bay_holidays = get_bavarian_holidays(tuple(np.unique(years).tolist()))
+
+    features = {
+        'is_holiday': np.isin(days, bay_holidays).astype(np.int64),
+        'is_weekend': (components['weekday'] >= 6).astype(np.int64)
+    }
+    for component, period in PERIODS.items():
+        angle = 2 * np.pi * components[component] / period
+        features[f'{component}_sin'] = np.sin(angle)
+        features[f'{component}_cos'] = np.cos(angle)
+
+    index = rent_date_hour.index if isinstance(rent_date_hour, pd.Series) else None
+    return pd.DataFrame(features, columns=CALENDAR_FEATURES, index=index)
@@ -5,86 +5,160 @@ from pathlib import Path
 import requests, csv, json
 
 from bikesharing.params import *
-
-from google.cloud import bigquery
-from shapely.geometry import Polygon
+from bikesharing.ml_logic.cache import is_cached, load_cache, save_cache, iter_cache, CacheWriter, \
+    RAW_RENTAL_SCHEMA, WEATHER_SCHEMA
+from bikesharing.ml_logic.warehouse import SQLBackend, get_sql_backend
+from bikesharing.ml_logic.weather import fetch_weather_history
+from bikesharing.ml_logic.instrumentation import span
+from datetime import date
 
 def get_raw_data(
         gcp_project:str,
         query:str,
         cache_path:Path,
-        data_has_header=True
+        columns:list=None,
+        backend:SQLBackend=None
     ) -> pd.DataFrame:
     """
     Retrieve `query` data from BigQuery, or from `cache_dir` if a file exists
     Store in `cache_dir` if retrieved from BigQuery for future use
-     * cache_path: the path where to look for (or store) the cached data,
+     * cache_path: the path where to look for (or store) the cached data, the
+            suffix is set according to CACHE_FORMAT,
             e. g.: cache_path = Path(LOCAL_DATA_PATH).joinpath("raw",
-                                f"raw_{START_YEAR}_{END_YEAR}.csv")
+                                f"raw_{START_YEAR}_{END_YEAR}.parquet")
      * query: the string containing the query which should be run on the table
             e. g.: query = f'''
                         SELECT *
                         FROM `{GCP_PROJECT}.{BQ_DATASET}.raw_data_mvg`
                         '''
+     * columns: the columns to load from the cache, defaults to all columns
+     * backend: the SQL backend running the query, defaults to SQL_BACKEND
     """
 
-    if cache_path.is_file():
-        print(Fore.BLUE + "\nLoad rental_data from local CSV..." + Style.RESET_ALL)
-        df = pd.read_csv(cache_path, header='infer' if data_has_header else None)
+    if is_cached(cache_path):
+        print(Fore.BLUE + f"\nLoad rental_data from local {CACHE_FORMAT} cache..." + Style.RESET_ALL)
+        with span('data.load_raw_cache', format=CACHE_FORMAT) as s:
+            df = load_cache(cache_path, columns=columns, schema=RAW_RENTAL_SCHEMA)
+            s.set(rows_out=len(df))
     else:
-        print(Fore.BLUE + "\nLoad rental_data from BigQuery server..." + Style.RESET_ALL)
-        client = bigquery.Client(project=gcp_project)
-        query_job = client.query(query)
-        result = query_job.result()
-        df = result.to_dataframe()
+        if backend is None:
+            backend = get_sql_backend(gcp_project=gcp_project)
+        print(Fore.BLUE + f"\nLoad rental_data from {type(backend).__name__}..." + Style.RESET_ALL)
+        with span('data.query_raw', backend=type(backend).__name__) as s:
+            df = backend.query(query)
+            s.set(rows_out=len(df))
+
+        df = _normalize_timestamps(df)
 
-        # Store as CSV if the BQ query returned at least one valid line
+        # Store in the cache if the BQ query returned at least one valid line
         if df.shape[0] > 1:
-            df.to_csv(cache_path, header=data_has_header, index=False)
+            save_cache(df, cache_path, schema=RAW_RENTAL_SCHEMA)
             print(f'columns: {df.columns}')
 
+        if columns is not None:
+            df = df[columns]
+
     print(f"✅ Data loaded, with shape {df.shape}")
 
     return df
 
-def get_weather_data(
+def _normalize_timestamps(df: pd.DataFrame) -> pd.DataFrame:
+    # The warehouses return timestamps as text (SQLite) or in UTC (BigQuery), the cache stores them tz-naive
+    for column in ['STARTTIME', 'rent_date_hour']:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column])
+            if df[column].dt.tz is not None:
+                df[column] = df[column].dt.tz_convert(None)
+    return df
+
+
+def get_new_raw_data(
+        gcp_project:str,
+        query:str,
+        backend:SQLBackend=None
+    ) -> pd.DataFrame:
+    """
+    Like get_raw_data, but always runs the query and does not cache the result. For the
+    rentals appended to the processed store, whose query changes with every append.
+    """
+    if backend is None:
+        backend = get_sql_backend(gcp_project=gcp_project)
+    print(Fore.BLUE + f"\nLoad new rental_data from {type(backend).__name__}..." + Style.RESET_ALL)
+
+    with span('data.query_new_raw', backend=type(backend).__name__) as s:
+        df = _normalize_timestamps(backend.query(query))
+        s.set(rows_out=len(df))
+
+    print(f"✅ Data loaded, with shape {df.shape}")
+
+    return df
+
+
+def iter_raw_data(
+        gcp_project:str,
+        query:str,
         cache_path:Path,
-        data_has_header=True):
+        columns:list=None,
+        chunk_size:int=PREPROCESS_CHUNK_SIZE,
+        backend:SQLBackend=None
+    ):
     """
-    Retrieve the historical weather data from 'start_year' to 'end_year' from the
-    Open Meteo Api.
+    Like get_raw_data, but yields the data in chunks of at most `chunk_size` rows, so that
+    only one chunk is in memory at a time. The chunks of a query result are written to
+    the cache as they arrive.
     """
+    if is_cached(cache_path):
+        print(Fore.BLUE + f"\nStream rental_data from local {CACHE_FORMAT} cache in chunks of {chunk_size:,} rows..." + Style.RESET_ALL)
+        for df in iter_cache(cache_path, columns=columns, chunk_size=chunk_size, schema=RAW_RENTAL_SCHEMA):
+            yield df
+        return
 
-    if cache_path.is_file():
-        print(Fore.BLUE + "\nLoad weather_data from local CSV..." + Style.RESET_ALL)
-        historical_weather_data_df = pd.read_csv(cache_path, header='infer' if data_has_header else None)
-    else:
-        base_url = 'https://archive-api.open-meteo.com/v1/archive'
+    if backend is None:
+        backend = get_sql_backend(gcp_project=gcp_project)
+    print(Fore.BLUE + f"\nStream rental_data from {type(backend).__name__} in chunks of {chunk_size:,} rows..." + Style.RESET_ALL)
 
-        params = {
-            'latitude': 48.70,
-            'longitude': 13.46,
-            'start_date' : f'{START_YEAR}-01-01',
-            'end_date' : f'{END_YEAR}-12-31',
-            'hourly': ['temperature_2m', 'relativehumidity_2m', 'apparent_temperature','windspeed_10m','precipitation']
-        }
+    with CacheWriter(cache_path, schema=RAW_RENTAL_SCHEMA) as writer:
+        for df in backend.query_chunks(query, chunk_size):
+            df = _normalize_timestamps(df)
+            writer.write(df)
+            yield df[columns] if columns is not None else df
 
-        historical_weather_data = requests.get(base_url , params=params).json()
+    print(f"✅ Data streamed, {writer.rows:,} rows")
 
-        if 'hourly' not in historical_weather_data.keys():
-            print('''Error while requesting from the API. Please check if the API is stil working with the following URL:\nhttps://archive-api.open-meteo.com/v1/archive?latitude=48.70&longitude=13.46&start_date=2019-01-01&end_date=2022-12-31&hourly=temperature_2m,relativehumidity_2m,apparent_temperature,precipitation,windspeed_10m\nIf the API is working check your code!''')
+def get_weather_data(
+        cache_path:Path,
+        columns:list=None):
+    """
+    Retrieve the historical weather data from 'start_year' to 'end_year' from the
+    Open Meteo Api (in cached chunks, see weather.fetch_weather_history), or from
+    `cache_path` if a file exists.
+    The 'time' column is returned as datetime64.
+    """
 
-        historical_weather_data_df = pd.DataFrame(historical_weather_data['hourly'])
+    if is_cached(cache_path):
+        print(Fore.BLUE + f"\nLoad weather_data from local {CACHE_FORMAT} cache..." + Style.RESET_ALL)
+        with span('data.load_weather_cache', format=CACHE_FORMAT) as s:
+            historical_weather_data_df = load_cache(cache_path, columns=columns, schema=WEATHER_SCHEMA)
+            s.set(rows_out=len(historical_weather_data_df))
+    else:
+        with span('data.fetch_weather', chunk=WEATHER_CHUNK, n_workers=WEATHER_N_WORKERS) as s:
+            historical_weather_data_df = fetch_weather_history(date(START_YEAR, 1, 1), date(END_YEAR, 12, 31))
+            s.set(rows_out=len(historical_weather_data_df))
 
         if historical_weather_data_df.shape[0] > 1:
-            historical_weather_data_df.to_csv(cache_path, header=data_has_header, index=False)
+            save_cache(historical_weather_data_df, cache_path, schema=WEATHER_SCHEMA)
             print(f'columns: {historical_weather_data_df.columns}')
 
+        if columns is not None:
+            historical_weather_data_df = historical_weather_data_df[columns]
+
     print(f"✅ Data loaded, with shape {historical_weather_data_df.shape}")
 
     return historical_weather_data_df
 
 def get_polygons():
+    from shapely.geometry import Polygon
+
     polygons = {}
     # load coordinates for districts from csv and sava them in a dict of Polygons
     with open('../raw_data/polygons.csv', 'r') as csvfile:
@@ -95,3 +169,21 @@ def get_polygons():
     return polygons
 
 # define get_processed data
+
+
+def get_new_weather_data(since, end_date:date) -> pd.DataFrame:
+    """
+    Retrieve the hourly weather from the hour `since` on until `end_date` (in cached chunks,
+    see weather.fetch_weather_history), for the hours appended to the processed store.
+    """
+    since = pd.Timestamp(since)
+
+    with span('data.fetch_new_weather', chunk=WEATHER_CHUNK) as s:
+        weather_df = fetch_weather_history(since.date(), end_date)
+        # The archive has no values for the latest hours yet, they are appended with a later run
+        weather_df = weather_df[weather_df['time'] >= since].dropna().reset_index(drop=True)
+        s.set(rows_out=len(weather_df))
+
+    print(f"✅ Data loaded, with shape {weather_df.shape}")
+
+    return weather_df
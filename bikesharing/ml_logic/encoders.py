@@ -1,48 +1,106 @@
 import pandas as pd
 import numpy as np
-import geopandas as gpd
-from shapely.geometry import Point
+import shapely
+from shapely import STRtree
+from functools import lru_cache
 
-from sklearn.preprocessing import OneHotEncoder
+from bikesharing.ml_logic.calendar_features import compute_calendar_features
 
 
-def get_district_from_polygons(rental_df: pd.DataFrame, polygons: dict) -> pd.DataFrame:
+def build_district_index(polygons: dict) -> tuple:
     """
-    Performs a spatial join between the rental DataFrame and polygons.
+    Builds (or returns the cached) spatial index over the district polygons.
 
     Args:
-        rental_df (pd.DataFrame): The rental DataFrame.
         polygons (dict): The dictionary of polygons.
 
     Returns:
-        pd.DataFrame: The DataFrame with the spatial join result.
+        tuple: The district names, the prepared polygons and an STRtree over the polygons.
+    """
+    key = tuple((district, polygon.wkb) for district, polygon in polygons.items())
+
+    return _build_district_index(key)
+
+
+@lru_cache(maxsize=8)
+def _build_district_index(key: tuple) -> tuple:
+    names = np.array([district for district, _ in key], dtype=object)
+    geometries = shapely.from_wkb([wkb for _, wkb in key])
+
+    # Prepared geometries make the repeated point-in-polygon checks cheap
+    shapely.prepare(geometries)
+
+    return names, geometries, STRtree(geometries)
+
+
+def match_districts(lon: np.ndarray, lat: np.ndarray, polygons: dict) -> tuple:
+    """
+    Finds the districts containing each point.
+
+    The coordinates are deduplicated before querying an STRtree of the district polygons
+    and the matches are scattered back to all points. A point lying within several
+    (overlapping) polygons yields one match per district, a point outside of all polygons none.
+
+    Args:
+        lon (np.ndarray): The longitudes of the points.
+        lat (np.ndarray): The latitudes of the points.
+        polygons (dict): The dictionary of polygons.
+
+    Returns:
+        tuple: The index of the point of every match, the code of its district (ordered by
+            point) and the district names the codes refer to.
     """
-    # Create a DataFrame from the polygons dictionary
-    polygons_df = pd.DataFrame.from_dict(polygons, orient='index', columns=['geometry'])
-    # Reset the index to make the 'district' column a regular column
-    polygons_df = polygons_df.reset_index().rename(columns={'index': 'district'})
+    names, geometries, tree = build_district_index(polygons)
+
+    # Deduplicate the coordinates, rentals mostly start at a limited number of stations
+    lon_codes, unique_lon = pd.factorize(np.asarray(lon, dtype=np.float64), use_na_sentinel=False)
+    lat_codes, unique_lat = pd.factorize(np.asarray(lat, dtype=np.float64), use_na_sentinel=False)
+    inverse, unique_codes = pd.factorize(lon_codes.astype(np.int64) * len(unique_lat) + lat_codes)
+
+    # Create all point geometries in one shot and query the spatial index
+    points = shapely.points(unique_lon[unique_codes // len(unique_lat)],
+                            unique_lat[unique_codes % len(unique_lat)])
+    point_idx, polygon_idx = tree.query(points)
 
-    # Create a GeoDataFrame from the polygons DataFrame
-    polygons_gdf = gpd.GeoDataFrame(polygons_df)
-    # Set the geometry column in the polygons_gdf GeoDataFrame
-    polygons_gdf.set_geometry('geometry', inplace=True)
+    # Keep the bounding box candidates which are actually within the (prepared) polygons
+    is_within = shapely.contains(geometries[polygon_idx], points[point_idx])
+    point_idx, polygon_idx = point_idx[is_within], polygon_idx[is_within]
 
-    # Create a GeoDataFrame from the point data
-    geometry = [Point(row['STARTLON'], row['STARTLAT']) for _, row in rental_df.iterrows()]
-    rental_gdf = gpd.GeoDataFrame(rental_df, geometry=geometry)
-    # Set the geometry column in the rental_gdf GeoDataFrame
-    rental_gdf.set_geometry('geometry', inplace=True)
+    # Group the matches by point
+    order = np.argsort(point_idx, kind='stable')
+    point_idx, polygon_idx = point_idx[order], polygon_idx[order]
+    matches_per_point = np.bincount(point_idx, minlength=len(unique_codes))
+    first_match_per_point = np.cumsum(matches_per_point) - matches_per_point
 
-    # Perform the spatial join
-    rental_geo_df = gpd.sjoin(rental_gdf, polygons_gdf, predicate='within')
+    # Scatter the matches back to the points
+    matches_per_row = matches_per_point[inverse]
+    row_idx = np.repeat(np.arange(len(inverse)), matches_per_row)
+    match_rank = np.arange(len(row_idx)) - np.repeat(np.cumsum(matches_per_row) - matches_per_row, matches_per_row)
+    district_codes = polygon_idx[first_match_per_point[inverse[row_idx]] + match_rank]
+
+    return row_idx, district_codes, names
+
+
+def get_district_from_polygons(rental_df: pd.DataFrame, polygons: dict) -> pd.DataFrame:
+    """
+    Performs a spatial join between the rental DataFrame and polygons (see match_districts).
+
+    Args:
+        rental_df (pd.DataFrame): The rental DataFrame.
+        polygons (dict): The dictionary of polygons.
+
+    Returns:
+        pd.DataFrame: The DataFrame with the spatial join result.
+    """
+    row_idx, district_codes, names = match_districts(rental_df['STARTLON'], rental_df['STARTLAT'], polygons)
 
     # Drop unnecessary columns
-    rental_geo_df = rental_geo_df.drop(columns=['geometry', 'index_right', 'STARTLON', 'STARTLAT'])
+    rental_geo_df = rental_df.drop(columns=['STARTLON', 'STARTLAT']).iloc[row_idx].copy()
+    rental_geo_df['district'] = names[district_codes]
 
     return rental_geo_df
 
 
-
 def encode_district_label(rental_df: pd.DataFrame, polygons: dict) -> pd.DataFrame:
     """
     Encodes the district labels in the DataFrame using one-hot encoding.
@@ -55,6 +113,8 @@ def encode_district_label(rental_df: pd.DataFrame, polygons: dict) -> pd.DataFra
     """
     df = get_district_from_polygons(rental_df, polygons)
 
+    from sklearn.preprocessing import OneHotEncoder
+
     # Instantiate the OneHotEncoder
     district_ohe = OneHotEncoder(sparse_output=False)
 
@@ -88,20 +148,11 @@ def encode_temporal_features(datetime_column: pd.DataFrame) -> pd.DataFrame:
     encoded_df = pd.DataFrame()
     encoded_df['rent_date_hour'] = datetime_column['rent_date_hour']
 
-    # Extract hour, month, and day from the datetime_column
-    encoded_df['hour'] = datetime_column['rent_date_hour'].dt.hour.apply(lambda x: x+1)
-    encoded_df['month'] = datetime_column['rent_date_hour'].dt.month
-    encoded_df['day'] = datetime_column['rent_date_hour'].dt.day
-    encoded_df['weekday'] = datetime_column['rent_date_hour'].dt.weekday + 1
-
-
-    temporal_features = ['hour', 'month', 'day' , 'weekday']
-
-    # Apply sine and cosine transformations to the temporal features
+    # Fixed periods (24 hours, 12 months, 31 days, 7 weekdays), so that a single day is encoded like in training
+    temporal_features = [f'{feature}_{function}' for feature in ['hour', 'month', 'day', 'weekday']
+                         for function in ['sin', 'cos']]
+    calendar_df = compute_calendar_features(datetime_column['rent_date_hour'])
     for feature in temporal_features:
-        encoded_df[f'{feature}_sin'] = np.sin(2 * np.pi * encoded_df[feature] / encoded_df[feature].max())
-        encoded_df[f'{feature}_cos'] = np.cos(2 * np.pi * encoded_df[feature] / encoded_df[feature].max())
-
-    encoded_df.drop(columns=temporal_features, inplace=True)
+        encoded_df[feature] = calendar_df[feature].to_numpy()
 
     return encoded_df
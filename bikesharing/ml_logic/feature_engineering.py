@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
-import holidays
-from datetime import date
+
+from bikesharing.ml_logic.calendar_features import compute_calendar_features, CALENDAR_FEATURES
 
 # Function for Holiday Flag
 def is_holiday(data: pd.DataFrame):
@@ -14,16 +14,9 @@ def is_holiday(data: pd.DataFrame):
     Returns:
         DataFrame: A DataFrame containing the Holiday Flags.
     """
-    df = data.copy()
+    df = data[['rent_date_hour']].copy()
     df['rent_date_hour'] = pd.to_datetime(df['rent_date_hour'])
-
-    # Extract date from rent_date_hour
-    date_column = df['rent_date_hour'].dt.date
-
-    # Checking for the Bayern Holidays
-    bay_holidays = holidays.CountryHoliday('DE', prov='BY')
-
-    df['is_holiday'] = date_column.apply(lambda x: 1 if x in bay_holidays else 0)
+    df['is_holiday'] = compute_calendar_features(df['rent_date_hour'])['is_holiday']
 
     return df[['rent_date_hour', 'is_holiday']]
 
@@ -39,16 +32,32 @@ def is_weekend(data: pd.DataFrame):
     Returns:
         DataFrame: A DataFrame containing the Weekend Flags.
     """
-    df = data.copy()
+    df = data[['rent_date_hour']].copy()
     df['rent_date_hour'] = pd.to_datetime(df['rent_date_hour'])
+    df['is_weekend'] = compute_calendar_features(df['rent_date_hour'])['is_weekend']
 
-    # Extract date from rent_date_hour
-    date_column = data['rent_date_hour'].dt.date
+    return df[['rent_date_hour', 'is_weekend']]
 
-    # Checking if Day is a Weekend or not
-    df["is_weekend"] = date_column.apply(lambda x: 1 if x.weekday() >= 5 else 0)
 
-    return df[['rent_date_hour', 'is_weekend']]
+def add_calendar_features(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the holiday and weekend flags and the encoded temporal features, computed
+    in a single vectorized pass without merges. Shared by training and inference.
+
+    Args:
+        data (pd.DataFrame): The input DataFrame with a rent_date_hour column.
+
+    Returns:
+        DataFrame: The input DataFrame with the calendar features.
+    """
+    df = data.copy()
+    df['rent_date_hour'] = pd.to_datetime(df['rent_date_hour'])
+
+    calendar_df = compute_calendar_features(df['rent_date_hour'])
+    for column in CALENDAR_FEATURES:
+        df[column] = calendar_df[column].to_numpy()
+
+    return df
 
 
 def feature_selection(data, list):
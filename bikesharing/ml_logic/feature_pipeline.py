@@ -0,0 +1,104 @@
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from bikesharing.ml_logic.calendar_features import compute_calendar_features, CALENDAR_FEATURES
+
+
+# Features scaled to [0, 1] with the min and max seen in training, the others pass through
+SCALED_FEATURES = ['temperature_2m', 'apparent_temperature','windspeed_10m', 'precipitation',
+            'hour_sin', 'hour_cos', 'month_sin', 'month_cos', 'day_sin', 'day_cos',
+            'weekday_sin' , 'weekday_cos']
+
+
+class FeaturePipeline:
+    """
+    The fitted feature transform shared by training and inference: calendar features,
+    feature selection and min-max scaling compiled into a single affine transform
+    X * scale + offset over the selected features.
+    """
+
+    def __init__(self, features: list, scale, offset, version: str = None):
+        self.features = list(features)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.offset = np.asarray(offset, dtype=np.float64)
+        self.version = version or time.strftime("%Y%m%d-%H%M%S")
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame, features: list) -> 'FeaturePipeline':
+        """
+        Fits the scaling like a MinMaxScaler on the SCALED_FEATURES among `features`.
+
+        Args:
+            df (pd.DataFrame): The training data including the calendar features.
+            features (list): The features of the model, in order.
+
+        Returns:
+            FeaturePipeline: The fitted pipeline.
+        """
+        scale = np.ones(len(features))
+        offset = np.zeros(len(features))
+
+        for i, feature in enumerate(features):
+            if feature in SCALED_FEATURES:
+                values = df[feature].to_numpy(dtype=np.float64)
+                data_min, data_range = np.nanmin(values), np.nanmax(values) - np.nanmin(values)
+                # Like sklearn, a constant feature is only shifted
+                scale[i] = 1 / data_range if data_range != 0 else 1
+                offset[i] = -data_min * scale[i]
+
+        return cls(features, scale, offset)
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Applies the pipeline. The calendar features are computed from rent_date_hour if missing.
+
+        Args:
+            df (pd.DataFrame): The weather data (and calendar features) per hour.
+
+        Returns:
+            np.ndarray: The model input of shape (rows, features).
+        """
+        missing = [feature for feature in self.features if feature not in df.columns]
+
+        if missing and set(missing) <= set(CALENDAR_FEATURES) and 'rent_date_hour' in df.columns:
+            calendar_df = compute_calendar_features(df['rent_date_hour'])
+            columns = [df[feature].to_numpy(dtype=np.float64) if feature in df.columns
+                       else calendar_df[feature].to_numpy(dtype=np.float64) for feature in self.features]
+            X = np.column_stack(columns)
+        else:
+            X = df[self.features].to_numpy(dtype=np.float64)
+
+        return X * self.scale + self.offset
+
+    def transform_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Applies the pipeline and returns the model input with the feature names as columns.
+        """
+        return pd.DataFrame(self.transform(df), columns=self.features, index=df.index)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({'feature': self.features, 'scale': self.scale, 'offset': self.offset})
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, version: str = None) -> 'FeaturePipeline':
+        return cls(df['feature'].tolist(), df['scale'].to_numpy(), df['offset'].to_numpy(), version=version)
+
+    def to_dict(self) -> dict:
+        return {'version': self.version, 'features': self.features,
+                'scale': self.scale.tolist(), 'offset': self.offset.tolist()}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'FeaturePipeline':
+        return cls(d['features'], d['scale'], d['offset'], version=d.get('version'))
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> 'FeaturePipeline':
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
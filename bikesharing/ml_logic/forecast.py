@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+import requests
+from colorama import Fore, Style
+
+from bikesharing.params import *
+from bikesharing.ml_logic.weather import fetch_weather_chunk, LATITUDE, LONGITUDE
+
+
+class ForecastProvider:
+    """
+    Provides the hourly weather forecast of a day for the predictions.
+
+    Forecasts are cached in memory and on disk, keyed by location, day and the hour the
+    forecast was requested in (forecasts are updated hourly), and expire after `ttl` seconds.
+    The files of past forecast hours are removed with every write.
+    Concurrent callers asking for the same key share one upstream request.
+    """
+
+    def __init__(self,
+                 base_url: str = FORECAST_API_URL,
+                 ttl: float = FORECAST_TTL_SECONDS,
+                 cache_dir: Path = Path(LOCAL_DATA_PATH).joinpath('forecast'),
+                 latitude: float = LATITUDE,
+                 longitude: float = LONGITUDE):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.cache_dir = Path(cache_dir)
+        self.latitude = latitude
+        self.longitude = longitude
+        self._memory = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def _get_key(self, day: date, latitude: float, longitude: float) -> tuple:
+        forecast_hour = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H')
+        return (round(latitude, 2), round(longitude, 2), day.isoformat(), forecast_hour)
+
+    def _get_cache_path(self, key: tuple) -> Path:
+        return self.cache_dir.joinpath('_'.join(str(part) for part in key) + '.json')
+
+    def _read_disk(self, key: tuple):
+        path = self._get_cache_path(key)
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if time.time() - cached['fetched_at'] > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+
+        forecast_df = pd.DataFrame(cached['hourly'])
+        forecast_df['time'] = pd.to_datetime(forecast_df['time'])
+        return cached['fetched_at'], forecast_df
+
+    def _write_disk(self, key: tuple, fetched_at: float, forecast_df: pd.DataFrame) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        hourly = forecast_df.assign(time=forecast_df['time'].dt.strftime('%Y-%m-%dT%H:%M')).to_dict(orient='list')
+
+        path = self._get_cache_path(key)
+        tmp_path = path.with_name(f'.{path.name}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'fetched_at': fetched_at, 'hourly': hourly}, f)
+        tmp_path.replace(path)
+
+        # Forecasts requested in past hours are outdated, whatever their location or day
+        for cached_path in self.cache_dir.glob('*.json'):
+            if cached_path.stem.rsplit('_', 1)[-1] != key[3]:
+                cached_path.unlink(missing_ok=True)
+
+    def get_forecast(self, day: date, latitude: float = None, longitude: float = None) -> pd.DataFrame:
+        """
+        Returns the hourly forecast of the day.
+
+        Args:
+            day (date): The day, within the forecast range of the API (about two weeks).
+            latitude (float): Defaults to the location of the provider.
+            longitude (float): Defaults to the location of the provider.
+
+        Returns:
+            pd.DataFrame: The hourly weather with a datetime64 'time' column.
+        """
+        latitude = self.latitude if latitude is None else latitude
+        longitude = self.longitude if longitude is None else longitude
+        key = self._get_key(day, latitude, longitude)
+
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and time.time() - cached[0] <= self.ttl:
+                return cached[1].copy()
+
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not is_owner:
+            # Another caller is already fetching this forecast
+            return future.result().copy()
+
+        try:
+            cached = self._read_disk(key)
+            if cached is None:
+                print(Fore.BLUE + f"\nRequest weather forecast for {day}..." + Style.RESET_ALL)
+                forecast_df = fetch_weather_chunk(self._session, day, day, base_url=self.base_url,
+                                                  latitude=latitude, longitude=longitude, max_retries=2)
+                cached = (time.time(), forecast_df)
+                self._write_disk(key, *cached)
+
+            with self._lock:
+                # Entries of past forecast hours are outdated
+                self._memory = {cached_key: value for cached_key, value in self._memory.items()
+                                if cached_key[3] == key[3]}
+                self._memory[key] = cached
+            future.set_result(cached[1])
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+        return cached[1].copy()
+
+
+_forecast_provider = None
+
+
+def get_forecast_provider() -> ForecastProvider:
+    """
+    Returns the forecast provider shared by the whole process.
+    """
+    global _forecast_provider
+    if _forecast_provider is None:
+        _forecast_provider = ForecastProvider()
+    return _forecast_provider
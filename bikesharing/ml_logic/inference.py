@@ -0,0 +1,173 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from bikesharing.params import *
+
+
+class CompiledForest:
+    """
+    The trees of several XGBoost models flattened into contiguous NumPy arrays, so that the
+    trees of all districts are evaluated together in a vectorized way.
+
+    Only 'gbtree' boosters with the 'reg:squarederror' objective (identity link) are supported.
+    Like XGBoost, features and split conditions are compared as float32 and NaN follows the
+    default direction of a split.
+    """
+
+    def __init__(self, models: dict):
+        self.districts = list(models)
+        self.feature_names = None
+
+        left, right, feature, threshold, default_left, value = [], [], [], [], [], []
+        roots, tree_offsets, base_scores = [], [], []
+        n_nodes, max_depth = 0, 0
+
+        for district, model in models.items():
+            booster = model.get_booster() if hasattr(model, 'get_booster') else model
+            learner = json.loads(booster.save_raw(raw_format='json'))['learner']
+
+            objective = learner['objective']['name']
+            if objective != 'reg:squarederror':
+                raise ValueError(f"Objective '{objective}' of {district} is not supported by the compiled forest")
+
+            gradient_booster = learner['gradient_booster']
+            if gradient_booster['name'] != 'gbtree':
+                raise ValueError(f"Booster '{gradient_booster['name']}' of {district} is not supported by the compiled forest")
+
+            if self.feature_names is None:
+                self.feature_names = booster.feature_names
+
+            trees = gradient_booster['model']['trees']
+
+            # Predict like XGBoost does, i. e. up to the best iteration if early stopping was used
+            best_iteration = booster.attr('best_iteration')
+            if best_iteration is not None:
+                num_parallel_tree = int(gradient_booster['model']['gbtree_model_param']['num_parallel_tree'])
+                trees = trees[:(int(best_iteration) + 1) * num_parallel_tree]
+
+            tree_offsets.append(len(roots))
+            base_scores.append(float(learner['learner_model_param']['base_score']))
+
+            for tree in trees:
+                tree_left = np.asarray(tree['left_children'], dtype=np.int64)
+                tree_right = np.asarray(tree['right_children'], dtype=np.int64)
+                is_leaf = tree_left == -1
+
+                # Node indices are made global, leaves point to themselves
+                own_index = np.arange(len(tree_left)) + n_nodes
+                left.append(np.where(is_leaf, own_index, tree_left + n_nodes))
+                right.append(np.where(is_leaf, own_index, tree_right + n_nodes))
+                feature.append(np.asarray(tree['split_indices'], dtype=np.int64))
+                threshold.append(np.asarray(tree['split_conditions'], dtype=np.float32))
+                default_left.append(np.asarray(tree['default_left'], dtype=bool))
+                # The leaf value is stored in the split condition of a leaf
+                value.append(np.where(is_leaf, np.asarray(tree['split_conditions'], dtype=np.float64), 0.0))
+
+                roots.append(n_nodes)
+                n_nodes += len(tree_left)
+                max_depth = max(max_depth, _get_tree_depth(tree_left, tree_right))
+
+            if len(roots) == tree_offsets[-1]:
+                raise ValueError(f"The model of {district} has no trees")
+
+        self.left = np.concatenate(left)
+        self.right = np.concatenate(right)
+        self.feature = np.concatenate(feature)
+        self.threshold = np.concatenate(threshold)
+        self.default_left = np.concatenate(default_left)
+        self.value = np.concatenate(value)
+        self.roots = np.asarray(roots, dtype=np.int64)
+        self.tree_offsets = np.asarray(tree_offsets, dtype=np.int64)
+        self.base_scores = np.asarray(base_scores, dtype=np.float64)
+        self.max_depth = max_depth
+
+    def predict(self, X, max_elements: int = 2**22) -> np.ndarray:
+        """
+        Predicts with the models of all districts.
+
+        Args:
+            X: The features, as DataFrame (columns are ordered like at training) or array.
+            max_elements (int): The rows are processed in chunks of at most max_elements (trees x rows).
+
+        Returns:
+            np.ndarray: The predictions of shape (districts, rows).
+        """
+        if isinstance(X, pd.DataFrame):
+            X = X[self.feature_names] if self.feature_names is not None else X
+            X = X.to_numpy()
+        X = np.asarray(X, dtype=np.float32)
+
+        n_trees = len(self.roots)
+        chunk_size = max(1, max_elements // n_trees)
+        predictions = np.empty((len(self.districts), X.shape[0]), dtype=np.float32)
+
+        for start in range(0, X.shape[0], chunk_size):
+            X_chunk = X[start:start + chunk_size]
+            rows = np.arange(X_chunk.shape[0])[None, :]
+
+            # Walk all trees for all rows one level at a time, leaves point to themselves
+            node = np.repeat(self.roots[:, None], X_chunk.shape[0], axis=1)
+            for _ in range(self.max_depth):
+                x = X_chunk[rows, self.feature[node]]
+                go_left = np.where(np.isnan(x), self.default_left[node], x < self.threshold[node])
+                node = np.where(go_left, self.left[node], self.right[node])
+
+            leaf_values = self.value[node]
+            predictions[:, start:start + chunk_size] = (np.add.reduceat(leaf_values, self.tree_offsets, axis=0)
+                                                        + self.base_scores[:, None])
+
+        return predictions
+
+
+def _get_tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    depth, level = 0, np.array([0])
+    while True:
+        level = level[left[level] != -1]
+        if len(level) == 0:
+            return depth
+        level = np.concatenate([left[level], right[level]])
+        depth += 1
+
+
+_compiled_forest = None
+
+
+def get_compiled_forest(models: dict) -> CompiledForest:
+    """
+    Returns the compiled forest of the models, it is only recompiled when the models change.
+    """
+    global _compiled_forest
+    key = tuple((district, id(model)) for district, model in models.items())
+
+    if _compiled_forest is None or _compiled_forest[0] != key:
+        # Keeping the models referenced makes sure their ids are not reused
+        _compiled_forest = (key, dict(models), CompiledForest(models))
+
+    return _compiled_forest[2]
+
+
+def predict_districts(models: dict, X, engine: str = INFERENCE_ENGINE) -> np.ndarray:
+    """
+    Predicts the rentals of all districts for a block of feature rows (e. g. hours x days) in one call.
+
+    Args:
+        models (dict): The models by district.
+        X: The features.
+        engine (str): 'xgboost' predicts with every model, 'compiled' evaluates all trees at once.
+
+    Returns:
+        np.ndarray: The predictions of shape (districts, rows), in the order of `models`.
+    """
+    if engine == 'compiled':
+        return get_compiled_forest(models).predict(X)
+
+    if engine != 'xgboost':
+        raise ValueError(f"Unknown inference engine '{engine}', use 'xgboost' or 'compiled'")
+
+    predictions = np.empty((len(models), len(X)), dtype=np.float32)
+    for i, model in enumerate(models.values()):
+        predictions[i] = model.predict(X)
+
+    return predictions
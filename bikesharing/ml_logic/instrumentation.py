@@ -0,0 +1,286 @@
+"""
+Spans around the steps of the pipeline, recording wall time, CPU time, peak RSS and row counts.
+
+Every finished span is emitted as a structured (JSON) log line on the 'bikesharing.instrumentation'
+logger and aggregated into an optional Prometheus textfile (INSTRUMENTATION_PROMETHEUS_PATH) and
+an optional JSON trace in the Chrome trace event array format (INSTRUMENTATION_TRACE_PATH), which
+opens in chrome://tracing or Perfetto. The trace events are buffered in a bounded queue and
+appended to the trace file (the closing bracket is optional in that format), so long-running
+processes like the API service neither keep nor rewrite their whole history.
+
+When instrumentation is disabled, span() returns a shared no-op object, so that the spans can
+stay in the code permanently.
+"""
+import atexit
+import collections
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from bikesharing.params import *
+
+
+logger = logging.getLogger('bikesharing.instrumentation')
+
+_enabled = False
+_trace_path = None
+_prometheus_path = None
+
+_lock = threading.Lock()
+_span_ids = itertools.count(1)
+_current_span = contextvars.ContextVar('bikesharing_current_span', default=None)
+_trace_events = collections.deque(maxlen=INSTRUMENTATION_TRACE_BUFFER)
+_dropped_events = 0
+_last_flush = time.monotonic()
+_flush_lock = threading.Lock()
+_metrics = {}
+
+
+def get_peak_rss_mb() -> float:
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024**2 if os.uname().sysname == 'Darwin' else maxrss / 1024
+
+
+class _NoopSpan:
+    """
+    Returned by span() while instrumentation is disabled.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    A timed step of the pipeline, used as a context manager:
+
+        with span('stage.weather_merge', rows_in=len(df)) as s:
+            df = merge_weather_data(df, weather_df)
+            s.set(rows_out=len(df))
+    """
+
+    def __init__(self, name: str, rows_in: int = None, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.attributes['rows_in'] = rows_in
+        self.attributes.setdefault('rows_out', None)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.span_id = next(_span_ids)
+        self.parent_id = _current_span.get()
+        self._token = _current_span.set(self.span_id)
+        self._peak_rss_mb = get_peak_rss_mb()
+        self._start_cpu = time.process_time()
+        self._start_epoch = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_seconds = time.perf_counter() - self._start
+        cpu_seconds = time.process_time() - self._start_cpu
+        _current_span.reset(self._token)
+
+        peak_rss_mb = get_peak_rss_mb()
+        record_span(self.name,
+                    wall_seconds=wall_seconds,
+                    cpu_seconds=cpu_seconds,
+                    peak_rss_mb=peak_rss_mb,
+                    rss_growth_mb=None if peak_rss_mb is None else peak_rss_mb - self._peak_rss_mb,
+                    start=self._start_epoch,
+                    span_id=self.span_id,
+                    parent_id=self.parent_id,
+                    error=None if exc_type is None else exc_type.__name__,
+                    **self.attributes)
+        return False
+
+
+def span(name: str, rows_in: int = None, **attributes):
+    """
+    Returns a span recording the step `name` when instrumentation is enabled, a no-op otherwise.
+
+    Args:
+        name (str): The name of the step, dotted by subsystem (e. g. 'stage.raw_load', 'registry.load_model').
+        rows_in (int): The number of input rows, the output rows are set with span.set(rows_out=...).
+        **attributes: Further labels of the span (e. g. district).
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, rows_in, **attributes)
+
+
+def record_span(name: str, wall_seconds: float, cpu_seconds: float = None, peak_rss_mb: float = None,
+                start: float = None, **attributes) -> None:
+    """
+    Emits a span measured elsewhere, e. g. in a worker process whose result reports its timings.
+    """
+    global _dropped_events
+    if not _enabled:
+        return
+
+    record = {'span': name, 'wall_seconds': wall_seconds, 'cpu_seconds': cpu_seconds,
+              'peak_rss_mb': peak_rss_mb, 'pid': os.getpid(), **attributes}
+    record.setdefault('parent_id', _current_span.get())
+
+    logger.info(json.dumps(record, default=str))
+
+    with _lock:
+        metrics = _metrics.setdefault(name, {'count': 0, 'errors': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                             'rows_in': 0, 'rows_out': 0})
+        metrics['count'] += 1
+        metrics['errors'] += record.get('error') is not None
+        metrics['wall_seconds'] += wall_seconds
+        metrics['cpu_seconds'] += cpu_seconds or 0.0
+        metrics['rows_in'] += record.get('rows_in') or 0
+        metrics['rows_out'] += record.get('rows_out') or 0
+
+        if _trace_path is not None:
+            _dropped_events += len(_trace_events) == _trace_events.maxlen
+            start = start if start is not None else time.time() - wall_seconds
+            _trace_events.append({
+                'name': name, 'ph': 'X', 'ts': int(start * 1e6), 'dur': int(wall_seconds * 1e6),
+                'pid': record['pid'], 'tid': record.pop('tid', threading.get_ident()),
+                'args': {key: value for key, value in record.items() if key not in ('span', 'pid')}
+            })
+
+    # The files are written when a top-level step finishes, at most every INSTRUMENTATION_FLUSH_SECONDS
+    if record['parent_id'] is None and time.monotonic() - _last_flush >= INSTRUMENTATION_FLUSH_SECONDS:
+        flush()
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # The Prometheus textfile collector must never see a partially written file
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def get_prometheus_metrics() -> str:
+    """
+    Returns the aggregated spans in the Prometheus text exposition format.
+    """
+    series = [
+        ('bikesharing_span_count_total', 'counter', 'Number of finished spans', 'count'),
+        ('bikesharing_span_errors_total', 'counter', 'Number of spans that raised an exception', 'errors'),
+        ('bikesharing_span_wall_seconds_total', 'counter', 'Wall time spent in the spans', 'wall_seconds'),
+        ('bikesharing_span_cpu_seconds_total', 'counter', 'CPU time spent in the spans', 'cpu_seconds'),
+        ('bikesharing_span_rows_in_total', 'counter', 'Rows passed into the spans', 'rows_in'),
+        ('bikesharing_span_rows_out_total', 'counter', 'Rows returned by the spans', 'rows_out'),
+    ]
+    with _lock:
+        metrics = {name: dict(values) for name, values in _metrics.items()}
+
+    lines = []
+    for metric, metric_type, help_text, key in series:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {metric_type}']
+        lines += [f'{metric}{{span="{name}"}} {values[key]}' for name, values in sorted(metrics.items())]
+
+    peak_rss_mb = get_peak_rss_mb()
+    if peak_rss_mb is not None:
+        lines += ['# HELP bikesharing_peak_rss_bytes Peak resident set size of the process',
+                  '# TYPE bikesharing_peak_rss_bytes gauge',
+                  f'bikesharing_peak_rss_bytes {int(peak_rss_mb * 1024**2)}']
+
+    return '\n'.join(lines) + '\n'
+
+
+def _append_trace(events: list) -> None:
+    if os.path.exists(_trace_path) and os.path.getsize(_trace_path) > INSTRUMENTATION_TRACE_MAX_MB * 1024**2:
+        os.replace(_trace_path, f'{_trace_path}.1')
+
+    new_file = not os.path.exists(_trace_path) or os.path.getsize(_trace_path) == 0
+    if new_file:
+        os.makedirs(os.path.dirname(os.path.abspath(_trace_path)), exist_ok=True)
+
+    lines = ',\n'.join(json.dumps(event, default=str) for event in events)
+    with open(_trace_path, 'a') as f:
+        f.write(('[\n' if new_file else ',\n') + lines)
+
+
+def flush() -> None:
+    """
+    Writes the Prometheus textfile and appends the buffered events to the JSON trace, if configured.
+    """
+    global _last_flush, _dropped_events
+
+    with _flush_lock:
+        _last_flush = time.monotonic()
+
+        if _prometheus_path is not None:
+            _write_atomic(_prometheus_path, get_prometheus_metrics())
+
+        if _trace_path is not None:
+            with _lock:
+                events = list(_trace_events)
+                _trace_events.clear()
+                dropped, _dropped_events = _dropped_events, 0
+            if dropped:
+                logger.warning(json.dumps({'span': 'instrumentation.dropped_trace_events', 'count': dropped}))
+            if events:
+                _append_trace(events)
+
+
+def enable(trace_path: str = None, prometheus_path: str = None) -> None:
+    """
+    Enables the instrumentation. The structured logs go to the 'bikesharing.instrumentation'
+    logger, which writes to stderr unless the application configured a handler.
+
+    Args:
+        trace_path (str): Path of the JSON trace, None to not write one.
+        prometheus_path (str): Path of the Prometheus textfile, None to not write one.
+    """
+    global _enabled, _trace_path, _prometheus_path
+    _trace_path, _prometheus_path = trace_path, prometheus_path
+
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    if not _enabled:
+        atexit.register(flush)
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    if _enabled:
+        flush()
+        atexit.unregister(flush)
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+if INSTRUMENTATION:
+    enable(INSTRUMENTATION_TRACE_PATH, INSTRUMENTATION_PROMETHEUS_PATH)
@@ -1,6 +1,50 @@
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Tuple, Sequence
+from numpy.lib.stride_tricks import sliding_window_view
+from functools import lru_cache
+from typing import Dict, Iterator, List, Tuple, Sequence
+
+from bikesharing.params import *
+
+def get_fold_starts(
+    n_timesteps: int,
+    fold_length: int,
+    fold_stride: int) -> np.ndarray:
+    """
+    Returns the first index of every fold of `fold_length` timesteps, taken every `fold_stride` timesteps
+
+    Args:
+        n_timesteps (int): Number of timesteps of the whole time series
+        fold_length (int): How long each fold should be in rows
+        fold_stride (int): How many timesteps to move forward between taking each fold
+
+    Returns:
+        np.ndarray: The start index of each fold
+    """
+    return np.arange(0, max(n_timesteps - fold_length + 1, 0), fold_stride)
+
+
+def get_fold_views(
+    values: np.ndarray,
+    fold_length: int,
+    fold_stride: int) -> np.ndarray:
+    """
+    Strided view of all folds of a time series array of shape (n_timesteps, n_features), no data is copied
+
+    Args:
+        values (np.ndarray): Overall array
+        fold_length (int): How long each fold should be in rows
+        fold_stride (int): How many timesteps to move forward between taking each fold
+
+    Returns:
+        np.ndarray: A read-only view of shape (n_folds, fold_length, n_features)
+    """
+    if len(values) < fold_length:
+        return np.empty((0, fold_length) + values.shape[1:], dtype=values.dtype)
+
+    windows = sliding_window_view(values, fold_length, axis=0)[::fold_stride]
+    return np.moveaxis(windows, -1, 1)
+
 
 def get_folds(
     df: pd.DataFrame,
@@ -19,63 +63,86 @@ def get_folds(
     Returns:
         List[pd.DataFrame]: A list where each fold is a dataframe within
     """
-    folds = []
-    for idx in range(0, len(df), fold_stride):
-        # Exits the loop as soon as the last fold index would exceed the last index
-        if (idx + fold_length) > len(df):
-            break
-        fold = df.iloc[idx:idx + fold_length, :]
-        folds.append(fold)
-    return folds
-
-def train_test_indices(fold:pd.DataFrame,
-                    train_test_ratio: float,
-                    input_length: int) -> Tuple[pd.DataFrame]:
-    """From a fold dataframe, take a train dataframe and test dataframe based on
-    the split ratio.
-    - df_train contains all the timesteps until round(train_test_ratio * len(fold))
-    - df_test contains all the timesteps needed to create all (X_test, y_test) tuples
-
-    Args:
-        fold (pd.DataFrame): A fold of timesteps
-        train_test_ratio (float): The ratio between train and test 0-1
-        input_length (int): How long each X_i will be
+    return [df.iloc[idx:idx + fold_length, :] for idx in get_fold_starts(len(df), fold_length, fold_stride)]
 
-    Returns:
-        Tuple[pd.DataFrame]: A tuple of two dataframes (fold_train, fold_test)
-    """
 
-def train_test_split(fold:pd.DataFrame,
+def train_test_split(fold,
                      train_test_ratio: float,
-                     input_length: int) -> Tuple[pd.DataFrame]:
-    """From a fold dataframe, take a train dataframe and test dataframe based on
-    the split ratio.
+                     input_length: int) -> Tuple:
+    """From a fold dataframe (or array), take a train dataframe and test dataframe based on
+    the split ratio. Arrays are split into views.
     - df_train should contain all the timesteps until round(train_test_ratio * len(fold))
     - df_test should contain all the timesteps needed to create all (X_test, y_test) tuples
 
     Args:
-        fold (pd.DataFrame): A fold of timesteps
+        fold (pd.DataFrame | np.ndarray): A fold of timesteps
         train_test_ratio (float): The ratio between train and test 0-1
         input_length (int): How long each X_i will be
 
     Returns:
-        Tuple[pd.DataFrame]: A tuple of two dataframes (fold_train, fold_test)
+        Tuple: A tuple of two dataframes (fold_train, fold_test)
     """
 
     # TRAIN SET
     last_train_idx = round(train_test_ratio * len(fold))
-    fold_train = fold.iloc[0:last_train_idx, :]
 
     # TEST SET
     first_test_idx = last_train_idx - input_length
-    fold_test = fold.iloc[first_test_idx:, :]
 
-    return (fold_train, fold_test)
+    if isinstance(fold, pd.DataFrame):
+        return (fold.iloc[0:last_train_idx, :], fold.iloc[first_test_idx:, :])
+
+    return (fold[0:last_train_idx], fold[first_test_idx:])
+
+
+def _get_values(fold, target_columns: list = None) -> Tuple[np.ndarray]:
+    # The targets default to all columns
+    if isinstance(fold, pd.DataFrame):
+        values = fold.to_numpy()
+        target_idx = fold.columns.get_indexer(target_columns) if target_columns is not None else None
+    else:
+        values = np.asarray(fold)
+        target_idx = target_columns
+
+    target_values = values if target_idx is None else values[:, target_idx]
+    return values, target_values
+
+
+def get_sequence_views(
+    fold,
+    input_length: int,
+    output_length: int,
+    target_columns: list = None) -> Tuple[np.ndarray]:
+    """Strided views of all (X_i, y_i) sequences of a fold, no data is copied
+
+    Args:
+        fold (pd.DataFrame | np.ndarray): A single fold
+        input_length (int): How long each X_i should be
+        output_length (int): How long each y_i should be
+        target_columns (list): The columns (names or indices) of y, defaults to all columns
+
+    Returns:
+        Tuple[np.ndarray]: Views of shapes (n_sequences, input_length, n_features)
+            and (n_sequences, output_length, n_targets)
+    """
+    values, target_values = _get_values(fold, target_columns)
+
+    n_sequences = len(values) - (input_length + output_length) + 1
+    if n_sequences <= 0:
+        raise ValueError(f'The fold of {len(values)} timesteps is shorter than one sequence '
+                         f'({input_length} + {output_length} timesteps)')
+
+    X_views = np.moveaxis(sliding_window_view(values[:n_sequences + input_length - 1], input_length, axis=0), -1, 1)
+    y_views = np.moveaxis(sliding_window_view(target_values[input_length:], output_length, axis=0), -1, 1)
+
+    return X_views, y_views
+
 
 def get_Xi_yi(
     fold:pd.DataFrame,
     input_length:int,
-    output_length:int) -> Tuple[pd.DataFrame]:
+    output_length:int,
+    target_columns:list=None) -> Tuple[pd.DataFrame]:
     """given a fold, it returns one sequence (X_i, y_i) as based on the desired
     input_length and output_length with the starting point of the sequence being chosen at random based
 
@@ -83,6 +150,7 @@ def get_Xi_yi(
         fold (pd.DataFrame): A single fold
         input_length (int): How long each X_i should be
         output_length (int): How long each y_i should be
+        target_columns (list): The columns of y_i, defaults to all columns
 
     Returns:
         Tuple[pd.DataFrame]: A tuple of two dataframes (X_i, y_i)
@@ -93,41 +161,113 @@ def get_Xi_yi(
     random_start = np.random.randint(first_possible_start, last_possible_start)
     X_i = fold.iloc[random_start:random_start+input_length]
     y_i = fold.iloc[random_start+input_length:
-                  random_start+input_length+output_length][[TARGET]]
+                  random_start+input_length+output_length]
+    if target_columns is not None:
+        y_i = y_i[target_columns]
 
     return (X_i, y_i)
 
+
 def get_X_y(
-    fold:pd.DataFrame,
+    fold,
     number_of_sequences:int,
     input_length:int,
-    output_length:int) -> Tuple[np.array]:
+    output_length:int,
+    target_columns:list=None,
+    random_state=None) -> Tuple[np.array]:
     """Given a fold generate X and y based on the number of desired sequences
-    of the given input_length and output_length
+    of the given input_length and output_length. The starts of the sequences are
+    sampled at random in one vectorized draw and gathered from strided views.
 
     Args:
-        fold (pd.DataFrame): Fold dataframe
+        fold (pd.DataFrame | np.ndarray): Fold dataframe
         number_of_sequences (int): The number of X_i and y_i pairs to include
         input_length (int): Length of each X_i
         output_length (int): Length of each y_i
+        target_columns (list): The columns of y, defaults to all columns
+        random_state: Seed or np.random.Generator
 
     Returns:
         Tuple[np.array]: A tuple of numpy arrays (X, y)
     """
-    X, y = [], []
+    X_views, y_views = get_sequence_views(fold, input_length, output_length, target_columns)
 
-    for i in range(number_of_sequences):
-        (Xi, yi) = get_Xi_yi(fold, input_length, output_length)
-        X.append(Xi)
-        y.append(yi)
+    starts = np.random.default_rng(random_state).integers(0, len(X_views), number_of_sequences)
 
-    return np.array(X), np.array(y)
+    return X_views[starts], y_views[starts]
 
-def get_model_params(district:str) -> dict:
+
+def iter_X_y_batches(
+    fold,
+    input_length: int,
+    output_length: int,
+    batch_size: int,
+    target_columns: list = None,
+    shuffle: bool = True,
+    random_state=None) -> Iterator[Tuple[np.ndarray]]:
+    """Streams all (X, y) sequences of a fold in batches, so that only one batch is
+    materialized at a time whatever the number of sequences
+
+    Args:
+        fold (pd.DataFrame | np.ndarray): Fold dataframe
+        input_length (int): Length of each X_i
+        output_length (int): Length of each y_i
+        batch_size (int): Number of sequences per batch
+        target_columns (list): The columns of y, defaults to all columns
+        shuffle (bool): Whether the sequences are visited in random order
+        random_state: Seed or np.random.Generator
+
+    Yields:
+        Tuple[np.ndarray]: Batches (X, y) of shapes (batch_size, input_length, n_features)
+            and (batch_size, output_length, n_targets), the last batch may be smaller
+    """
+    X_views, y_views = get_sequence_views(fold, input_length, output_length, target_columns)
+
+    if shuffle:
+        order = np.random.default_rng(random_state).permutation(len(X_views))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            yield X_views[batch], y_views[batch]
+    else:
+        for start in range(0, len(X_views), batch_size):
+            yield X_views[start:start + batch_size], y_views[start:start + batch_size]
+
+
+# Parameters of districts which are neither tuned nor in the hand-picked table
+DEFAULT_MODEL_PARAMS = {
+    'n_estimators': 100,
+    'max_depth': 5
+}
+
+
+@lru_cache(maxsize=4)
+def _get_tuned_params(version: str) -> dict:
+    from bikesharing.ml_logic.registry import load_hyperparams
+
+    return load_hyperparams(None if version == 'latest' else version)
+
+
+def invalidate_tuned_params() -> None:
+    '''
+        forgets the cached tuned parameters, e. g. after a new version was saved
+    '''
+    _get_tuned_params.cache_clear()
+
+
+def get_model_params(district:str, version:str=None) -> dict:
     '''
         returns the hyperparameters for training an XGBRegressor for the
-        specified district
+        specified district: the tuned parameters of the params store (see
+        tuning.tune_districts) in the given version (MODEL_PARAMS_VERSION by
+        default), the hand-picked table if the district was not tuned or the
+        version is 'table', DEFAULT_MODEL_PARAMS if it is not listed either
     '''
+    version = version or MODEL_PARAMS_VERSION
+    if version != 'table':
+        tuned_params = _get_tuned_params(version).get(district)
+        if tuned_params is not None:
+            return dict(tuned_params)
+
     hyperparams = {
         'Feldmoching': {
             'n_estimators': 100,
@@ -187,7 +327,7 @@ def get_model_params(district:str) -> dict:
         return hyperparams['Obersendling']
     elif district in ['Laim', 'Obergiesing', 'Sendling-Westpark', 'Ramersdorf-Perlach', 'Berg am Laim']:
         return hyperparams['Laim']
-    elif district in ['Untergiesing-Harlaching', 'Bogenhausen', 'Untergiesing', 'Schwanthalerhöhe', 'Berg am Laim']:
+    elif district in ['Untergiesing-Harlaching', 'Bogenhausen', 'Untergiesing', 'Schwanthalerhöhe']:
         return hyperparams['Untergiesing-Harlaching']
     elif district in ['Sendling', 'Schwabing-West', 'Moosach', 'Au - Haidhausen']:
         return hyperparams['Sendling']
@@ -200,4 +340,4 @@ def get_model_params(district:str) -> dict:
     elif district in ['Maxvorstadt', 'Altstadt-Lehel']:
         return hyperparams['Maxvorstadt']
     else:
-        return None
+        return dict(DEFAULT_MODEL_PARAMS)
@@ -1,15 +1,33 @@
 from bikesharing.params import *
 from bikesharing.ml_logic.encoders import *
+from bikesharing.ml_logic.calendar_features import is_leap_day
+from bikesharing.ml_logic.feature_pipeline import FeaturePipeline
+from bikesharing.ml_logic.instrumentation import record_span, get_peak_rss_mb
 
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import MinMaxScaler
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 import pandas as pd
 import numpy as np
+from colorama import Fore, Style
 
 
 
+def drop_duplicate_rentals(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Removes duplicated rentals.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame.
+
+    Returns:
+        pd.DataFrame: The DataFrame without duplicated rows.
+    """
+    return df.drop_duplicates()
+
+
 # Aggregate by hour
 def group_rental_data_by_hour(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -33,12 +51,360 @@ def group_rental_data_by_hour(df: pd.DataFrame) -> pd.DataFrame:
     return df_by_hour.reset_index()
 
 
+def group_rental_counts_by_hour(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Groups rental counts, which were already aggregated per hour and location in the
+    warehouse, by hour and district.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame with the columns rent_date_hour, n_rentals and district.
+
+    Returns:
+        pd.DataFrame: The DataFrame with one column of rental counts per district, grouped by hour.
+    """
+    df_by_hour = df.pivot_table(index='rent_date_hour', columns='district', values='n_rentals',
+                                aggfunc='sum', fill_value=0)
+    df_by_hour.columns.name = None
+
+    return df_by_hour.reset_index()
+
+
+def count_rentals_by_hour(df: pd.DataFrame, polygons: dict, time_column: str = 'STARTTIME',
+                          weight_column: str = None) -> pd.DataFrame:
+    """
+    Counts the rentals per hour and district without materializing a one-hot matrix.
+
+    Every rental becomes an integer pair (hour index, district code) which is counted with
+    np.bincount into a dense hours x districts matrix. This gives the same frame as
+    encode_district_label followed by group_rental_data_by_hour (the hours with at least one
+    rental, one column per district that occurs, sorted by name) with a memory overhead of a
+    few integers per rental instead of a float per rental and district.
+
+    Args:
+        df (pd.DataFrame): The rentals with the columns STARTLAT, STARTLON and `time_column`.
+        polygons (dict): The district polygons.
+        time_column (str): The start time of the rentals ('rent_date_hour' for hourly counts).
+        weight_column (str): The number of rentals of each row (e. g. 'n_rentals' of data aggregated
+            in the warehouse), defaults to one rental per row.
+
+    Returns:
+        pd.DataFrame: The DataFrame with rent_date_hour and one column of rental counts per district.
+    """
+    names = build_district_index(polygons)[0]
+
+    # Unparseable start times (NaT) are dropped, like the groupby of group_rental_data_by_hour does
+    hours = pd.to_datetime(df[time_column]).to_numpy().astype('datetime64[h]')
+    hours = hours[~np.isnat(hours)]
+    first_hour = hours.min() if len(hours) else np.datetime64(0, 'h')
+    n_hours = int((hours.max() - first_hour).astype(np.int64)) + 1 if len(hours) else 0
+
+    counts = np.zeros((n_hours, len(names)), dtype=np.int64)
+    accumulate_rental_counts(counts, df, polygons, first_hour, time_column, weight_column)
+
+    return get_rental_counts_frame(counts, first_hour, names)
+
+
+def accumulate_rental_counts(counts: np.ndarray, df: pd.DataFrame, polygons: dict, first_hour: np.datetime64,
+                             time_column: str = 'STARTTIME', weight_column: str = None) -> np.ndarray:
+    """
+    Adds the rentals of `df` to the hours x districts count matrix, in place.
+
+    Args:
+        counts (np.ndarray): The count matrix, one row per hour from `first_hour` and one column per
+            district (in the order of the polygons).
+        df (pd.DataFrame): The rentals with the columns STARTLAT, STARTLON and `time_column`.
+        polygons (dict): The district polygons.
+        first_hour (np.datetime64): The hour of the first row of `counts`.
+        time_column (str): The start time of the rentals.
+        weight_column (str): The number of rentals of each row, defaults to one rental per row.
+
+    Returns:
+        np.ndarray: The count matrix, rentals outside of its hours or without a start time are ignored.
+    """
+    n_hours, n_districts = counts.shape
+    row_idx, district_codes, _ = match_districts(df['STARTLON'], df['STARTLAT'], polygons)
+
+    hours = pd.to_datetime(df[time_column]).to_numpy().astype('datetime64[h]')[row_idx]
+    is_valid = ~np.isnat(hours)
+    hour_idx = np.where(is_valid, (hours - first_hour).astype(np.int64), -1)
+    is_in_grid = is_valid & (hour_idx >= 0) & (hour_idx < n_hours)
+
+    weights = None if weight_column is None else df[weight_column].to_numpy()[row_idx][is_in_grid]
+    increments = np.bincount(hour_idx[is_in_grid] * n_districts + district_codes[is_in_grid], weights=weights,
+                             minlength=n_hours * n_districts)
+    np.add(counts, increments.reshape(n_hours, n_districts), out=counts, casting='unsafe')
+
+    return counts
+
+
+def get_rental_counts_frame(counts: np.ndarray, first_hour: np.datetime64, names: np.ndarray) -> pd.DataFrame:
+    """
+    Converts the hours x districts count matrix to the frame of group_rental_data_by_hour.
+    """
+    # Only the hours with rentals and the districts which occur, like the groupby of the one-hot frame
+    present_hours = np.flatnonzero(counts.any(axis=1))
+    present_districts = np.flatnonzero(counts.any(axis=0))
+    present_districts = present_districts[np.argsort(names[present_districts], kind='stable')]
+
+    df_by_hour = pd.DataFrame(counts[np.ix_(present_hours, present_districts)],
+                              columns=names[present_districts].tolist())
+    df_by_hour.insert(0, 'rent_date_hour', (first_hour + present_hours).astype('datetime64[ns]'))
+
+    return df_by_hour
+
+
+class RentalDeduplicator:
+    """
+    Drops the rentals of a chunk which occurred before, in the chunk itself or in a previous one.
+
+    The rows are identified by a 64 bit hash, the hashes seen so far are kept as one sorted
+    array which each chunk is looked up in and merged into (8 bytes per distinct rental
+    instead of the rows themselves).
+
+    With `ordered=True` the chunks are expected in the order of `time_column`. Duplicates share
+    their start time, so only the hashes of the rentals at the latest start time are kept and
+    the memory is bounded by the chunk size. A chunk going back in time raises a ValueError.
+    """
+
+    def __init__(self, ordered: bool = False, time_column: str = 'STARTTIME'):
+        self.ordered = ordered
+        self.time_column = time_column
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._watermark = None
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        unique_hashes, first_idx = np.unique(hashes, return_index=True)
+
+        # Membership in the sorted array of the hashes seen before
+        position = np.minimum(np.searchsorted(self._hashes, unique_hashes), max(len(self._hashes) - 1, 0))
+        is_new = self._hashes[position] != unique_hashes if len(self._hashes) else np.ones(len(unique_hashes), bool)
+        new_hashes, keep_idx = unique_hashes[is_new], np.sort(first_idx[is_new])
+
+        if not self.ordered:
+            self._hashes = np.insert(self._hashes, np.searchsorted(self._hashes, new_hashes), new_hashes)
+            return df.iloc[keep_idx]
+
+        times = df[self.time_column].to_numpy()
+        if len(times) == 0:
+            return df
+        if self._watermark is not None and times.min() < self._watermark:
+            raise ValueError(f"Chunk starting at {times.min()} precedes the previous chunk, which ended at "
+                             f"{self._watermark}: the rentals are not ordered by {self.time_column}")
+
+        watermark = times.max()
+        latest_hashes = np.unique(hashes[times == watermark])
+        if watermark == self._watermark:
+            latest_hashes = np.union1d(self._hashes, latest_hashes)
+        self._hashes, self._watermark = latest_hashes, watermark
+
+        return df.iloc[keep_idx]
+
+
+def count_streamed_rentals_by_hour(gcp_project: str, query: str, cache_path, polygons: dict,
+                                   start_year: int = START_YEAR, end_year: int = END_YEAR,
+                                   columns: list = None, chunk_size: int = PREPROCESS_CHUNK_SIZE,
+                                   deduplicate: bool = True, ordered: bool = False,
+                                   time_column: str = 'STARTTIME', weight_column: str = None) -> pd.DataFrame:
+    """
+    Streaming version of loading, deduplicating and counting the rentals per hour and district.
+
+    The raw data is read in chunks of `chunk_size` rows (see data.iter_raw_data), each chunk is
+    deduplicated, assigned to districts and added to a count matrix on the fixed hour grid of
+    start_year to end_year, so the memory is bounded by the chunk size and not by the number
+    of years. Rentals outside of the grid are ignored.
+
+    Args:
+        gcp_project (str): The GCP project of the query.
+        query (str): The query of the raw data, should be ordered by `time_column` if `ordered`.
+        cache_path: The path of the raw data cache.
+        polygons (dict): The district polygons.
+        start_year (int): The first year of the hour grid.
+        end_year (int): The last year of the hour grid.
+        columns (list): The columns to load.
+        chunk_size (int): The number of rows per chunk.
+        deduplicate (bool): Whether duplicated rentals are dropped (see RentalDeduplicator).
+        ordered (bool): Whether the rentals arrive ordered by `time_column`.
+        time_column (str): The start time of the rentals.
+        weight_column (str): The number of rentals of each row, defaults to one rental per row.
+
+    Returns:
+        pd.DataFrame: The DataFrame with rent_date_hour and one column of rental counts per district.
+    """
+    from bikesharing.ml_logic.data import iter_raw_data
+
+    names = build_district_index(polygons)[0]
+    first_hour = np.datetime64(f'{int(start_year)}-01-01T00', 'h')
+    n_hours = int((np.datetime64(f'{int(end_year) + 1}-01-01T00', 'h') - first_hour).astype(np.int64))
+    counts = np.zeros((n_hours, len(names)), dtype=np.int64)
+
+    deduplicator = RentalDeduplicator(ordered, time_column) if deduplicate else None
+    n_rows = n_kept = 0
+
+    for chunk in iter_raw_data(gcp_project, query, cache_path, columns=columns, chunk_size=chunk_size):
+        n_rows += len(chunk)
+        if deduplicator is not None:
+            chunk = deduplicator(chunk)
+        n_kept += len(chunk)
+        accumulate_rental_counts(counts, chunk, polygons, first_hour, time_column, weight_column)
+
+    print(f"✅ {n_rows:,} rows streamed, {n_rows - n_kept:,} duplicates dropped")
+
+    return get_rental_counts_frame(counts, first_hour, names)
+
+
+def merge_weather_data(rental_df: pd.DataFrame, weather_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Joins the hourly rental data with the hourly weather data. Hours without rentals
+    get zero rentals, leap days are dropped.
+
+    Args:
+        rental_df (pd.DataFrame): The rental data grouped by hour.
+        weather_df (pd.DataFrame): The hourly weather data.
+
+    Returns:
+        pd.DataFrame: The merged DataFrame sorted by rent_date_hour.
+    """
+    merged_df = rental_df.merge(weather_df, right_on='time' , left_on='rent_date_hour' , how='outer')
+    merged_df['rent_date_hour'] = merged_df['time']
+    merged_df = merged_df.sort_values(by='rent_date_hour').drop(columns=['time'])
+    merged_df.fillna(0 , inplace=True)
+
+    # Dropping leapyear data
+    merged_df = merged_df[~is_leap_day(merged_df['rent_date_hour'])]
+
+    return merged_df.reset_index(drop=True)
+
+
+def preprocess_partition(year: int, weather_df: pd.DataFrame, polygons: dict, gcp_project: str,
+                         raw_data_mode: str, cache_dir: str) -> dict:
+    """
+    Preprocesses the rentals of one year up to the calendar features (see preprocess_partitions).
+    Runs in a worker process, the timings are returned with the result and recorded by the parent.
+    """
+    from bikesharing.ml_logic.data import get_raw_data
+    from bikesharing.ml_logic.warehouse import get_sql_backend, build_rental_query, build_hourly_location_query
+    from bikesharing.ml_logic.feature_engineering import add_calendar_features
+
+    start, start_cpu = time.perf_counter(), time.process_time()
+    backend = get_sql_backend(gcp_project=gcp_project)
+
+    if raw_data_mode == 'aggregated':
+        raw_df = get_raw_data(gcp_project, build_hourly_location_query(backend, start_year=year, end_year=year),
+                              cache_path=Path(cache_dir).joinpath(f'mvg_hourly_locations_{year}.parquet'),
+                              backend=backend)
+        counts_df = count_rentals_by_hour(raw_df, polygons, time_column='rent_date_hour', weight_column='n_rentals')
+    else:
+        # Duplicated rentals share their start time, i. e. they are always in the same partition
+        raw_df = get_raw_data(gcp_project, build_rental_query(backend, start_year=year, end_year=year),
+                              cache_path=Path(cache_dir).joinpath(f'mvg_rentals_{year}.parquet'),
+                              columns=['STARTTIME', 'STARTLAT', 'STARTLON'], backend=backend)
+        counts_df = count_rentals_by_hour(drop_duplicate_rentals(raw_df), polygons)
+
+    n_rows = len(raw_df)
+    del raw_df
+    df = add_calendar_features(merge_weather_data(counts_df, weather_df))
+
+    return {'year': year, 'df': df, 'rows_in': n_rows, 'seconds': time.perf_counter() - start,
+            'cpu_seconds': time.process_time() - start_cpu, 'peak_rss_mb': get_peak_rss_mb(), 'pid': os.getpid()}
+
+
+def preprocess_partitions(weather_df: pd.DataFrame, polygons: dict, gcp_project: str = GCP_PROJECT,
+                          start_year: int = START_YEAR, end_year: int = END_YEAR,
+                          raw_data_mode: str = RAW_DATA_MODE, cache_dir: str = None,
+                          n_workers: int = PREPROCESS_N_WORKERS) -> pd.DataFrame:
+    """
+    Year-partitioned version of the preprocessing up to the calendar features.
+
+    Every year from start_year to end_year is loaded (with a raw data cache per year),
+    deduplicated, assigned to districts, counted per hour, joined with its weather and given
+    the calendar features in a process of its own. All of these steps are per hour, so the
+    years concatenated in order give the same frame as the single-process pipeline. The global
+    steps (fitting and applying the feature pipeline) run on the concatenated frame.
+
+    Args:
+        weather_df (pd.DataFrame): The hourly weather of all years, split by year for the workers.
+        polygons (dict): The district polygons.
+        gcp_project (str): The GCP project of the queries.
+        start_year (int): The first year.
+        end_year (int): The last year.
+        raw_data_mode (str): 'rows' or 'aggregated' (see RAW_DATA_MODE).
+        cache_dir (str): The directory of the raw data caches, defaults to LOCAL_DATA_PATH/raw.
+        n_workers (int): The number of processes.
+
+    Returns:
+        pd.DataFrame: The merged DataFrame including the calendar features, sorted by rent_date_hour.
+    """
+    years = list(range(int(start_year), int(end_year) + 1))
+    cache_dir = str(cache_dir or Path(LOCAL_DATA_PATH).joinpath('raw'))
+    weather_years = pd.to_datetime(weather_df['time']).dt.year
+
+    print(Fore.BLUE + f"\nPreprocessing {len(years)} yearly partitions on {min(n_workers, len(years))} workers..."
+          + Style.RESET_ALL)
+
+    with ProcessPoolExecutor(max_workers=max(1, min(n_workers, len(years)))) as executor:
+        futures = [executor.submit(preprocess_partition, year, weather_df[weather_years == year], polygons,
+                                   gcp_project, raw_data_mode, cache_dir) for year in years]
+        # Collected in the order of the years
+        results = [future.result() for future in futures]
+
+    for result in results:
+        record_span('preprocess.partition', wall_seconds=result['seconds'], cpu_seconds=result['cpu_seconds'],
+                    peak_rss_mb=result['peak_rss_mb'], year=result['year'], worker_pid=result['pid'],
+                    rows_in=result['rows_in'], rows_out=len(result['df']))
+        print(f"✅ {result['year']} preprocessed in {result['seconds']:.2f} s")
+
+    df = pd.concat([result['df'] for result in results], ignore_index=True)
+
+    # A district without rentals in a year is missing from its partition, the columns are ordered
+    # like in the single-process pipeline (rent_date_hour, the districts by name, the rest)
+    names = set(build_district_index(polygons)[0].tolist())
+    districts = sorted(column for column in df.columns if column in names)
+    df[districts] = df[districts].fillna(0)
+    other_columns = [column for column in df.columns if column not in names and column != 'rent_date_hour']
+
+    return df[['rent_date_hour', *districts, *other_columns]]
+
+
+def fit_feature_pipeline(df: pd.DataFrame, features: list) -> pd.DataFrame:
+    """
+    Fits the feature pipeline on the training data.
+
+    Args:
+        df (pd.DataFrame): The merged DataFrame including the calendar features.
+        features (list): The features of the model.
+
+    Returns:
+        pd.DataFrame: The parameters of the fitted FeaturePipeline (see FeaturePipeline.to_frame).
+    """
+    return FeaturePipeline.fit(df, features).to_frame()
+
+
+def build_processed_data(df: pd.DataFrame, pipeline_df: pd.DataFrame, districts: list) -> pd.DataFrame:
+    """
+    Selects and scales the features with the fitted pipeline and appends the rental counts of the districts.
+
+    Args:
+        df (pd.DataFrame): The merged DataFrame including the calendar features.
+        pipeline_df (pd.DataFrame): The parameters of the fitted FeaturePipeline.
+        districts (list): The districts, i. e. the targets.
+
+    Returns:
+        pd.DataFrame: The DataFrame with rent_date_hour, the scaled features and the districts.
+    """
+    X_processed = FeaturePipeline.from_frame(pipeline_df).transform_frame(df)
+
+    return pd.concat([df[['rent_date_hour']], X_processed, df[districts]], axis=1)
+
+
 def preprocess_features(df: pd.DataFrame):
+    from sklearn.preprocessing import MinMaxScaler
+
     scaler = MinMaxScaler()
 
-    features = ['temperature_2m', 'apparent_temperature','windspeed_10m', 'precipitation',
+    features = [feature for feature in ['temperature_2m', 'apparent_temperature','windspeed_10m', 'precipitation',
             'hour_sin', 'hour_cos', 'month_sin', 'month_cos', 'day_sin', 'day_cos',
-            'weekday_sin' , 'weekday_cos']
+            'weekday_sin' , 'weekday_cos'] if feature in df.columns]
 
     X = df[features]
 
@@ -0,0 +1,116 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+from colorama import Fore, Style
+
+from bikesharing.params import *
+from bikesharing.ml_logic.cache import get_cache_path, load_cache, save_cache, CACHE_SUFFIXES
+from bikesharing.ml_logic.feature_pipeline import FeaturePipeline
+from bikesharing.ml_logic.instrumentation import span
+
+
+PIPELINE_FILE = 'feature_pipeline.json'
+
+
+def get_store_path(start_year: int = START_YEAR) -> Path:
+    """
+    Returns the directory of the processed store of the data from `start_year` on.
+    """
+    return Path(LOCAL_DATA_PATH).joinpath('processed', f'store_from_{start_year}')
+
+
+def get_partition_paths(store_path: Path) -> list:
+    """
+    Returns the paths of the monthly partitions of the store in chronological order.
+    """
+    store_path = Path(store_path)
+    if not store_path.is_dir():
+        return []
+
+    # The partitions are named after their month (YYYY-MM), i. e. they sort chronologically
+    suffix = CACHE_SUFFIXES[CACHE_FORMAT]
+    return sorted(path for path in store_path.glob(f'????-??{suffix}'))
+
+
+def get_last_processed_hour(store_path: Path):
+    """
+    Returns the last hour of the store, None for an empty store.
+    """
+    partition_paths = get_partition_paths(store_path)
+    if not partition_paths:
+        return None
+
+    hours = load_cache(partition_paths[-1], columns=['rent_date_hour'])['rent_date_hour']
+    return pd.Timestamp(hours.max()) if len(hours) else None
+
+
+def append_processed_data(df: pd.DataFrame, store_path: Path) -> int:
+    """
+    Appends processed rows to the monthly partitions of the store. The rows of a partition
+    from the first appended hour on are replaced, so a partially processed hour or month is
+    completed instead of duplicated. Every partition is written atomically (see save_cache).
+
+    Args:
+        df (pd.DataFrame): The processed rows with rent_date_hour, sorted by it.
+        store_path (Path): The directory of the store.
+
+    Returns:
+        int: The number of written partitions.
+    """
+    if df.empty:
+        return 0
+
+    first_hour = df['rent_date_hour'].min()
+    months = df['rent_date_hour'].dt.strftime('%Y-%m')
+
+    n_partitions = 0
+    with span('store.append', rows_in=len(df)) as s:
+        for month, month_df in df.groupby(months, sort=True):
+            partition_path = get_cache_path(Path(store_path).joinpath(month))
+            if partition_path.exists():
+                existing_df = load_cache(partition_path)
+                existing_df = existing_df[existing_df['rent_date_hour'] < first_hour]
+                month_df = pd.concat([existing_df, month_df[existing_df.columns]], ignore_index=True)
+
+            save_cache(month_df.reset_index(drop=True), partition_path)
+            n_partitions += 1
+        s.set(rows_out=n_partitions)
+
+    print(f"✅ {len(df):,} rows appended to {n_partitions} partitions of the processed store")
+    return n_partitions
+
+
+def load_processed_data(store_path: Path, columns: list = None) -> pd.DataFrame:
+    """
+    Returns all partitions of the store as one DataFrame sorted by rent_date_hour.
+    """
+    partition_paths = get_partition_paths(store_path)
+    print(Fore.BLUE + f"\nLoad {len(partition_paths)} partitions of the processed store..." + Style.RESET_ALL)
+
+    with span('store.load', n_partitions=len(partition_paths)) as s:
+        if partition_paths:
+            df = pd.concat([load_cache(path, columns=columns) for path in partition_paths], ignore_index=True)
+        else:
+            df = pd.DataFrame(columns=columns)
+        s.set(rows_out=len(df))
+
+    return df
+
+
+def save_store_pipeline(pipeline: FeaturePipeline, store_path: Path) -> None:
+    """
+    Stores the feature pipeline all rows of the store are scaled with.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    tmp_path = Path(store_path).joinpath(f'.{PIPELINE_FILE}.tmp')
+    pipeline.save(tmp_path)
+    tmp_path.replace(Path(store_path).joinpath(PIPELINE_FILE))
+
+
+def load_store_pipeline(store_path: Path) -> FeaturePipeline:
+    """
+    Returns the feature pipeline of the store, None for a new store.
+    """
+    path = Path(store_path).joinpath(PIPELINE_FILE)
+    return FeaturePipeline.load(path) if path.exists() else None
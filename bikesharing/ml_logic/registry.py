@@ -1,37 +1,565 @@
-import os, time, glob
+import os, time, glob, threading, json, sqlite3, hashlib, uuid, mmap, struct, tempfile
+from collections import OrderedDict
 from bikesharing.params import *
 
-import joblib
+from bikesharing.ml_logic.feature_pipeline import FeaturePipeline
+from bikesharing.ml_logic.instrumentation import span
 
 from colorama import Fore, Style
 
 
-def save_model(model , district : str) -> None:
-    timestamp = time.strftime("%Y%m%d-%H%M%S")
+MODEL_DIRECTORY = os.path.join(LOCAL_REGISTRY_PATH, "models")
+PIPELINE_DIRECTORY = os.path.join(LOCAL_REGISTRY_PATH, "pipelines")
+MANIFEST_PATH = os.path.join(LOCAL_REGISTRY_PATH, "registry.sqlite")
+
+MANIFEST_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        created_at TEXT NOT NULL,
+        promoted_at TEXT,
+        feature_pipeline TEXT,
+        metadata TEXT
+    );
+    CREATE TABLE IF NOT EXISTS models (
+        district TEXT NOT NULL,
+        version TEXT NOT NULL REFERENCES runs(run_id),
+        path TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        metrics TEXT,
+        feature_schema TEXT,
+        offset INTEGER,
+        length INTEGER,
+        PRIMARY KEY (district, version)
+    );
+    CREATE TABLE IF NOT EXISTS latest (
+        district TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        path TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        offset INTEGER,
+        length INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS hyperparams (
+        district TEXT NOT NULL,
+        version TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        params TEXT NOT NULL,
+        score REAL,
+        metadata TEXT,
+        PRIMARY KEY (district, version)
+    );
+    CREATE INDEX IF NOT EXISTS runs_promoted_at ON runs(promoted_at);
+'''
+
+
+def _connect(manifest_path: str = None) -> sqlite3.Connection:
+    manifest_path = manifest_path or MANIFEST_PATH
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+
+    connection = sqlite3.connect(manifest_path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(MANIFEST_SCHEMA)
+
+    # Manifests created before models could be packed lack the offset table columns
+    for table in ['models', 'latest']:
+        columns = {row[1] for row in connection.execute(f'PRAGMA table_info({table})')}
+        for column in ['offset', 'length']:
+            if column not in columns:
+                connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} INTEGER')
+
+    # Models saved before the manifest existed are registered once, newer versions take precedence
+    if connection.execute('PRAGMA user_version').fetchone()[0] < 1:
+        with connection:
+            connection.executemany('INSERT OR IGNORE INTO latest (district, version, path, sha256) VALUES (?, ?, ?, ?)',
+                                   [(district, os.path.basename(path).rsplit('_', 1)[1][:-4], path, _get_sha256(path))
+                                    for district, path in _get_legacy_model_paths().items()])
+            connection.execute('PRAGMA user_version = 1')
+
+    return connection
+
+
+def _get_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(write, path: str) -> str:
+    # Write to a temporary file in the same directory and rename it, so readers never see a partial file
+    # The temporary file keeps the extension, XGBoost chooses the format from it
+    root, extension = os.path.splitext(os.path.basename(path))
+    tmp_path = os.path.join(os.path.dirname(path), f".{root}.{uuid.uuid4().hex}.tmp{extension}")
+    try:
+        write(tmp_path)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        sha256 = _get_sha256(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return sha256
+
+
+PACKED_MAGIC = b'BSPACK01'
+
+
+def _get_ubj_bytes(model) -> bytes:
+    # XGBModel.save_model keeps the scikit-learn attributes next to the booster
+    with tempfile.TemporaryDirectory() as tmp_directory:
+        path = os.path.join(tmp_directory, 'model.ubj')
+        model.save_model(path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def _pack_models(models: dict) -> tuple:
+    """
+    Packs the models in XGBoost's binary (UBJ) format into one file:
+    magic, header length (uint64), JSON header {district: [offset, length]}, model blobs.
+    The offsets in the header are relative to the end of the header.
+
+    Returns:
+        tuple: The absolute offsets and lengths of the models by district, and the function writing the file.
+    """
+    blobs = {district: _get_ubj_bytes(model) for district, model in models.items()}
+
+    relative_offsets, position = {}, 0
+    for district, blob in blobs.items():
+        relative_offsets[district] = [position, len(blob)]
+        position += len(blob)
+
+    header = json.dumps(relative_offsets).encode()
+    data_start = len(PACKED_MAGIC) + 8 + len(header)
+    offsets = {district: (data_start + offset, length) for district, (offset, length) in relative_offsets.items()}
+
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(PACKED_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for blob in blobs.values():
+                f.write(blob)
+
+    return offsets, write
+
+
+class PackedModelFile:
+    """
+    A memory-mapped packed model file, the models are only deserialized when requested.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(PACKED_MAGIC)] != PACKED_MAGIC:
+            raise ValueError(f"{path} is not a packed model file")
+
+        header_length, = struct.unpack('<Q', self._mmap[len(PACKED_MAGIC):len(PACKED_MAGIC) + 8])
+        data_start = len(PACKED_MAGIC) + 8 + header_length
+        header = json.loads(self._mmap[len(PACKED_MAGIC) + 8:data_start])
+        self.offsets = {district: (data_start + offset, length) for district, (offset, length) in header.items()}
 
-    # Save model locally
-    model_path = os.path.join(LOCAL_REGISTRY_PATH, "models", f"{district}_{timestamp}.pkl")
-    joblib.dump(model , model_path)
+    def load(self, district: str):
+        return self.load_range(*self.offsets[district])
+
+    def load_range(self, offset: int, length: int):
+        from xgboost import XGBRegressor
+
+        model = XGBRegressor()
+        model.load_model(bytearray(self._mmap[offset:offset + length]))
+        return model
+
+
+_packed_model_files = {}
+
+
+def _load_model_file(path: str, offset: int = None, length: int = None):
+    # xgboost and joblib are only imported when a model is loaded, not with the registry
+    if path.endswith('.pkl'):
+        import joblib
+        return joblib.load(path)
+
+    if offset is None:
+        from xgboost import XGBRegressor
+
+        model = XGBRegressor()
+        model.load_model(path)
+        return model
+
+    # Packed files are mapped once and shared by all their districts
+    if path not in _packed_model_files:
+        _packed_model_files[path] = PackedModelFile(path)
+
+    return _packed_model_files[path].load_range(offset, length)
+
+
+def publish_models(models: dict,
+                   metrics: dict = None,
+                   feature_pipeline: FeaturePipeline = None,
+                   metadata: dict = None,
+                   model_format: str = MODEL_FORMAT) -> str:
+    """
+    Publishes the models of a training run. The model files are written atomically and the
+    run is promoted in a single manifest transaction, i. e. predictions switch to all new
+    district models at once (or to none of them if the publish fails).
+
+    Args:
+        models (dict): The models by district.
+        metrics (dict): The metrics of each district, by district.
+        feature_pipeline (FeaturePipeline): The feature pipeline the models were trained with.
+        metadata (dict): Metadata of the run, e. g. the trained period.
+        model_format (str): 'ubj', 'packed' or 'joblib' (see MODEL_FORMAT).
+
+    Returns:
+        str: The version (run id) of the published models.
+    """
+    run_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:6]}'
+    metrics = metrics or {}
+    os.makedirs(MODEL_DIRECTORY, exist_ok=True)
+
+    if model_format not in ['ubj', 'packed', 'joblib']:
+        raise ValueError(f"Unknown model format '{model_format}', use 'ubj', 'packed' or 'joblib'")
+
+    written_paths, rows = [], []
+    try:
+        if model_format == 'packed' and models:
+            packed_path = os.path.join(MODEL_DIRECTORY, f"run_{run_id}.models")
+            offsets, write = _pack_models(models)
+            packed_sha256 = _write_atomic(write, packed_path)
+            written_paths.append(packed_path)
+
+        for district, model in models.items():
+            offset, length = None, None
+            if model_format == 'packed':
+                model_path, sha256 = packed_path, packed_sha256
+                offset, length = offsets[district]
+            elif model_format == 'ubj':
+                model_path = os.path.join(MODEL_DIRECTORY, f"{district}_{run_id}.ubj")
+                sha256 = _write_atomic(model.save_model, model_path)
+                written_paths.append(model_path)
+            else:
+                model_path = os.path.join(MODEL_DIRECTORY, f"{district}_{run_id}.pkl")
+                import joblib
+                sha256 = _write_atomic(lambda path: joblib.dump(model, path), model_path)
+                written_paths.append(model_path)
+
+            feature_names = model.get_booster().feature_names if hasattr(model, 'get_booster') else None
+            rows.append((district, run_id, model_path, sha256,
+                         json.dumps(metrics.get(district, {}), default=float), json.dumps(feature_names),
+                         offset, length))
+
+        pipeline_path = None
+        if feature_pipeline is not None:
+            os.makedirs(PIPELINE_DIRECTORY, exist_ok=True)
+            pipeline_path = os.path.join(PIPELINE_DIRECTORY, f"feature_pipeline_{run_id}.json")
+            _write_atomic(feature_pipeline.save, pipeline_path)
+            written_paths.append(pipeline_path)
+
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        with _connect() as connection:
+            connection.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?)',
+                               (run_id, now, now, pipeline_path, json.dumps(metadata or {}, default=str)))
+            connection.executemany('INSERT INTO models (district, version, path, sha256, metrics, feature_schema, '
+                                   'offset, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            connection.executemany('INSERT OR REPLACE INTO latest (district, version, path, sha256, offset, length) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)',
+                                   [(district, version, path, sha256, offset, length)
+                                    for district, version, path, sha256, _, _, offset, length in rows])
+        connection.close()
+    except BaseException:
+        for path in written_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    print(f"✅ {len(rows)} models published as version {run_id}")
+    return run_id
+
+
+def save_model(model , district : str) -> None:
+    # Save model locally, as a run of its own
+    publish_models({district: model})
 
     print("✅ Model saved locally")
     return
 
+
+def get_latest_models(connection: sqlite3.Connection = None) -> dict:
+    """
+    Returns the version, path and hash of the latest model of every district.
+    """
+    if connection is None:
+        with _connect() as connection:
+            rows = connection.execute('SELECT district, version, path, sha256, offset, length FROM latest').fetchall()
+        connection.close()
+    else:
+        rows = connection.execute('SELECT district, version, path, sha256, offset, length FROM latest').fetchall()
+
+    return {district: {'version': version, 'path': path, 'sha256': sha256, 'offset': offset, 'length': length}
+            for district, version, path, sha256, offset, length in rows}
+
+
+def get_run_metadata(version: str) -> dict:
+    """
+    Returns the metadata a run was published with (e. g. trained_until), empty for unknown runs.
+    """
+    with _connect() as connection:
+        row = connection.execute('SELECT metadata FROM runs WHERE run_id = ?', (version,)).fetchone()
+    connection.close()
+
+    return json.loads(row[0]) if row is not None and row[0] else {}
+
+
+def _get_legacy_model_paths() -> dict:
+    legacy_paths = {}
+    if not os.path.isdir(MODEL_DIRECTORY):
+        return legacy_paths
+
+    # Legacy model files are named {district}_{timestamp}.pkl, the latest one sorts last
+    for path in sorted(glob.glob(os.path.join(MODEL_DIRECTORY, "*_????????-??????.pkl"))):
+        legacy_paths[os.path.basename(path).rsplit('_', 1)[0]] = path
+    return legacy_paths
+
+
 def load_model(district : str):
     print(Fore.BLUE + f"\nLoad latest model from local registry..." + Style.RESET_ALL)
 
-    # Get the latest model version name by the timestamp on disk
-    local_model_directory = os.path.join(LOCAL_REGISTRY_PATH, "models")
-    local_model_paths = glob.glob(f"{local_model_directory}/{district}*")
+    # Constant time lookup of the latest version in the manifest
+    with _connect() as connection:
+        row = connection.execute('SELECT path, offset, length FROM latest WHERE district = ?', (district,)).fetchone()
+    connection.close()
 
-    if not local_model_paths:
+    if row is None:
         return None
 
-    most_recent_model_path_on_disk = sorted(local_model_paths)[-1]
-
     print(Fore.BLUE + f"\nLoad latest model from disk..." + Style.RESET_ALL)
 
-    latest_model = joblib.load(most_recent_model_path_on_disk)
+    with span('registry.load_model', district=district, packed=row[1] is not None):
+        latest_model = _load_model_file(*row)
 
     print("✅ Model loaded from local disk")
 
     return latest_model
+
+
+def save_hyperparams(params: dict, scores: dict = None, metadata: dict = None) -> str:
+    """
+    Stores tuned hyperparameters as a new version.
+
+    Args:
+        params (dict): The hyperparameters by district.
+        scores (dict): The validation score of each district, by district.
+        metadata (dict): Metadata of the search, e. g. the number of trials.
+
+    Returns:
+        str: The version of the stored hyperparameters.
+    """
+    version = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:6]}'
+    scores = scores or {}
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    with _connect() as connection:
+        connection.executemany('INSERT INTO hyperparams VALUES (?, ?, ?, ?, ?, ?)',
+                               [(district, version, now, json.dumps(district_params), scores.get(district),
+                                 json.dumps(metadata or {}, default=str))
+                                for district, district_params in params.items()])
+    connection.close()
+
+    print(f"✅ Hyperparameters of {len(params)} districts stored as version {version}")
+    return version
+
+
+def load_hyperparams(version: str = None) -> dict:
+    """
+    Returns the hyperparameters by district of the given version, by default the latest
+    version of every district.
+    """
+    with _connect() as connection:
+        if version is None:
+            rows = connection.execute('SELECT district, params FROM hyperparams AS h WHERE version = '
+                                      '(SELECT MAX(version) FROM hyperparams WHERE district = h.district)').fetchall()
+        else:
+            rows = connection.execute('SELECT district, params FROM hyperparams WHERE version = ?', (version,)).fetchall()
+    connection.close()
+
+    return {district: json.loads(params) for district, params in rows}
+
+
+def garbage_collect(keep_runs: int = MODEL_RETENTION_RUNS) -> int:
+    """
+    Deletes the models and feature pipelines of all but the `keep_runs` latest runs.
+    Models which are still the latest version of a district are always kept.
+
+    Returns:
+        int: The number of deleted model files.
+    """
+    with _connect() as connection:
+        kept_runs = {run_id for run_id, in connection.execute(
+            'SELECT run_id FROM runs ORDER BY promoted_at DESC, run_id DESC LIMIT ?', (keep_runs,))}
+        kept_runs |= {version for version, in connection.execute('SELECT DISTINCT version FROM latest')}
+
+        expired_models = [(district, version, path) for district, version, path in connection.execute(
+            'SELECT district, version, path FROM models') if version not in kept_runs]
+        expired_runs = [(run_id, pipeline_path) for run_id, pipeline_path in connection.execute(
+            'SELECT run_id, feature_pipeline FROM runs') if run_id not in kept_runs]
+
+        connection.executemany('DELETE FROM models WHERE district = ? AND version = ?',
+                               [(district, version) for district, version, _ in expired_models])
+        connection.executemany('DELETE FROM runs WHERE run_id = ?', [(run_id,) for run_id, _ in expired_runs])
+
+        referenced_paths = {path for path, in connection.execute('SELECT path FROM models UNION SELECT path FROM latest')}
+    connection.close()
+
+    # Files are only deleted once they are no longer referenced by the manifest (packed files are shared)
+    expired_paths = {path for _, _, path in expired_models} | {path for _, path in expired_runs if path}
+    for path in expired_paths - referenced_paths:
+        _packed_model_files.pop(path, None)
+        if os.path.exists(path):
+            os.remove(path)
+
+    print(f"✅ Garbage collected {len(expired_models)} models of {len(expired_runs)} runs")
+    return len(expired_models)
+
+
+def save_feature_pipeline(pipeline: FeaturePipeline) -> str:
+    """
+    Publishes the feature pipeline as a run of its own.
+    """
+    return publish_models({}, feature_pipeline=pipeline)
+
+
+def load_feature_pipeline() -> FeaturePipeline:
+    """
+    Returns the feature pipeline of the latest run. It is cached by the model pool, which only
+    reads the manifest again when it changed and the pipeline file when it is a new one.
+    """
+    return get_model_pool().get_feature_pipeline()
+
+
+class ModelPool:
+    """
+    Keeps the latest model of every district in memory.
+
+    The latest versions are only read from the manifest again when another connection
+    committed to it (PRAGMA data_version), so a lookup costs the same however many historical
+    versions are registered. A newly published version is loaded on the next lookup (hot swap)
+    and the least recently used models are evicted beyond `max_size`.
+    """
+
+    def __init__(self, max_size: int = MODEL_POOL_SIZE, manifest_path: str = None):
+        self.max_size = max_size
+        self.manifest_path = manifest_path or MANIFEST_PATH
+        self._models = OrderedDict()
+        self._latest = {}
+        self._feature_pipeline_path = None
+        self._feature_pipeline = None
+        self._connection = None
+        self._data_version = None
+        self._lock = threading.RLock()
+
+    def _refresh_index(self) -> None:
+        if self._connection is None:
+            self._connection = _connect(self.manifest_path)
+
+        data_version = self._connection.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return
+
+        self._latest = get_latest_models(self._connection)
+        row = self._connection.execute('SELECT feature_pipeline FROM runs WHERE feature_pipeline IS NOT NULL '
+                                       'ORDER BY promoted_at DESC, run_id DESC LIMIT 1').fetchone()
+        self._feature_pipeline_path = row[0] if row is not None else None
+        self._data_version = data_version
+
+    def get(self, district: str):
+        """
+        Returns the latest model of the district, None if there is none.
+        """
+        with self._lock:
+            self._refresh_index()
+
+            latest = self._latest.get(district)
+            if latest is None:
+                return None
+
+            cached = self._models.get(district)
+            if cached is not None and cached[0] == latest['version']:
+                self._models.move_to_end(district)
+                return cached[1]
+
+            print(Fore.BLUE + f"\nLoad latest model of {district} into the model pool..." + Style.RESET_ALL)
+            with span('registry.load_model', district=district, version=latest['version'],
+                      packed=latest['offset'] is not None):
+                model = _load_model_file(latest['path'], latest['offset'], latest['length'])
+
+            self._models[district] = (latest['version'], model)
+            self._models.move_to_end(district)
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+
+            return model
+
+    def get_districts(self) -> list:
+        """
+        Returns the districts with a published model, sorted by name.
+        """
+        with self._lock:
+            self._refresh_index()
+            return sorted(self._latest)
+
+    def get_feature_pipeline(self) -> FeaturePipeline:
+        """
+        Returns the feature pipeline of the latest run, None if there is none.
+        """
+        with self._lock:
+            self._refresh_index()
+
+            path = self._feature_pipeline_path
+            if path is None:
+                return None
+
+            if self._feature_pipeline is None or self._feature_pipeline[0] != path:
+                print(Fore.BLUE + f"\nLoad latest feature pipeline from local registry..." + Style.RESET_ALL)
+                with span('registry.load_feature_pipeline'):
+                    self._feature_pipeline = (path, FeaturePipeline.load(path))
+
+            return self._feature_pipeline[1]
+
+    def warm(self, districts: list = None) -> None:
+        """
+        Loads the latest models of the districts (all districts by default) into the pool.
+        """
+        with self._lock:
+            self._refresh_index()
+            districts = districts if districts is not None else list(self._latest)
+
+        for district in districts[:self.max_size]:
+            self.get(district)
+
+        print(f"✅ Model pool warmed with {len(self._models)} models")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._latest = {}
+            self._feature_pipeline_path = None
+            self._feature_pipeline = None
+            self._data_version = None
+
+
+_model_pool = None
+
+
+def get_model_pool() -> ModelPool:
+    """
+    Returns the model pool shared by the whole process.
+    """
+    global _model_pool
+    if _model_pool is None:
+        _model_pool = ModelPool()
+    return _model_pool
@@ -0,0 +1,266 @@
+import ast
+import hashlib
+import importlib.util
+import inspect
+import json
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from colorama import Fore, Style
+
+import bikesharing
+from bikesharing.params import *
+from bikesharing.ml_logic.cache import get_cache_path, is_cached, load_cache, save_cache
+from bikesharing.ml_logic.instrumentation import span
+
+
+STAGE_CACHE_PATH = Path(LOCAL_DATA_PATH).joinpath('stages')
+PACKAGE = 'bikesharing'
+
+
+def fingerprint(value) -> str:
+    """
+    Computes a stable hash of (nested) parameters, DataFrames, arrays, geometries or functions.
+
+    Args:
+        value: The value to hash.
+
+    Returns:
+        str: The hex digest of the value.
+    """
+    digest = hashlib.sha256()
+    _update_fingerprint(digest, value)
+    return digest.hexdigest()
+
+
+def _update_fingerprint(digest, value) -> None:
+    if isinstance(value, dict):
+        digest.update(b'dict')
+        for key in sorted(value, key=str):
+            _update_fingerprint(digest, str(key))
+            _update_fingerprint(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'list')
+        for item in value:
+            _update_fingerprint(digest, item)
+    elif isinstance(value, pd.DataFrame):
+        digest.update(b'frame')
+        _update_fingerprint(digest, [str(column) for column in value.columns])
+        _update_fingerprint(digest, [str(dtype) for dtype in value.dtypes])
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(b'array')
+        digest.update(str(value.dtype).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, bytes):
+        digest.update(value)
+    elif hasattr(value, 'wkb'):
+        # Shapely geometries
+        digest.update(value.wkb)
+    elif callable(value):
+        # Functions are identified by their source code
+        try:
+            digest.update(inspect.getsource(value).encode())
+        except (OSError, TypeError):
+            digest.update(getattr(value, '__qualname__', repr(value)).encode())
+    else:
+        digest.update(f'{type(value).__name__}:{value}'.encode())
+
+
+def _get_imported_modules(path: str) -> list:
+    # Every import of the package in the module, including the lazy imports inside functions
+    names = []
+    for node in ast.walk(ast.parse(Path(path).read_text(encoding='utf-8'))):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            # `from package import module` imports a module as well
+            names += [node.module] + [f'{node.module}.{alias.name}' for alias in node.names]
+    return [name for name in names if name == PACKAGE or name.startswith(f'{PACKAGE}.')]
+
+
+def _get_module_path(name: str) -> str:
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, AttributeError, ValueError):
+        # An attribute imported from a module, not a module itself
+        return None
+    return spec.origin if spec is not None and spec.origin not in (None, 'built-in', 'frozen') else None
+
+
+@lru_cache(maxsize=None)
+def get_code_fingerprint(module: str) -> str:
+    """
+    Computes a hash of the source code of a module of the package and of every module of the
+    package it imports, directly or indirectly (including imports inside functions). A change
+    to any helper a stage function may call therefore invalidates the stage.
+
+    Args:
+        module (str): The name of the module, e. g. the __module__ of a stage function.
+
+    Returns:
+        str: The hex digest of the sources.
+    """
+    sources, pending = {}, [module]
+    while pending:
+        name = pending.pop()
+        if name in sources:
+            continue
+        path = _get_module_path(name)
+        sources[name] = None
+        if path is None or not path.endswith('.py'):
+            continue
+        sources[name] = Path(path).read_bytes()
+        pending += _get_imported_modules(path)
+
+    return fingerprint({name: source for name, source in sources.items() if source is not None})
+
+
+class Stage:
+    """
+    A node of the preprocessing pipeline whose output is cached on disk.
+
+    The key of a stage is a hash of the keys of its input stages, its parameters and the
+    source code of the module of its function, including every module of the package it
+    imports (see get_code_fingerprint). Changing any of them invalidates the stage and every
+    stage downstream of it, while the stages upstream stay cached.
+
+    Stages with `persist=False` are keyed but never written to disk, which is used for the
+    row-level stages feeding the hourly aggregation: they are as large as the raw data and
+    only run when the aggregation itself has to be recomputed.
+    """
+
+    def __init__(self, name: str, func, inputs: list = None, params: dict = None,
+                 persist: bool = True, key: str = None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or []
+        self.params = params or {}
+        self.persist = persist
+        self._key = key
+        self._output = None
+
+    @classmethod
+    def from_data(cls, name: str, df: pd.DataFrame) -> 'Stage':
+        """
+        Creates a source stage keyed by the content of an already loaded DataFrame.
+        """
+        stage = cls(name, lambda: df, persist=False, key=fingerprint([name, df]))
+        stage._output = df
+        return stage
+
+    @property
+    def key(self) -> str:
+        if self._key is None:
+            self._key = fingerprint({
+                'name': self.name,
+                'inputs': [stage.key for stage in self.inputs],
+                'params': self.params,
+                'code': [self.func, get_code_fingerprint(getattr(self.func, '__module__', None) or '')],
+                'version': getattr(bikesharing, '__version__', None)
+            })
+        return self._key
+
+    @property
+    def cache_path(self) -> Path:
+        return STAGE_CACHE_PATH.joinpath(self.name, f'{self.key}.parquet')
+
+    def is_cached(self) -> bool:
+        return self.persist and is_cached(self.cache_path)
+
+    def output(self) -> pd.DataFrame:
+        """
+        Returns the output of the stage, from the cache if it exists, otherwise the stage and
+        the invalidated stages upstream of it are run.
+        """
+        if self._output is not None:
+            return self._output
+
+        if self.is_cached():
+            print(Fore.BLUE + f"\nLoad stage '{self.name}' ({self.key[:12]}) from cache..." + Style.RESET_ALL)
+            with span(f'stage.{self.name}', cached=True, key=self.key[:12]) as s:
+                self._output = load_cache(self.cache_path)
+                s.set(rows_out=len(self._output))
+            return self._output
+
+        inputs = [stage.output() for stage in self.inputs]
+
+        print(Fore.BLUE + f"\nRun stage '{self.name}' ({self.key[:12]})..." + Style.RESET_ALL)
+        with span(f'stage.{self.name}', rows_in=sum(len(df) for df in inputs), cached=False,
+                  key=self.key[:12]) as s:
+            start = time.perf_counter()
+            df = self.func(*inputs, **self.params)
+            seconds = time.perf_counter() - start
+            s.set(rows_out=len(df))
+
+        if self.persist:
+            path = save_cache(df, self.cache_path)
+            _write_stage_metadata(path, {
+                'name': self.name,
+                'key': self.key,
+                'inputs': {stage.name: stage.key for stage in self.inputs},
+                'rows': int(df.shape[0]),
+                'columns': int(df.shape[1]),
+                'seconds': round(seconds, 3),
+                'created_at': time.strftime("%Y-%m-%d %H:%M:%S")
+            })
+
+        self._output = df
+        return df
+
+
+def _write_stage_metadata(path: Path, metadata: dict) -> None:
+    with open(path.with_suffix('.json'), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def list_stages(name: str = None) -> pd.DataFrame:
+    """
+    Lists the cached stage outputs.
+
+    Args:
+        name (str): Only list the outputs of this stage, defaults to all stages.
+
+    Returns:
+        pd.DataFrame: One row per cached output with its metadata, path and size on disk.
+    """
+    entries = []
+    for metadata_path in sorted(STAGE_CACHE_PATH.glob(f"{name or '*'}/*.json")):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+
+        path = get_cache_path(metadata_path)
+        if not path.is_file():
+            continue
+
+        metadata['path'] = str(path)
+        metadata['size_mb'] = round(path.stat().st_size / 1e6, 3)
+        entries.append(metadata)
+
+    return pd.DataFrame(entries, columns=['name', 'key', 'inputs', 'rows', 'columns', 'seconds',
+                                          'created_at', 'path', 'size_mb'])
+
+
+def evict_stages(name: str = None, key: str = None) -> int:
+    """
+    Deletes cached stage outputs.
+
+    Args:
+        name (str): Only evict the outputs of this stage, defaults to all stages.
+        key (str): Only evict the output with this key (or key prefix).
+
+    Returns:
+        int: The number of evicted outputs.
+    """
+    evicted = 0
+    for metadata_path in STAGE_CACHE_PATH.glob(f"{name or '*'}/{key or ''}*.json"):
+        get_cache_path(metadata_path).unlink(missing_ok=True)
+        metadata_path.unlink()
+        evicted += 1
+
+    print(f"✅ Evicted {evicted} cached stage outputs")
+
+    return evicted
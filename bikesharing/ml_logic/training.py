@@ -0,0 +1,315 @@
+import os
+import shutil
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from colorama import Fore, Style
+
+from bikesharing.params import *
+from bikesharing.ml_logic.instrumentation import span, record_span, get_peak_rss_mb
+
+
+# Feature matrix and targets of a worker process, memory-mapped once by _init_worker
+_X = None
+_y = None
+_features = None
+
+
+def _init_worker(X_path: str, y_path: str, features: list) -> None:
+    global _X, _y, _features
+    _X = np.load(X_path, mmap_mode='r')
+    _y = np.load(y_path, mmap_mode='r')
+    _features = features
+
+
+def get_worker_data() -> tuple:
+    """
+    Returns the feature matrix, the targets and the feature names of the current worker
+    process, as set by _init_worker (shared with the backtest workers).
+    """
+    return _X, _y, _features
+
+
+def _fit_district(district: str, column: int, hyper_params: dict, n_threads: int) -> dict:
+    # The timings are returned with the result, the spans are recorded by the parent process
+    start, start_cpu = time.perf_counter(), time.process_time()
+    model, error = None, None
+    try:
+        from xgboost import XGBRegressor
+
+        X = pd.DataFrame(_X, columns=_features, copy=False)
+        model = XGBRegressor(objective='reg:squarederror', n_jobs=n_threads, **hyper_params)
+        model.fit(X, _y[:, column])
+    except Exception:
+        error = traceback.format_exc()
+
+    return {'district': district, 'model': model, 'seconds': time.perf_counter() - start,
+            'cpu_seconds': time.process_time() - start_cpu, 'peak_rss_mb': get_peak_rss_mb(),
+            'pid': os.getpid(), 'error': error}
+
+
+def train_district_models(X: pd.DataFrame,
+                          y: pd.DataFrame,
+                          get_params,
+                          n_workers: int = TRAIN_N_WORKERS,
+                          threads_per_worker: int = TRAIN_THREADS_PER_WORKER) -> tuple:
+    """
+    Fits one XGBRegressor per district (column of y).
+
+    With more than one worker, the districts are fanned out over a process pool. X and y are
+    written once to memory-mapped .npy files (in /dev/shm if available) which every worker maps
+    read-only, instead of pickling the feature matrix to each of them.
+
+    Args:
+        X (pd.DataFrame): The features.
+        y (pd.DataFrame): The rental counts, one column per district.
+        get_params: Function returning the hyperparameters of a district.
+        n_workers (int): The number of processes, 1 trains in the current process.
+        threads_per_worker (int): The number of XGBoost threads of each fit, 0 splits the cores
+            evenly between the workers.
+
+    Returns:
+        tuple: A dict of the fitted models by district and a DataFrame reporting the duration,
+            worker and error (if any) of every district.
+    """
+    districts = list(y.columns)
+    n_threads = threads_per_worker or max(1, (os.cpu_count() or 1) // n_workers)
+    start = time.perf_counter()
+
+    with span('train.district_models', rows_in=len(X), n_districts=len(districts), n_workers=n_workers) as s:
+        results = _train(X, y, districts, get_params, n_workers, n_threads)
+        s.set(rows_out=sum(result['error'] is None for result in results))
+
+    models = {result['district']: result['model'] for result in results if result['error'] is None}
+    report = pd.DataFrame([{key: value for key, value in result.items() if key != 'model'} for result in results])
+    report = report.set_index('district').loc[districts].reset_index()
+
+    print(f"✅ {len(models)} of {len(districts)} models trained in {time.perf_counter() - start:.1f} s")
+
+    return models, report
+
+
+def _train(X: pd.DataFrame, y: pd.DataFrame, districts: list, get_params, n_workers: int, n_threads: int) -> list:
+    global _X, _y, _features
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    tmp_dir = tempfile.mkdtemp(prefix='bikesharing_train_', dir=shm_dir) if n_workers > 1 else None
+
+    try:
+        if n_workers > 1:
+            X_path, y_path = os.path.join(tmp_dir, 'X.npy'), os.path.join(tmp_dir, 'y.npy')
+            np.save(X_path, X.to_numpy(dtype=np.float32))
+            np.save(y_path, y.to_numpy(dtype=np.float32))
+
+            print(Fore.BLUE + f"\nTraining {len(districts)} models on {n_workers} workers "
+                  f"with {n_threads} threads each..." + Style.RESET_ALL)
+
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                     initargs=(X_path, y_path, list(X.columns))) as executor:
+                futures = [executor.submit(_fit_district, district, column, get_params(district), n_threads)
+                           for column, district in enumerate(districts)]
+                results = []
+                for future in as_completed(futures):
+                    result = future.result()
+                    _print_result(result)
+                    results.append(result)
+        else:
+            _X, _y, _features = X.to_numpy(dtype=np.float32), y.to_numpy(dtype=np.float32), list(X.columns)
+            results = []
+            for column, district in enumerate(districts):
+                print(Fore.BLUE + f"\nTraining model for district {district}..." + Style.RESET_ALL)
+                result = _fit_district(district, column, get_params(district), n_threads)
+                _print_result(result)
+                results.append(result)
+    finally:
+        _X, _y, _features = None, None, None
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return results
+
+
+def _print_result(result: dict) -> None:
+    record_span('train.fit_district', wall_seconds=result['seconds'], cpu_seconds=result['cpu_seconds'],
+                peak_rss_mb=result['peak_rss_mb'], district=result['district'], worker_pid=result['pid'],
+                error=None if result['error'] is None else 'FitError')
+    if result['error'] is None:
+        print(f"✅ {result['district']} trained in {result['seconds']:.2f} s")
+    else:
+        print(Fore.RED + f"❌ {result['district']} failed after {result['seconds']:.2f} s:\n{result['error']}" + Style.RESET_ALL)
+
+
+def update_district_model(model, X: pd.DataFrame, y: np.ndarray, hyper_params: dict, mode: str = 'continue',
+                          n_rounds: int = 50, n_threads: int = 0):
+    """
+    Warm-starts a fitted XGBRegressor on new rows.
+
+    The hyperparameters are passed explicitly: a model loaded from the UBJ format only
+    restores its booster, not the parameters of the XGBRegressor it was fitted with.
+
+    Args:
+        model: The fitted XGBRegressor.
+        X (pd.DataFrame): The features of the new rows.
+        y (np.ndarray): The rental counts of the new rows.
+        hyper_params (dict): The hyperparameters of the district (see get_model_params).
+        mode (str): 'continue' adds n_rounds boosting rounds fitted on the new rows, 'refresh'
+            keeps the trees and refits their leaf values on the new rows.
+        n_rounds (int): The number of added rounds in the 'continue' mode.
+        n_threads (int): The number of XGBoost threads, 0 for all cores.
+
+    Returns:
+        XGBRegressor: The updated model, the given model is left unchanged.
+    """
+    from xgboost import XGBRegressor
+
+    params = {'objective': 'reg:squarederror', **hyper_params, 'n_jobs': n_threads or None}
+    booster = model.get_booster()
+
+    if mode == 'continue':
+        params['n_estimators'] = n_rounds
+    elif mode == 'refresh':
+        # The refresh updater walks the existing trees once, updating their statistics and leaves
+        params.update(n_estimators=booster.num_boosted_rounds(), process_type='update',
+                      updater='refresh', refresh_leaf=True)
+    else:
+        raise ValueError(f"Unknown update mode '{mode}', use 'continue' or 'refresh'")
+
+    updated_model = XGBRegressor(**params)
+    updated_model.fit(X, y, xgb_model=booster)
+
+    return updated_model
+
+
+def _get_rmse(model, X: pd.DataFrame, y: np.ndarray) -> float:
+    return float(np.sqrt(np.mean((model.predict(X) - y) ** 2)))
+
+
+def update_district_models(models: dict,
+                           X: pd.DataFrame,
+                           y: pd.DataFrame,
+                           trained_until: dict,
+                           get_params,
+                           mode: str = INCREMENTAL_MODE,
+                           n_rounds: int = INCREMENTAL_ROUNDS,
+                           validation_hours: int = INCREMENTAL_VALIDATION_HOURS,
+                           guardrail: str = INCREMENTAL_GUARDRAIL,
+                           tolerance: float = INCREMENTAL_TOLERANCE,
+                           n_workers: int = TRAIN_N_WORKERS) -> tuple:
+    """
+    Incremental training: the latest model of every district is warm-started (see
+    update_district_model) on the hours after its `trained_until`, instead of being refitted
+    on the whole history.
+
+    Guardrail: the last `validation_hours` of the new hours are held out. The updated model
+    must not be worse on them than the reference by more than `tolerance` (relative RMSE),
+    otherwise the district falls back:
+        - 'retrain': the reference is a full retrain on all hours before the held out ones,
+          a failing district is retrained from scratch on all hours.
+        - 'previous': the reference is the current model, a failing district keeps it.
+        - 'off': no check.
+    Accepted updates are finally warm-started on all new hours, including the held out ones.
+
+    Args:
+        models (dict): The latest models by district.
+        X (pd.DataFrame): The features of all hours (indexed by rent_date_hour), transformed with
+            the feature pipeline of the models.
+        y (pd.DataFrame): The rental counts, one column per district.
+        trained_until (dict): The last hour each district's model was trained on, by district.
+        get_params: Function returning the hyperparameters of a district (for the full retrains).
+        mode (str): 'continue' or 'refresh'.
+        n_rounds (int): The rounds added in the 'continue' mode.
+        validation_hours (int): The held out hours of the guardrail.
+        guardrail (str): 'retrain', 'previous' or 'off'.
+        tolerance (float): The accepted relative increase of the validation RMSE.
+        n_workers (int): The number of processes of the full retrains.
+
+    Returns:
+        tuple: The changed models by district and a DataFrame reporting, per district, the new
+            hours, validation RMSEs, the outcome and the duration.
+    """
+    if guardrail not in ['retrain', 'previous', 'off']:
+        raise ValueError(f"Unknown guardrail '{guardrail}', use 'retrain', 'previous' or 'off'")
+
+    updated, report, retrain = {}, [], []
+    new_data, references = {}, {}
+
+    districts = [district for district in y.columns if district in models]
+    for district in districts:
+        start = time.perf_counter()
+        if trained_until.get(district) is None:
+            # Without trained_until the models cannot tell the new hours apart
+            new_rows = np.zeros(len(X), dtype=bool)
+        else:
+            new_rows = X.index > pd.Timestamp(trained_until[district])
+        n_new = int(new_rows.sum())
+        entry = {'district': district, 'new_hours': n_new, 'validation_rmse': None, 'reference_rmse': None}
+
+        if n_new == 0:
+            report.append({**entry, 'outcome': 'up to date', 'seconds': time.perf_counter() - start})
+            continue
+
+        X_new, y_new = X[new_rows], y.loc[new_rows, district].to_numpy(dtype=np.float32)
+        new_data[district] = X_new, y_new
+        # The guardrail needs at least as many new hours to update on as it holds out
+        check = guardrail != 'off' and n_new >= 2 * validation_hours
+
+        with span('train.update_district', rows_in=n_new, district=district, mode=mode):
+            if check:
+                X_fit, y_fit = X_new.iloc[:-validation_hours], y_new[:-validation_hours]
+                X_validation, y_validation = X_new.iloc[-validation_hours:], y_new[-validation_hours:]
+
+                candidate = update_district_model(models[district], X_fit, y_fit, get_params(district), mode, n_rounds)
+                entry['validation_rmse'] = _get_rmse(candidate, X_validation, y_validation)
+
+                if guardrail == 'previous':
+                    entry['reference_rmse'] = _get_rmse(models[district], X_validation, y_validation)
+                else:
+                    references[district] = (X_validation, y_validation)
+
+        if not check or guardrail == 'previous':
+            accepted = not check or entry['validation_rmse'] <= entry['reference_rmse'] * (1 + tolerance)
+            if accepted:
+                updated[district] = update_district_model(models[district], X_new, y_new, get_params(district),
+                                                          mode, n_rounds)
+            report.append({**entry, 'outcome': 'updated' if accepted else 'kept previous',
+                           'seconds': time.perf_counter() - start})
+        else:
+            # Decided below, after the full retrains of the reference
+            report.append({**entry, 'outcome': None, 'seconds': time.perf_counter() - start})
+
+    if references:
+        # Full retrains on all hours before the held out ones of each district
+        first_validation_hour = min(X_validation.index[0] for X_validation, _ in references.values())
+        X_reference = X[X.index < first_validation_hour]
+        reference_models, _ = train_district_models(X_reference, y.loc[X_reference.index, list(references)],
+                                                    get_params, n_workers=n_workers)
+
+        for entry in report:
+            district = entry['district']
+            if district not in references:
+                continue
+            X_validation, y_validation = references[district]
+            if district in reference_models:
+                entry['reference_rmse'] = _get_rmse(reference_models[district], X_validation, y_validation)
+
+            if entry['reference_rmse'] is None or entry['validation_rmse'] <= entry['reference_rmse'] * (1 + tolerance):
+                updated[district] = update_district_model(models[district], *new_data[district], get_params(district),
+                                                          mode, n_rounds)
+                entry['outcome'] = 'updated'
+            else:
+                retrain.append(district)
+                entry['outcome'] = 'retrained'
+
+    if retrain:
+        print(Fore.RED + f"\nIncremental update worse than a full retrain for {retrain}, retraining them..." + Style.RESET_ALL)
+        retrained_models, _ = train_district_models(X, y[retrain], get_params, n_workers=n_workers)
+        updated.update(retrained_models)
+
+    report = pd.DataFrame(report, columns=['district', 'new_hours', 'validation_rmse', 'reference_rmse', 'outcome', 'seconds'])
+    print(f"✅ {len(updated)} of {len(districts)} models updated incrementally "
+          f"({(report['outcome'] == 'retrained').sum()} retrained)")
+
+    return updated, report
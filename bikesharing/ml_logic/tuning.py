@@ -0,0 +1,202 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from colorama import Fore, Style
+
+from bikesharing.params import *
+from bikesharing.ml_logic.instrumentation import span, record_span
+
+
+# Distributions of the searched hyperparameters: (low, high, scale), integers for 'int'
+SEARCH_SPACE = {
+    'max_depth': (3, 10, 'int'),
+    'learning_rate': (0.01, 0.3, 'log'),
+    'min_child_weight': (1, 10, 'int'),
+    'subsample': (0.6, 1.0, 'linear'),
+    'colsample_bytree': (0.5, 1.0, 'linear'),
+    'gamma': (0.0, 5.0, 'linear'),
+    'reg_lambda': (0.1, 10.0, 'log')
+}
+
+# Quantization of the features, shared by all trials through the QuantileDMatrix of a fold
+MAX_BIN = 256
+
+
+def sample_params(n_trials: int, seed: int = 42) -> list:
+    '''
+        returns n_trials random parameter sets of the SEARCH_SPACE
+    '''
+    rng = np.random.default_rng(seed)
+    trials = [{} for _ in range(n_trials)]
+
+    for name, (low, high, scale) in SEARCH_SPACE.items():
+        if scale == 'int':
+            values = rng.integers(low, high + 1, n_trials)
+        elif scale == 'log':
+            values = np.exp(rng.uniform(np.log(low), np.log(high), n_trials))
+        else:
+            values = rng.uniform(low, high, n_trials)
+        for trial, value in zip(trials, values):
+            trial[name] = value.item()
+
+    return trials
+
+
+def get_validation_folds(n_rows: int, n_folds: int = TUNE_N_FOLDS,
+                         validation_length: int = TUNE_VALIDATION_HOURS) -> list:
+    """
+    Returns time-ordered (expanding window) folds: each fold trains on all rows before its
+    validation period, the validation periods are the last n_folds x validation_length rows.
+
+    Returns:
+        list: The (train_end, validation_end) row of every fold, the validation starts at train_end.
+    """
+    first_validation = n_rows - n_folds * validation_length
+    if first_validation <= validation_length:
+        raise ValueError(f'{n_rows} rows are not enough for {n_folds} validation folds of {validation_length} rows')
+
+    return [(first_validation + i * validation_length, first_validation + (i + 1) * validation_length)
+            for i in range(n_folds)]
+
+
+def get_fold_matrices(X: pd.DataFrame, folds: list) -> list:
+    """
+    Quantizes the features of every fold once. The training rows become a QuantileDMatrix and
+    the validation rows a QuantileDMatrix referencing its bins. The labels are set per district
+    (set_label), so the matrices are reused by all trials of all districts.
+    """
+    import xgboost as xgb
+
+    X_values = X.to_numpy(dtype=np.float32)
+    matrices = []
+    for train_end, validation_end in folds:
+        dtrain = xgb.QuantileDMatrix(X_values[:train_end], label=np.zeros(train_end, dtype=np.float32),
+                                     feature_names=list(X.columns), max_bin=MAX_BIN)
+        dvalidation = xgb.QuantileDMatrix(X_values[train_end:validation_end],
+                                          label=np.zeros(validation_end - train_end, dtype=np.float32),
+                                          feature_names=list(X.columns), max_bin=MAX_BIN, ref=dtrain)
+        matrices.append((dtrain, dvalidation))
+
+    return matrices
+
+
+def _train_trial(trial: dict, matrices: list, n_rounds: int, n_threads: int) -> dict:
+    """
+    Continues boosting the boosters of a trial on every fold up to n_rounds (or until early stopping).
+    """
+    import xgboost as xgb
+
+    params = {'objective': 'reg:squarederror', 'eval_metric': 'rmse', 'tree_method': 'hist',
+              'max_bin': MAX_BIN, 'nthread': n_threads, **trial['params']}
+
+    for i, (dtrain, dvalidation) in enumerate(matrices):
+        if trial['stopped'][i]:
+            continue
+
+        booster = trial['boosters'][i]
+        rounds_done = booster.num_boosted_rounds() if booster is not None else 0
+        booster = xgb.train(params, dtrain, num_boost_round=n_rounds - rounds_done, xgb_model=booster,
+                            evals=[(dvalidation, 'validation')], early_stopping_rounds=TUNE_EARLY_STOPPING_ROUNDS,
+                            verbose_eval=False)
+
+        trial['boosters'][i] = booster
+        trial['scores'][i] = booster.best_score
+        trial['best_iterations'][i] = booster.best_iteration
+        # Early stopped before using the whole budget, more rounds would not improve it
+        trial['stopped'][i] = booster.best_iteration + TUNE_EARLY_STOPPING_ROUNDS < booster.num_boosted_rounds()
+
+    trial['score'] = float(np.mean(trial['scores']))
+    return trial
+
+
+def tune_district(matrices: list,
+                  y: np.ndarray,
+                  folds: list,
+                  n_trials: int = TUNE_N_TRIALS,
+                  min_rounds: int = TUNE_MIN_ROUNDS,
+                  max_rounds: int = TUNE_MAX_ROUNDS,
+                  reduction_factor: int = 3,
+                  n_parallel: int = TUNE_N_PARALLEL,
+                  seed: int = 42) -> dict:
+    """
+    Searches the hyperparameters of one district with successive halving: all trials get
+    `min_rounds` boosting rounds, the best 1/reduction_factor of them continue with
+    reduction_factor times as many rounds, and so on up to `max_rounds`. Every trial is
+    scored by its mean validation RMSE over the folds, with early stopping.
+
+    The trials of a rung run in parallel threads (XGBoost releases the GIL), which share the
+    quantized fold matrices instead of copying them.
+
+    Args:
+        matrices (list): The fold matrices (see get_fold_matrices).
+        y (np.ndarray): The rental counts of the district.
+        folds (list): The folds of the matrices (see get_validation_folds).
+        n_trials (int): The number of sampled parameter sets.
+        min_rounds (int): The boosting rounds of the first rung.
+        max_rounds (int): The maximal boosting rounds.
+        reduction_factor (int): The factor by which the trials are reduced and the rounds increased per rung.
+        n_parallel (int): The number of trials trained at once, 0 for one per core.
+        seed (int): The seed of the sampled parameter sets.
+
+    Returns:
+        dict: The best parameters (with n_estimators from early stopping), their score and the number of fits.
+    """
+    for (dtrain, dvalidation), (train_end, validation_end) in zip(matrices, folds):
+        dtrain.set_label(y[:train_end])
+        dvalidation.set_label(y[train_end:validation_end])
+
+    n_parallel = n_parallel or os.cpu_count() or 1
+    trials = [{'params': params, 'boosters': [None] * len(matrices), 'scores': [np.inf] * len(matrices),
+               'best_iterations': [0] * len(matrices), 'stopped': [False] * len(matrices), 'score': np.inf}
+              for params in sample_params(n_trials, seed)]
+
+    n_rounds, n_fits = min_rounds, 0
+    with ThreadPoolExecutor(max_workers=n_parallel) as executor:
+        while True:
+            n_threads = max(1, (os.cpu_count() or 1) // min(n_parallel, len(trials)))
+            trials = list(executor.map(lambda trial: _train_trial(trial, matrices, n_rounds, n_threads), trials))
+            n_fits += len(trials) * len(matrices)
+
+            if n_rounds >= max_rounds or len(trials) == 1:
+                break
+
+            trials = sorted(trials, key=lambda trial: trial['score'])[:max(1, len(trials) // reduction_factor)]
+            n_rounds = min(max_rounds, n_rounds * reduction_factor)
+
+    best = min(trials, key=lambda trial: trial['score'])
+    params = {'n_estimators': int(np.mean(best['best_iterations'])) + 1, 'tree_method': 'hist',
+              'max_bin': MAX_BIN, **best['params']}
+
+    return {'params': params, 'score': best['score'], 'n_fits': n_fits}
+
+
+def tune_districts(X: pd.DataFrame, y: pd.DataFrame, **kwargs) -> tuple:
+    """
+    Tunes the hyperparameters of every district (column of y), see tune_district.
+
+    Returns:
+        tuple: The best parameters by district and a DataFrame reporting the validation RMSE,
+            number of fits and duration of every district.
+    """
+    folds = get_validation_folds(len(X))
+    with span('tuning.fold_matrices', rows_in=len(X), n_folds=len(folds)):
+        matrices = get_fold_matrices(X, folds)
+
+    params, report = {}, []
+    for district in y.columns:
+        print(Fore.BLUE + f"\nTuning district {district}..." + Style.RESET_ALL)
+        start, start_cpu = time.perf_counter(), time.process_time()
+
+        result = tune_district(matrices, y[district].to_numpy(dtype=np.float32), folds, **kwargs)
+        params[district] = result['params']
+
+        seconds = time.perf_counter() - start
+        record_span('tuning.district', wall_seconds=seconds, cpu_seconds=time.process_time() - start_cpu,
+                    district=district, n_fits=result['n_fits'])
+        report.append({'district': district, 'rmse': result['score'], 'n_fits': result['n_fits'], 'seconds': seconds})
+        print(f"✅ {district} tuned in {seconds:.1f} s, validation RMSE {result['score']:.2f}")
+
+    return params, pd.DataFrame(report)
@@ -0,0 +1,205 @@
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from bikesharing.params import *
+
+
+class SQLBackend:
+    """
+    Runs queries against the data warehouse holding the `raw_data_mvg` table.
+    Subclasses provide the connection and the dialect specific SQL snippets.
+    """
+
+    def query(self, query: str) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def query_chunks(self, query: str, chunk_size: int):
+        """
+        Yields the result of the query in DataFrames of at most `chunk_size` rows.
+        """
+        raise NotImplementedError
+
+    def table(self, name: str) -> str:
+        return name
+
+    def truncate_to_hour(self, column: str) -> str:
+        raise NotImplementedError
+
+    def extract_year(self, column: str) -> str:
+        raise NotImplementedError
+
+    def timestamp(self, value) -> str:
+        return f"'{pd.Timestamp(value):%Y-%m-%d %H:%M:%S}'"
+
+
+class BigQueryBackend(SQLBackend):
+    def __init__(self, gcp_project: str = GCP_PROJECT, dataset: str = BQ_DATASET):
+        self.gcp_project = gcp_project
+        self.dataset = dataset
+
+    def query(self, query: str) -> pd.DataFrame:
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=self.gcp_project)
+        query_job = client.query(query)
+        result = query_job.result()
+        return result.to_dataframe()
+
+    def query_chunks(self, query: str, chunk_size: int):
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=self.gcp_project)
+        result = client.query(query).result(page_size=chunk_size)
+        yield from result.to_dataframe_iterable()
+
+    def table(self, name: str) -> str:
+        return f'`{self.gcp_project}.{self.dataset}.{name}`'
+
+    def truncate_to_hour(self, column: str) -> str:
+        return f'TIMESTAMP_TRUNC({column}, HOUR)'
+
+    def extract_year(self, column: str) -> str:
+        return f'EXTRACT(YEAR FROM {column})'
+
+    def timestamp(self, value) -> str:
+        return f"TIMESTAMP('{pd.Timestamp(value):%Y-%m-%d %H:%M:%S}')"
+
+
+class SQLiteBackend(SQLBackend):
+    """
+    Local stand-in for the warehouse, STARTTIME is expected as ISO formatted text.
+    """
+
+    def __init__(self, database: str = SQL_DATABASE):
+        self.database = database
+
+    def query(self, query: str) -> pd.DataFrame:
+        # The context manager of a sqlite3 connection only ends the transaction, closing() closes it
+        with closing(sqlite3.connect(self.database)) as connection:
+            return pd.read_sql_query(query, connection)
+
+    def query_chunks(self, query: str, chunk_size: int):
+        with closing(sqlite3.connect(self.database)) as connection:
+            yield from pd.read_sql_query(query, connection, chunksize=chunk_size)
+
+    def truncate_to_hour(self, column: str) -> str:
+        return f"strftime('%Y-%m-%d %H:00:00', {column})"
+
+    def extract_year(self, column: str) -> str:
+        return f"CAST(strftime('%Y', {column}) AS INTEGER)"
+
+
+class DuckDBBackend(SQLBackend):
+    def __init__(self, database: str = SQL_DATABASE):
+        self.database = database
+
+    def query(self, query: str) -> pd.DataFrame:
+        import duckdb
+
+        with duckdb.connect(self.database, read_only=True) as connection:
+            return connection.execute(query).df()
+
+    def query_chunks(self, query: str, chunk_size: int):
+        import duckdb
+
+        with duckdb.connect(self.database, read_only=True) as connection:
+            for batch in connection.execute(query).fetch_record_batch(chunk_size):
+                yield batch.to_pandas()
+
+    def truncate_to_hour(self, column: str) -> str:
+        return f"date_trunc('hour', {column})"
+
+    def extract_year(self, column: str) -> str:
+        return f'year({column})'
+
+    def timestamp(self, value) -> str:
+        return f"TIMESTAMP '{pd.Timestamp(value):%Y-%m-%d %H:%M:%S}'"
+
+
+SQL_BACKENDS = {
+    'bigquery': BigQueryBackend,
+    'sqlite': SQLiteBackend,
+    'duckdb': DuckDBBackend
+}
+
+
+def get_sql_backend(name: str = None, gcp_project: str = None, **kwargs) -> SQLBackend:
+    '''
+        returns the SQL backend with the given name, defaults to SQL_BACKEND;
+        gcp_project only applies to BigQuery and is ignored by the other backends
+    '''
+    name = name or SQL_BACKEND
+
+    if name not in SQL_BACKENDS:
+        raise ValueError(f"Unknown SQL backend '{name}', use one of {list(SQL_BACKENDS)}")
+
+    if name == 'bigquery' and gcp_project is not None:
+        kwargs['gcp_project'] = gcp_project
+
+    return SQL_BACKENDS[name](**kwargs)
+
+
+def build_hourly_location_query(backend: SQLBackend,
+                                start_year: int = START_YEAR,
+                                end_year: int = END_YEAR,
+                                table: str = 'raw_data_mvg',
+                                since=None) -> str:
+    """
+    Builds the query which counts the distinct rentals per hour and start location
+    on the server, instead of loading every single rental.
+
+    Args:
+        backend (SQLBackend): The backend the query is generated for.
+        start_year (int): The first year to load.
+        end_year (int): The last year to load.
+        table (str): The name of the rental table.
+        since: Only the rentals from this time on, e. g. the first hour missing in the processed store.
+
+    Returns:
+        str: The query returning the columns rent_date_hour, STARTLAT, STARTLON and n_rentals.
+    """
+    return f'''
+        SELECT {backend.truncate_to_hour('STARTTIME')} AS rent_date_hour, STARTLAT, STARTLON, COUNT(*) AS n_rentals
+        FROM (
+            SELECT DISTINCT STARTTIME, STARTLAT, STARTLON
+            FROM {backend.table(table)}
+            WHERE {_get_period_condition(backend, start_year, end_year, since)}
+        ) AS rentals
+        GROUP BY 1, 2, 3
+        ORDER BY 1
+    '''
+
+
+def build_rental_query(backend: SQLBackend,
+                       start_year: int = START_YEAR,
+                       end_year: int = END_YEAR,
+                       table: str = 'raw_data_mvg',
+                       since=None) -> str:
+    """
+    Builds the query which loads the single rentals ordered by their start time.
+
+    Args:
+        backend (SQLBackend): The backend the query is generated for.
+        start_year (int): The first year to load.
+        end_year (int): The last year to load.
+        table (str): The name of the rental table.
+        since: Only the rentals from this time on, e. g. the first hour missing in the processed store.
+
+    Returns:
+        str: The query returning the columns STARTTIME, STARTLAT and STARTLON.
+    """
+    return f'''
+        SELECT STARTTIME, STARTLAT, STARTLON
+        FROM {backend.table(table)}
+        WHERE {_get_period_condition(backend, start_year, end_year, since)}
+        ORDER BY STARTTIME
+    '''
+
+
+def _get_period_condition(backend: SQLBackend, start_year: int, end_year: int, since=None) -> str:
+    condition = f"{backend.extract_year('STARTTIME')} BETWEEN {int(start_year)} AND {int(end_year)}"
+    if since is not None:
+        condition += f" AND STARTTIME >= {backend.timestamp(since)}"
+    return condition
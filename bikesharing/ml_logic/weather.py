@@ -0,0 +1,153 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+import requests
+from colorama import Fore, Style
+from requests.adapters import HTTPAdapter
+
+from bikesharing.params import *
+from bikesharing.ml_logic.cache import is_cached, load_cache, save_cache, WEATHER_SCHEMA
+
+
+WEATHER_VARIABLES = ['temperature_2m', 'relativehumidity_2m', 'apparent_temperature','windspeed_10m','precipitation']
+LATITUDE = 48.70
+LONGITUDE = 13.46
+
+# The archive API publishes the weather with a delay of a few days, younger chunks are not cached
+ARCHIVE_DELAY_DAYS = 7
+
+
+def get_weather_chunks(start_date: date, end_date: date, chunk: str = WEATHER_CHUNK) -> list:
+    """
+    Splits the date range into consecutive chunks.
+
+    Args:
+        start_date (date): The first day.
+        end_date (date): The last day.
+        chunk (str): 'month' or 'year'.
+
+    Returns:
+        list: The (start_date, end_date) tuples of the chunks.
+    """
+    if chunk not in ['month', 'year']:
+        raise ValueError(f"Unknown weather chunk '{chunk}', use 'month' or 'year'")
+
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        if chunk == 'year':
+            next_start = date(chunk_start.year + 1, 1, 1)
+        else:
+            next_start = date(chunk_start.year + chunk_start.month // 12, chunk_start.month % 12 + 1, 1)
+        chunks.append((chunk_start, min(next_start - timedelta(days=1), end_date)))
+        chunk_start = next_start
+
+    return chunks
+
+
+def fetch_weather_chunk(session: requests.Session,
+                        start_date: date,
+                        end_date: date,
+                        base_url: str = WEATHER_API_URL,
+                        latitude: float = LATITUDE,
+                        longitude: float = LONGITUDE,
+                        timeout: float = 30,
+                        max_retries: int = 5,
+                        backoff: float = 1.0) -> pd.DataFrame:
+    """
+    Requests the hourly weather of one chunk from the Open Meteo API. Connection errors,
+    timeouts, 429 and 5xx responses are retried with exponential backoff.
+
+    Returns:
+        pd.DataFrame: The hourly weather with 'time' as datetime64.
+    """
+    params = {
+        'latitude': latitude,
+        'longitude': longitude,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'hourly': ','.join(WEATHER_VARIABLES)
+    }
+
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.get(base_url, params=params, timeout=timeout)
+            if response.status_code != 429 and response.status_code < 500:
+                break
+            error = f'HTTP {response.status_code}'
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = repr(e)
+
+        if attempt == max_retries:
+            raise ConnectionError(f'Weather request for {start_date} to {end_date} failed after '
+                                  f'{max_retries + 1} attempts: {error}')
+
+        time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+    weather_data = response.json()
+
+    if 'hourly' not in weather_data:
+        raise ValueError(f'Error while requesting the weather from {start_date} to {end_date} from the API '
+                         f'({response.status_code}): {weather_data.get("reason", weather_data)}. '
+                         f'Please check if the API is still working with the following URL:\n{response.url}')
+
+    weather_df = pd.DataFrame(weather_data['hourly'])
+    weather_df['time'] = pd.to_datetime(weather_df['time'])
+
+    return weather_df
+
+
+def fetch_weather_history(start_date: date,
+                          end_date: date,
+                          chunk_cache_dir: Path = Path(LOCAL_DATA_PATH).joinpath('raw', 'weather_chunks'),
+                          base_url: str = WEATHER_API_URL,
+                          chunk: str = WEATHER_CHUNK,
+                          n_workers: int = WEATHER_N_WORKERS,
+                          latitude: float = LATITUDE,
+                          longitude: float = LONGITUDE) -> pd.DataFrame:
+    """
+    Retrieves the hourly weather from `start_date` to `end_date`. The range is split into
+    chunks which are cached individually, so only missing chunks are requested, concurrently
+    over a pooled session. An interrupted run resumes with the chunks it did not finish.
+
+    Returns:
+        pd.DataFrame: The hourly weather sorted by 'time'.
+    """
+    chunks = get_weather_chunks(start_date, end_date, chunk)
+    cache_paths = {chunk_range: chunk_cache_dir.joinpath(f'{latitude}_{longitude}_{chunk_range[0]}_{chunk_range[1]}.parquet')
+                   for chunk_range in chunks}
+    missing = [chunk_range for chunk_range in chunks if not is_cached(cache_paths[chunk_range])]
+
+    print(Fore.BLUE + f"\nLoad weather_data: {len(chunks) - len(missing)} of {len(chunks)} chunks cached, "
+          f"requesting {len(missing)} from the API..." + Style.RESET_ALL)
+
+    chunk_dfs = {}
+    if missing:
+        with requests.Session() as session:
+            adapter = HTTPAdapter(pool_connections=n_workers, pool_maxsize=n_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            def fetch(chunk_range):
+                chunk_df = fetch_weather_chunk(session, *chunk_range, base_url=base_url,
+                                               latitude=latitude, longitude=longitude)
+                # Only complete chunks are cached, the latest days may still be missing in the archive
+                if chunk_range[1] < date.today() - timedelta(days=ARCHIVE_DELAY_DAYS):
+                    save_cache(chunk_df, cache_paths[chunk_range], schema=WEATHER_SCHEMA)
+                return chunk_range, chunk_df
+
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                chunk_dfs.update(executor.map(fetch, missing))
+
+    for chunk_range in chunks:
+        if chunk_range not in chunk_dfs:
+            chunk_dfs[chunk_range] = load_cache(cache_paths[chunk_range], schema=WEATHER_SCHEMA)
+
+    weather_df = pd.concat([chunk_dfs[chunk_range] for chunk_range in chunks], ignore_index=True)
+    weather_df = weather_df.drop_duplicates(subset='time').sort_values('time').reset_index(drop=True)
+
+    return weather_df
@@ -1,9 +1,17 @@
 import os
 import numpy as np
 
+
+def _get_env(name: str, cast=str, default=None):
+    # Missing variables are None instead of failing the import, so that e. g. a prediction
+    # worker does not need the training-only variables
+    value = os.environ.get(name)
+    return cast(value) if value not in (None, "") else default
+
+
 #### preprocessing params ####
-START_YEAR = int(os.environ.get("START_YEAR"))
-END_YEAR = int(os.environ.get("END_YEAR"))
+START_YEAR = _get_env("START_YEAR", int)
+END_YEAR = _get_env("END_YEAR", int)
 
 ############ GCP ##############
 GCP_PROJECT = os.environ.get("GCP_PROJECT")
@@ -11,12 +19,102 @@ BQ_DATASET = os.environ.get("BQ_DATASET")
 BQ_REGION = os.environ.get("BQ_REGION")
 BUCKET_NAME = os.environ.get("BUCKET_NAME")
 
+########### WAREHOUSE ###########
+# 'bigquery', or 'sqlite'/'duckdb' with the local database file in SQL_DATABASE
+SQL_BACKEND = os.environ.get("SQL_BACKEND", "bigquery")
+SQL_DATABASE = os.environ.get("SQL_DATABASE")
+# 'rows' loads every rental, 'aggregated' counts the rentals per hour and location in the warehouse
+RAW_DATA_MODE = os.environ.get("RAW_DATA_MODE", "rows")
+# Rows per chunk of the streaming preprocessing, which bounds its memory; 0 loads the raw data at once
+PREPROCESS_CHUNK_SIZE = int(os.environ.get("PREPROCESS_CHUNK_SIZE", "0"))
+# 'full' rebuilds the processed data from the raw history, 'append' only processes the hours after the last
+# one of the monthly partitioned processed store
+PREPROCESS_MODE = os.environ.get("PREPROCESS_MODE", "full")
+# Processes of the year-partitioned preprocessing (takes precedence over PREPROCESS_CHUNK_SIZE); 1 runs the
+# single-process pipeline
+PREPROCESS_N_WORKERS = int(os.environ.get("PREPROCESS_N_WORKERS", "1"))
+
 ############ MODEL ##############
-FOLD_LENGTH = int(os.environ.get("FOLD_LENGTH"))
-FOLD_STRIDE = int(os.environ.get("FOLD_STRIDE"))
-TRAIN_TEST_RATIO = float(os.environ.get("TRAIN_TEST_RATIO"))
-INPUT_LENGTH = int(os.environ.get("INPUT_LENGTH"))
+FOLD_LENGTH = _get_env("FOLD_LENGTH", int)
+FOLD_STRIDE = _get_env("FOLD_STRIDE", int)
+TRAIN_TEST_RATIO = _get_env("TRAIN_TEST_RATIO", float)
+INPUT_LENGTH = _get_env("INPUT_LENGTH", int)
+
+# Number of processes fitting district models in parallel (1 trains in-process) and XGBoost threads
+# of each (0 splits the cores evenly between the processes)
+TRAIN_N_WORKERS = int(os.environ.get("TRAIN_N_WORKERS", "1"))
+TRAIN_THREADS_PER_WORKER = int(os.environ.get("TRAIN_THREADS_PER_WORKER", "0"))
+
+# Number of published training runs whose models are kept by the registry garbage collection
+MODEL_RETENTION_RUNS = int(os.environ.get("MODEL_RETENTION_RUNS", "5"))
+
+# Serialization of published models: 'ubj' (XGBoost binary per district), 'packed' (all districts
+# of a run in one file with an offset table) or 'joblib' (pickles)
+MODEL_FORMAT = os.environ.get("MODEL_FORMAT", "ubj")
+
+# Maximum number of district models kept in memory by the model pool
+MODEL_POOL_SIZE = int(os.environ.get("MODEL_POOL_SIZE", "64"))
+
+# 'xgboost' predicts with every district model, 'compiled' evaluates the trees of all districts at once in NumPy
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "xgboost")
 
 ########### CONSTANTS ###########
-LOCAL_DATA_PATH = os.path.join(os.path.expanduser('~'), ".lewagon", "bikesharing", "data")
-LOCAL_REGISTRY_PATH =  os.path.join(os.path.expanduser('~'), "code", "shoefer987", "bike_sharing_demand_api" , "data")
+LOCAL_DATA_PATH = os.environ.get("LOCAL_DATA_PATH", os.path.join(os.path.expanduser('~'), ".lewagon", "bikesharing", "data"))
+LOCAL_REGISTRY_PATH = os.environ.get("LOCAL_REGISTRY_PATH", os.path.join(os.path.expanduser('~'), "code", "shoefer987", "bike_sharing_demand_api" , "data"))
+
+############ WEATHER ############
+WEATHER_API_URL = os.environ.get("WEATHER_API_URL", "https://archive-api.open-meteo.com/v1/archive")
+# The historical weather is fetched in chunks of a 'month' or a 'year', by WEATHER_N_WORKERS concurrent requests
+WEATHER_CHUNK = os.environ.get("WEATHER_CHUNK", "month")
+WEATHER_N_WORKERS = int(os.environ.get("WEATHER_N_WORKERS", "4"))
+# Forecast used for predictions, cached for FORECAST_TTL_SECONDS
+FORECAST_API_URL = os.environ.get("FORECAST_API_URL", "https://api.open-meteo.com/v1/forecast")
+FORECAST_TTL_SECONDS = int(os.environ.get("FORECAST_TTL_SECONDS", "3600"))
+
+############ CACHE ##############
+# Format of the local data cache: 'parquet', 'arrow' (Feather V2) or 'csv'
+CACHE_FORMAT = os.environ.get("CACHE_FORMAT", "parquet")
+
+######## INSTRUMENTATION ########
+# Spans with durations, memory and row counts of every pipeline step, logged as JSON when enabled
+INSTRUMENTATION = os.environ.get("INSTRUMENTATION", "off").lower() in ("1", "on", "true")
+# Optional Prometheus textfile (for the node exporter textfile collector) and JSON trace of the spans
+INSTRUMENTATION_PROMETHEUS_PATH = os.environ.get("INSTRUMENTATION_PROMETHEUS_PATH")
+INSTRUMENTATION_TRACE_PATH = os.environ.get("INSTRUMENTATION_TRACE_PATH")
+# The files are written at most every INSTRUMENTATION_FLUSH_SECONDS (and at exit). Up to INSTRUMENTATION_TRACE_BUFFER
+# trace events are buffered in between (the oldest are dropped beyond), and the trace is appended to and rotated
+# to {INSTRUMENTATION_TRACE_PATH}.1 beyond INSTRUMENTATION_TRACE_MAX_MB
+INSTRUMENTATION_FLUSH_SECONDS = float(os.environ.get("INSTRUMENTATION_FLUSH_SECONDS", "5"))
+INSTRUMENTATION_TRACE_BUFFER = int(os.environ.get("INSTRUMENTATION_TRACE_BUFFER", "10000"))
+INSTRUMENTATION_TRACE_MAX_MB = float(os.environ.get("INSTRUMENTATION_TRACE_MAX_MB", "100"))
+
+########### SERVICE #############
+# Prediction requests arriving within PREDICT_BATCH_WINDOW_MS are predicted together, in batches of
+# at most PREDICT_MAX_BATCH_SIZE requests, on PREDICT_N_THREADS inference threads
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get("PREDICT_BATCH_WINDOW_MS", "5"))
+PREDICT_MAX_BATCH_SIZE = int(os.environ.get("PREDICT_MAX_BATCH_SIZE", "64"))
+PREDICT_N_THREADS = int(os.environ.get("PREDICT_N_THREADS", "1"))
+
+############ TUNING #############
+# Successive halving over TUNE_N_TRIALS sampled parameter sets, from TUNE_MIN_ROUNDS to TUNE_MAX_ROUNDS
+# boosting rounds, validated on the last TUNE_N_FOLDS periods of TUNE_VALIDATION_HOURS hours
+TUNE_N_TRIALS = int(os.environ.get("TUNE_N_TRIALS", "27"))
+TUNE_MIN_ROUNDS = int(os.environ.get("TUNE_MIN_ROUNDS", "50"))
+TUNE_MAX_ROUNDS = int(os.environ.get("TUNE_MAX_ROUNDS", "1000"))
+TUNE_EARLY_STOPPING_ROUNDS = int(os.environ.get("TUNE_EARLY_STOPPING_ROUNDS", "20"))
+TUNE_N_FOLDS = int(os.environ.get("TUNE_N_FOLDS", "3"))
+TUNE_VALIDATION_HOURS = int(os.environ.get("TUNE_VALIDATION_HOURS", "1344"))
+# Trials trained at once, 0 for one per core
+TUNE_N_PARALLEL = int(os.environ.get("TUNE_N_PARALLEL", "0"))
+# Version of the tuned parameters used by train(), 'latest' or 'table' for the hand-picked parameters
+MODEL_PARAMS_VERSION = os.environ.get("MODEL_PARAMS_VERSION", "latest")
+
+###### INCREMENTAL TRAINING #####
+# 'continue' adds INCREMENTAL_ROUNDS boosting rounds on the new hours, 'refresh' refits the leaf values of the trees
+INCREMENTAL_MODE = os.environ.get("INCREMENTAL_MODE", "continue")
+INCREMENTAL_ROUNDS = int(os.environ.get("INCREMENTAL_ROUNDS", "20"))
+# The last INCREMENTAL_VALIDATION_HOURS new hours validate the update against the INCREMENTAL_GUARDRAIL
+# reference ('retrain', 'previous' or 'off'), which it may exceed by INCREMENTAL_TOLERANCE (relative RMSE)
+INCREMENTAL_VALIDATION_HOURS = int(os.environ.get("INCREMENTAL_VALIDATION_HOURS", "168"))
+INCREMENTAL_GUARDRAIL = os.environ.get("INCREMENTAL_GUARDRAIL", "retrain")
+INCREMENTAL_TOLERANCE = float(os.environ.get("INCREMENTAL_TOLERANCE", "0.05"))
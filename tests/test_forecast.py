@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bikesharing.ml_logic.forecast import ForecastProvider
+
+
+DAY = date(2024, 6, 1)
+
+
+class _StubForecastHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.n_requests += 1
+        time.sleep(server.delay)
+
+        if server.fail:
+            status, body = 400, {'error': True, 'reason': 'stub failure'}
+        else:
+            times = [f'{DAY.isoformat()}T{hour:02d}:00' for hour in range(24)]
+            status, body = 200, {'hourly': {'time': times, 'temperature_2m': [15.0] * 24}}
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubForecastHandler)
+    server.lock = threading.Lock()
+    server.n_requests = 0
+    server.delay = 0.3
+    server.fail = False
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _get_provider(server, tmp_path, ttl: float = 60) -> ForecastProvider:
+    return ForecastProvider(base_url=f'http://127.0.0.1:{server.server_address[1]}/forecast', ttl=ttl,
+                            cache_dir=tmp_path, latitude=48.14, longitude=11.58)
+
+
+def test_concurrent_requests_share_one_upstream_call(stub_server, tmp_path):
+    provider = _get_provider(stub_server, tmp_path)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        forecasts = list(executor.map(lambda _: provider.get_forecast(DAY), range(8)))
+
+    assert stub_server.n_requests == 1
+    assert all(len(forecast) == 24 for forecast in forecasts)
+
+
+def test_forecast_is_refreshed_after_the_ttl(stub_server, tmp_path):
+    stub_server.delay = 0
+    provider = _get_provider(stub_server, tmp_path, ttl=0.5)
+
+    provider.get_forecast(DAY)
+    provider.get_forecast(DAY)
+    assert stub_server.n_requests == 1
+
+    time.sleep(0.6)
+    provider.get_forecast(DAY)
+    assert stub_server.n_requests == 2
+
+
+def test_upstream_error_reaches_every_waiter(stub_server, tmp_path):
+    stub_server.fail = True
+    provider = _get_provider(stub_server, tmp_path)
+
+    def get_error(_):
+        try:
+            provider.get_forecast(DAY)
+        except ValueError as error:
+            return error
+        return None
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        errors = list(executor.map(get_error, range(8)))
+
+    assert stub_server.n_requests == 1
+    assert all(error is not None and 'stub failure' in str(error) for error in errors)
+    # Nothing was cached, the next request goes upstream again
+    assert not provider._inflight
+    with pytest.raises(ValueError):
+        provider.get_forecast(DAY)
+    assert stub_server.n_requests == 2
+
+
+def test_files_of_past_forecast_hours_are_removed(stub_server, tmp_path):
+    stub_server.delay = 0
+    provider = _get_provider(stub_server, tmp_path)
+    past_path = tmp_path.joinpath(f'48.14_11.58_{DAY.isoformat()}_2024-05-31T23.json')
+    past_path.write_text(json.dumps({'fetched_at': time.time(), 'hourly': {}}))
+
+    provider.get_forecast(DAY)
+
+    key = provider._get_key(DAY, 48.14, 11.58)
+    assert not past_path.exists()
+    assert [path.name for path in tmp_path.glob('*.json')] == [provider._get_cache_path(key).name]
@@ -0,0 +1,8 @@
+from bikesharing.benchmarks.import_time import FORBIDDEN_MODULES, measure_import
+
+
+def test_predict_entry_point_does_not_load_training_dependencies():
+    # A fresh interpreter, the modules imported by the other tests do not count
+    loaded = set(measure_import('bikesharing.interface.predict')['modules'])
+
+    assert [name for name in FORBIDDEN_MODULES if name in loaded] == []
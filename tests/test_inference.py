@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from xgboost import XGBRegressor
+
+from bikesharing.ml_logic.inference import CompiledForest, predict_districts
+
+
+FEATURES = ['a', 'b', 'c', 'd']
+
+
+def _get_data(n_rows: int, seed: int, nan_share: float = 0.0) -> tuple:
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.random((n_rows, len(FEATURES))), columns=FEATURES)
+    y = (10 * X['a'] + 5 * X['b'] * X['c'] + rng.random(n_rows)).to_numpy()
+    if nan_share:
+        X = X.mask(rng.random(X.shape) < nan_share)
+    return X, y
+
+
+def _fit(X: pd.DataFrame, y: np.ndarray, **hyper_params) -> XGBRegressor:
+    model = XGBRegressor(objective='reg:squarederror', **hyper_params)
+    model.fit(X, y)
+    return model
+
+
+def _assert_same_predictions(models: dict, X: pd.DataFrame) -> None:
+    expected = np.stack([model.predict(X) for model in models.values()])
+
+    assert np.allclose(CompiledForest(models).predict(X), expected, rtol=1e-5, atol=1e-4)
+    assert np.allclose(predict_districts(models, X, engine='compiled'), expected, rtol=1e-5, atol=1e-4)
+    assert np.allclose(predict_districts(models, X, engine='xgboost'), expected)
+
+
+def test_compiled_forest_matches_xgboost():
+    X, y = _get_data(500, seed=0)
+    models = {'Laim': _fit(X, y, n_estimators=30, max_depth=3),
+              'Maxvorstadt': _fit(X, 2 * y, n_estimators=20, max_depth=3)}
+
+    _assert_same_predictions(models, _get_data(300, seed=1)[0])
+
+
+def test_missing_values_follow_the_default_direction():
+    X, y = _get_data(500, seed=0, nan_share=0.2)
+    models = {'Laim': _fit(X, y, n_estimators=30, max_depth=4)}
+
+    X_new = _get_data(300, seed=1, nan_share=0.3)[0]
+    # Rows without any value end up in the default leaves of every tree
+    X_new.iloc[:10] = np.nan
+
+    _assert_same_predictions(models, X_new)
+
+
+def test_only_the_trees_up_to_the_best_iteration_are_used():
+    X, y = _get_data(500, seed=0)
+    # The validation target is half the training target, the boosting overshoots it after a few rounds
+    X_validation, y_validation = _get_data(200, seed=2)
+    y_validation = 0.5 * y_validation
+    model = XGBRegressor(objective='reg:squarederror', n_estimators=100, max_depth=3, early_stopping_rounds=5)
+    model.fit(X, y, eval_set=[(X_validation, y_validation)], verbose=False)
+
+    assert 0 < model.best_iteration < model.get_booster().num_boosted_rounds() - 1
+    _assert_same_predictions({'Laim': model}, _get_data(300, seed=1)[0])
+
+
+@pytest.mark.parametrize('max_depths', [(1, 6), (6, 1, 3)])
+def test_districts_with_different_tree_depths(max_depths):
+    X, y = _get_data(500, seed=0, nan_share=0.1)
+    models = {f'district_{i}': _fit(X, (i + 1) * y, n_estimators=15, max_depth=max_depth)
+              for i, max_depth in enumerate(max_depths)}
+
+    forest = CompiledForest(models)
+    assert forest.max_depth == max(max_depths)
+    _assert_same_predictions(models, _get_data(300, seed=1, nan_share=0.1)[0])
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from shapely.geometry import Polygon
+
+from bikesharing.ml_logic.preprocessor import count_rentals_by_hour
+
+
+POLYGONS = {
+    'East': Polygon([(11.6, 48.1), (11.7, 48.1), (11.7, 48.2), (11.6, 48.2)]),
+    'West': Polygon([(11.5, 48.1), (11.6, 48.1), (11.6, 48.2), (11.5, 48.2)]),
+}
+
+
+def test_count_rentals_by_hour_drops_missing_start_times():
+    df = pd.DataFrame({
+        'STARTTIME': ['2023-05-01 08:10', 'not a time', '2023-05-01 08:50', '2023-05-01 10:05'],
+        'STARTLAT': [48.15, 48.15, 48.15, 48.15],
+        'STARTLON': [11.65, 11.55, 11.55, 11.65],
+    })
+    df['STARTTIME'] = pd.to_datetime(df['STARTTIME'], errors='coerce')
+    assert df['STARTTIME'].isna().sum() == 1
+
+    counts_df = count_rentals_by_hour(df, POLYGONS)
+
+    assert counts_df['rent_date_hour'].tolist() == [pd.Timestamp('2023-05-01 08:00'), pd.Timestamp('2023-05-01 10:00')]
+    assert counts_df['East'].tolist() == [1, 1]
+    assert counts_df['West'].tolist() == [1, 0]
+    assert int(np.sum(counts_df[['East', 'West']].to_numpy())) == 3
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Polygon
+
+import bikesharing.interface.main as main
+from bikesharing.ml_logic.feature_pipeline import FeaturePipeline
+from bikesharing.ml_logic.processed_store import append_processed_data, get_last_processed_hour, \
+    load_processed_data, save_store_pipeline
+
+
+POLYGONS = {
+    'Laim': Polygon([(11.50, 48.10), (11.55, 48.10), (11.55, 48.15), (11.50, 48.15)]),
+    'Maxvorstadt': Polygon([(11.55, 48.10), (11.60, 48.10), (11.60, 48.15), (11.55, 48.15)]),
+}
+LAIM = (48.12, 11.52)
+
+
+def _get_weather(start: str, end: str) -> pd.DataFrame:
+    hours = pd.date_range(start, end, freq='H')
+    return pd.DataFrame({'time': hours, 'temperature_2m': 5.0, 'relativehumidity_2m': 80.0,
+                         'apparent_temperature': 3.0, 'windspeed_10m': 10.0, 'precipitation': 0.0})
+
+
+def _get_rentals(times: list) -> pd.DataFrame:
+    return pd.DataFrame({'STARTTIME': pd.to_datetime(times), 'STARTLAT': LAIM[0], 'STARTLON': LAIM[1]})
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # The warehouse and the weather archive, filled by the tests
+    sources = {'rentals': _get_rentals([]), 'weather': _get_weather('2023-01-01', '2023-01-03 23:00')}
+
+    monkeypatch.setattr(main, 'START_YEAR', 2023)
+    monkeypatch.setattr(main, 'END_YEAR', 2023)
+    monkeypatch.setattr(main, 'RAW_DATA_MODE', 'rows')
+    monkeypatch.setattr(main, 'get_store_path', lambda start_year: tmp_path)
+    monkeypatch.setattr(main, 'get_polygons', lambda: POLYGONS)
+    monkeypatch.setattr(main, 'get_sql_backend', lambda: None)
+    # The "query" is the first hour to load
+    monkeypatch.setattr(main, 'build_rental_query', lambda backend, start_year, end_year, since: since)
+    monkeypatch.setattr(main, 'get_new_raw_data', lambda gcp_project, since, backend:
+                        sources['rentals'][sources['rentals']['STARTTIME'] >= since].reset_index(drop=True))
+    monkeypatch.setattr(main, 'get_new_weather_data', lambda since, end_date:
+                        sources['weather'][sources['weather']['time'] >= since].reset_index(drop=True))
+
+    # A store processed up to the end of 2023-01-01
+    pipeline = FeaturePipeline(main.FEATURES, np.ones(len(main.FEATURES)), np.zeros(len(main.FEATURES)))
+    save_store_pipeline(pipeline, tmp_path)
+    first_day = pd.DataFrame({'rent_date_hour': pd.date_range('2023-01-01', periods=24, freq='H')})
+    for column in [*main.FEATURES, *main.DISTRICTS]:
+        first_day[column] = 0.0
+    append_processed_data(first_day, tmp_path)
+
+    return tmp_path, sources
+
+
+def test_hours_without_rentals_loaded_are_not_appended(store):
+    store_path, sources = store
+    # The weather runs until 2023-01-03, the rental dump only until 2023-01-02 05:xx
+    sources['rentals'] = _get_rentals(['2023-01-02 01:10', '2023-01-02 05:40'])
+
+    main.preprocess_append()
+
+    assert get_last_processed_hour(store_path) == pd.Timestamp('2023-01-02 05:00')
+
+
+def test_later_rental_dump_fills_in_the_hours(store):
+    store_path, sources = store
+    sources['rentals'] = _get_rentals(['2023-01-02 01:10', '2023-01-02 05:40'])
+    main.preprocess_append()
+
+    # The next dump covers the rest of the weather
+    sources['rentals'] = _get_rentals(['2023-01-02 01:10', '2023-01-02 05:40', '2023-01-03 12:30',
+                                       '2023-01-03 23:05'])
+    main.preprocess_append()
+
+    processed_df = load_processed_data(store_path).set_index('rent_date_hour')
+
+    assert processed_df.index.is_unique
+    assert processed_df.index.equals(pd.date_range('2023-01-01', '2023-01-03 23:00', freq='H'))
+    assert processed_df.loc['2023-01-03 12:00', 'Laim'] == 1
+    assert processed_df.loc['2023-01-02 05:00', 'Laim'] == 1
+    assert processed_df['Laim'].sum() == 4
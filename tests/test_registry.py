@@ -0,0 +1,26 @@
+import hashlib
+
+from bikesharing.ml_logic import registry
+
+
+def test_legacy_models_are_registered_once(tmp_path, monkeypatch):
+    model_directory = tmp_path / 'models'
+    model_directory.mkdir()
+    monkeypatch.setattr(registry, 'MODEL_DIRECTORY', str(model_directory))
+    for name in ['Laim_20230101-120000.pkl', 'Laim_20230601-120000.pkl', 'Maxvorstadt_20230101-120000.pkl']:
+        (model_directory / name).write_bytes(name.encode())
+
+    manifest_path = str(tmp_path / 'registry.sqlite')
+    connection = registry._connect(manifest_path)
+    latest = registry.get_latest_models(connection)
+    connection.close()
+
+    assert sorted(latest) == ['Laim', 'Maxvorstadt']
+    assert latest['Laim']['version'] == '20230601-120000'
+    assert latest['Laim']['sha256'] == hashlib.sha256(b'Laim_20230601-120000.pkl').hexdigest()
+
+    # The model directory is not scanned again by later connections
+    (model_directory / 'Pasing_20230101-120000.pkl').write_bytes(b'')
+    connection = registry._connect(manifest_path)
+    assert sorted(registry.get_latest_models(connection)) == ['Laim', 'Maxvorstadt']
+    connection.close()
@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from xgboost import XGBRegressor
+
+from bikesharing.ml_logic.registry import _load_model_file
+from bikesharing.ml_logic.training import update_district_model
+
+
+HYPER_PARAMS = {'n_estimators': 10, 'max_depth': 2, 'learning_rate': 0.05}
+
+
+def _get_data(n_rows: int, seed: int) -> tuple:
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.random((n_rows, 3)), columns=['a', 'b', 'c'])
+    y = (10 * X['a'] + 5 * X['b'] + rng.random(n_rows)).to_numpy()
+    return X, y
+
+
+def _get_ubj_model(tmp_path) -> XGBRegressor:
+    X, y = _get_data(200, seed=0)
+    model = XGBRegressor(objective='reg:squarederror', **HYPER_PARAMS)
+    model.fit(X, y)
+
+    path = str(tmp_path / 'model.ubj')
+    model.save_model(path)
+    return _load_model_file(path)
+
+
+def _get_tree_param(model: XGBRegressor, name: str) -> float:
+    config = json.loads(model.get_booster().save_config())
+    return float(config['learner']['gradient_booster']['tree_train_param'][name])
+
+
+def test_update_after_ubj_round_trip_uses_district_params(tmp_path):
+    model = _get_ubj_model(tmp_path)
+    # The UBJ format does not restore the sklearn hyperparameters
+    assert model.get_params()['max_depth'] is None
+
+    X_new, y_new = _get_data(100, seed=1)
+    updated = update_district_model(model, X_new, y_new, HYPER_PARAMS, mode='continue', n_rounds=5)
+
+    assert _get_tree_param(updated, 'max_depth') == 2
+    assert _get_tree_param(updated, 'learning_rate') == pytest.approx(0.05)
+    assert updated.get_booster().num_boosted_rounds() == 15
+    # The loaded model is left unchanged
+    assert model.get_booster().num_boosted_rounds() == 10
+
+
+def test_refresh_keeps_trees_and_updates_leaves(tmp_path):
+    model = _get_ubj_model(tmp_path)
+
+    X_new, y_new = _get_data(100, seed=1)
+    updated = update_district_model(model, X_new, 2 * y_new, HYPER_PARAMS, mode='refresh')
+
+    assert updated.get_booster().num_boosted_rounds() == 10
+    assert _get_tree_param(updated, 'max_depth') == 2
+    assert not np.allclose(updated.predict(X_new), model.predict(X_new))
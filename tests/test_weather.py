@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+import requests
+
+from bikesharing.ml_logic.weather import WEATHER_VARIABLES, fetch_weather_chunk, fetch_weather_history
+
+
+class _StubArchiveHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)
+        start_date, end_date = query['start_date'][0], query['end_date'][0]
+        with server.lock:
+            server.requests.append((start_date, end_date))
+            # The scripted failures are answered first, in order
+            failure = server.failures.pop(0) if server.failures else None
+
+        if failure == 'timeout':
+            # No response before the timeout of the client
+            time.sleep(server.timeout_delay)
+            return
+
+        if failure is not None:
+            status, body = failure, {'error': True, 'reason': f'stub status {failure}'}
+        else:
+            hours = pd.date_range(start_date, datetime.fromisoformat(end_date) + timedelta(hours=23), freq='H')
+            hourly = {'time': list(hours.strftime('%Y-%m-%dT%H:%M'))}
+            hourly.update({variable: [1.0] * len(hours) for variable in WEATHER_VARIABLES})
+            status, body = 200, {'hourly': hourly}
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubArchiveHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.failures = []
+    server.timeout_delay = 0.5
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _get_url(server) -> str:
+    return f'http://127.0.0.1:{server.server_address[1]}/archive'
+
+
+def _fetch_history(server, tmp_path, start_date: date, end_date: date) -> pd.DataFrame:
+    return fetch_weather_history(start_date, end_date, chunk_cache_dir=tmp_path, base_url=_get_url(server),
+                                 chunk='month', n_workers=2)
+
+
+def _fetch_chunk(server, **kwargs) -> pd.DataFrame:
+    with requests.Session() as session:
+        return fetch_weather_chunk(session, date(2023, 1, 1), date(2023, 1, 2), base_url=_get_url(server),
+                                   backoff=0.01, **kwargs)
+
+
+def test_history_is_requested_in_chunks(stub_server, tmp_path):
+    weather_df = _fetch_history(stub_server, tmp_path, date(2023, 1, 15), date(2023, 3, 10))
+
+    assert sorted(stub_server.requests) == [('2023-01-15', '2023-01-31'), ('2023-02-01', '2023-02-28'),
+                                            ('2023-03-01', '2023-03-10')]
+    assert weather_df['time'].equals(pd.Series(pd.date_range('2023-01-15', '2023-03-10 23:00', freq='H'),
+                                               name='time'))
+    assert list(weather_df.columns) == ['time', *WEATHER_VARIABLES]
+
+
+def test_only_missing_chunks_are_requested(stub_server, tmp_path):
+    _fetch_history(stub_server, tmp_path, date(2023, 1, 1), date(2023, 2, 28))
+    stub_server.requests.clear()
+
+    weather_df = _fetch_history(stub_server, tmp_path, date(2023, 1, 1), date(2023, 3, 31))
+
+    assert stub_server.requests == [('2023-03-01', '2023-03-31')]
+    assert len(weather_df) == (31 + 28 + 31) * 24
+    assert weather_df['time'].is_unique and weather_df['time'].is_monotonic_increasing
+
+
+@pytest.mark.parametrize('failure', [500, 503, 429, 'timeout'])
+def test_transient_errors_are_retried(stub_server, failure):
+    stub_server.failures = [failure, failure]
+
+    weather_df = _fetch_chunk(stub_server, timeout=0.2)
+
+    assert len(stub_server.requests) == 3
+    assert len(weather_df) == 48
+
+
+def test_connection_error_after_the_last_retry(stub_server):
+    stub_server.failures = [503] * 3
+
+    with pytest.raises(ConnectionError, match='after 3 attempts: HTTP 503'):
+        _fetch_chunk(stub_server, max_retries=2)
+    assert len(stub_server.requests) == 3
+
+
+def test_response_without_hourly_weather_is_not_retried(stub_server):
+    stub_server.failures = [400]
+
+    with pytest.raises(ValueError, match='stub status 400'):
+        _fetch_chunk(stub_server)
+    assert len(stub_server.requests) == 1